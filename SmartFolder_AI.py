@@ -1,13 +1,24 @@
 import streamlit as st
 import os
-import hashlib
-import shutil
+import re
 import datetime
-from pathlib import Path
-import imaplib
-import email
+import tempfile
 import pandas as pd
 import altair as alt
+from smartfolder import config
+from smartfolder.index import count_hashes, ensure_log
+from smartfolder.logstore import (
+    count_rows, frame_dataset, log_filter, open_dataset, read_rows,
+    split_source, write_csv
+)
+from smartfolder.rollups import daily_from_log, load_daily, roll_up, totals
+from smartfolder.rules import compile_rules
+from smartfolder.senders import search_senders
+from smartfolder.settings import (
+    NAMING_CONVENTIONS, load_settings, save_settings
+)
+from smartfolder.organizer import ingest_uploads
+from smartfolder.sync import is_running, read_status, start_run
 st.set_page_config(
     page_title="SmartFolder AI",
     page_icon="📂",
@@ -52,201 +63,43 @@ if not EMAIL or not APP_PASSWORD:
     st.error("Please make sure your secrets are properly configured")
     st.stop()
 
-
-# === CONFIGURATION ===
-DOWNLOADS_DIR = str(Path.home() / "Downloads")
-BASE_DIR = os.path.join(DOWNLOADS_DIR, "EmailDownloads")
-LOG_FILE = os.path.join(BASE_DIR, "download_log.txt")
-
-FILE_CATEGORIES = {
-    ".pdf": "PDFs",
-    ".docx": "WordDocs",
-    ".doc": "WordDocs",
-    ".xlsx": "Excels",
-    ".xls": "Excels",
-    ".pptx": "PowerPoints",
-    ".ppt": "PowerPoints"
-}
-
-
-# === HELPERS ===
-def clean(text):
-    return text.replace("/", "_").replace("\\", "_")
-
-
-def file_hash(content):
-    return hashlib.md5(content).hexdigest()
-
-
-def get_category_folder(extension):
-    return FILE_CATEGORIES.get(extension.lower(), "Others")
-
-
-def ensure_log():
-    os.makedirs(BASE_DIR, exist_ok=True)
-    if not os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "w", encoding="utf-8"):
-            pass
+config.configure(st.secrets)
 
 
-def has_been_downloaded(file_hash_value):
-    with open(LOG_FILE, "r") as f:
-        return file_hash_value in f.read()
+def start_sync(**options):
+    """Start a background sync (see smartfolder.sync.start_run)."""
+    if not start_run(**options):
+        st.warning("A sync is already running; try again when it finishes.")
 
 
-def log_download(file_hash_value, filename, source="Email", email_from=None):
-    """Log a processed file with timestamp, source, and email information."""
-    ensure_log()
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    source_info = f"{source} ({email_from})" if email_from else source
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{timestamp}\t{file_hash_value}\t{filename}\t{source_info}\n")
-
-
-# === EMAIL HANDLING ===
-def connect_to_gmail():
-    mail = imaplib.IMAP4_SSL("imap.gmail.com")
-    mail.login(EMAIL, APP_PASSWORD)
-    mail.select("inbox")
-    return mail
-
-
-def fetch_attachments():
-    ensure_log()
-    attachments = []
-    try:
-        mail = connect_to_gmail()
-        date = (datetime.date.today() - 
-                datetime.timedelta(days=1)).strftime("%d-%b-%Y")
-        status, messages = mail.search(None, f'(SINCE "{date}")')
-        email_ids = messages[0].split()
-
-        for email_id in email_ids:
-            try:
-                status, data = mail.fetch(email_id, "(RFC822)")
-                if not data or not data[0]:
-                    continue
-                    
-                raw_email = data[0][1]
-                if not raw_email:
-                    continue
-                    
-                msg = email.message_from_bytes(raw_email)
-                if not msg:
-                    continue
-
-                email_from = msg.get("From", "Unknown")
-                
-                for part in msg.walk():
-                    if part.get_content_maintype() == "multipart":
-                        continue
-                    if part.get("Content-Disposition") is None:
-                        continue
-                        
-                    filename = part.get_filename()
-                    if not filename:
-                        continue
-                        
-                    try:
-                        file_data = part.get_payload(decode=True)
-                        if file_data:
-                            attachments.append(
-                                (filename, file_data, email_from)
-                            )
-                    except Exception as e:
-                        st.warning(
-                            f"Could not decode attachment {filename}: {str(e)}"
-                        )
-                        continue
-                        
-            except Exception as e:
-                st.warning(f"Error processing email {email_id}: {str(e)}")
-                continue
-                
-        mail.logout()
-    except Exception as e:
-        st.error(f"Email fetch failed: {str(e)}")
-    return attachments
-
-
-def save_attachments(attachments):
-    saved_files = []
-    for filename, content, email_from in attachments:
-        f_hash = file_hash(content)
-        if has_been_downloaded(f_hash):
-            continue
-        ext = os.path.splitext(filename)[1].lower()
-        category = get_category_folder(ext)
-        folder_path = os.path.join(BASE_DIR, category)
-        os.makedirs(folder_path, exist_ok=True)
-        filepath = os.path.join(folder_path, clean(filename))
-        with open(filepath, "wb") as f:
-            f.write(content)
-        log_download(f_hash, filename, source="Email", email_from=email_from)
-        saved_files.append(filepath)
-    return saved_files
-
-
-def move_existing_files():
-    global DOWNLOADS_DIR
-    moved_files = []
-    errors = []
-    
-    try:
-        # Ensure base directory exists
-        os.makedirs(BASE_DIR, exist_ok=True)
-        
-        current_dir = DOWNLOADS_DIR  # Store current directory to scan
-        
-        for filename in os.listdir(current_dir):
-            try:
-                full_path = os.path.join(current_dir, filename)
-                if os.path.isfile(full_path):
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in FILE_CATEGORIES:
-                        try:
-                            # Read file and compute hash
-                            with open(full_path, "rb") as f:
-                                content = f.read()
-                                f_hash = file_hash(content)
-                            
-                            # Create category folder
-                            category = get_category_folder(ext)
-                            dest_folder = os.path.join(BASE_DIR, category)
-                            os.makedirs(dest_folder, exist_ok=True)
-                            
-                            # Move file
-                            dest_path = os.path.join(
-                                dest_folder, clean(filename)
-                            )
-                            if not os.path.exists(dest_path):
-                                shutil.move(full_path, dest_path)
-                                log_download(
-                                    f_hash, filename, source="Downloads"
-                                )
-                                moved_files.append(dest_path)
-                            
-                        except (IOError, OSError) as e:
-                            errors.append(
-                                f"Error processing {filename}: {str(e)}"
-                            )
-                            continue
-                            
-            except Exception as e:
-                errors.append(f"Error with file {filename}: {str(e)}")
-                continue
-                
-    except Exception as e:
-        st.error(f"Error accessing folder: {str(e)}")
-        return moved_files
-    
-    # Show errors if any
-    if errors:
+def show_sync_status():
+    """Show the sync in progress, or what the last one did."""
+    status = read_status() or {}
+    if is_running():
+        st.info("⏳ Sync in progress. It keeps going if you leave the page.")
+        for folder, counts in status.get("progress", {}).items():
+            st.caption(
+                f"📁 {folder}: checked {counts['seen']} file(s), "
+                f"moved {counts['moved']}..."
+            )
+        st.button("🔄 Refresh")
+        return
+    if "finished" not in status:
+        return
+    st.caption(f"Last sync finished {status['finished']}")
+    for name, job in status["jobs"].items():
+        if "files" in job:
+            source = "📧 Email" if name == "email" else f"📁 {name}"
+            st.success(f"{source}: {job['files']} file(s) filed.")
+    messages = status.get("messages", [])
+    for m in messages:
+        if m["level"] in ("ERROR", "CRITICAL"):
+            st.error(m["message"])
+    warnings = [m for m in messages if m["level"] == "WARNING"]
+    if warnings:
         with st.expander("⚠️ Processing Errors"):
-            for error in errors:
-                st.warning(error)
-    
-    return moved_files
+            for m in warnings:
+                st.warning(m["message"])
 
 
 st.markdown("""
@@ -264,26 +117,10 @@ st.image("SmartFolder_AI.png", width=90)
 st.title("SmartFolder AI")
 st.success("👋 Welcome back! SmartFolder AI is ready to organize your world.")
 col_stat1, col_stat2, col_stat3 = st.columns(3)
-# Load real metrics from log
-files_organized = 0
-emails_processed = 0
-last_sync_time = "N/A"
-
-if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            lines = []
-            for ln in f:
-                parts = ln.strip().split("\t")
-                if len(parts) == 4:
-                    lines.append(parts)
-        files_organized = len(lines)
-        emails_processed = sum(1 for line in lines if "Email" in line[3])
-        if lines:
-            last_sync_time = lines[-1][0]
-            try:
-                last_sync_time = datetime.datetime.strptime(last_sync_time, "%Y-%m-%d %H:%M:%S").strftime("%b %d, %Y")
-            except ValueError:
-                pass
+# Load real metrics from the index's daily counts, which also cover log
+# segments that have been rotated into the archive.
+files_organized, emails_processed, last_day = totals()
+last_sync_time = last_day.strftime("%b %d, %Y") if last_day else "N/A"
 
 col_stat1.metric("🗂️ Files Organized", str(files_organized))
 col_stat2.metric("📧 Emails Processed", str(emails_processed))
@@ -304,6 +141,12 @@ st.sidebar.markdown("""
 - [Security](#)
 """)
 
+# Status of the headless `python -m smartfolder sync` worker, if running
+sync_status = read_status()
+if sync_status and "finished" in sync_status:
+    st.sidebar.markdown("---")
+    st.sidebar.caption(f"🔄 Background sync last ran {sync_status['finished']}")
+
 st.sidebar.markdown("---")
 st.sidebar.caption("© 2025 ISK LLC")
 st.sidebar.caption("📧 [loickonan.lk@gmail.com](mailto:loickonan.lk@gmail.com)")
@@ -322,12 +165,7 @@ with tabs[0]:
             "Pull recent attachments from Gmail and sort them automatically."
         )
         if st.button("🔄 Fetch Now"):
-            attachments = fetch_attachments()
-            st.info(f"Found {len(attachments)} attachment(s).")
-            saved = save_attachments(attachments)
-            st.success(f"Saved {len(saved)} file(s).")
-            for f in saved:
-                st.write(f"✅ {f}")
+            start_sync(email=True)
 
     with col2:
         st.markdown("### 🗂️ Organize Local Files")
@@ -336,22 +174,32 @@ with tabs[0]:
         # Custom folder selection
         selected_folder = st.text_input(
             "📂 Folder Path",
-            value=DOWNLOADS_DIR,
+            value=config.DOWNLOADS_DIR,
             help="Enter the full path to the folder you want to organize"
         )
-        
+        max_depth = st.number_input(
+            "↳ Subfolder Depth",
+            min_value=-1,
+            value=config.ORGANIZE_MAX_DEPTH,
+            help="How many levels of subfolders to sort (0: only this "
+                 "folder, -1: all)"
+        )
+        excludes = st.text_input(
+            "🚫 Exclude",
+            value=", ".join(config.ORGANIZE_EXCLUDES),
+            help="Comma-separated globs (or re:REGEX) of paths to skip"
+        )
+
         if st.button("🧹 Sort Files"):
             if os.path.exists(selected_folder):
-                original_dir = DOWNLOADS_DIR
-                DOWNLOADS_DIR = selected_folder
-                
-                moved = move_existing_files()
-                st.success(f"Moved {len(moved)} file(s).")
-                for f in moved:
-                    st.write(f"📁 {f}")
-                    
-                # Restore original DOWNLOADS_DIR
-                DOWNLOADS_DIR = original_dir
+                start_sync(
+                    email=False,
+                    folders=[selected_folder],
+                    max_depth=int(max_depth),
+                    excludes=[
+                        p.strip() for p in excludes.split(",") if p.strip()
+                    ]
+                )
             else:
                 st.error("Selected folder does not exist!")
 
@@ -363,72 +211,60 @@ with tabs[0]:
             accept_multiple_files=True
         )
         if uploaded_files:
-            for file in uploaded_files:
-                try:
-                    # Get file content and compute hash
-                    content = file.read()
-                    f_hash = file_hash(content)
-                    
-                    # Check if already processed
-                    if has_been_downloaded(f_hash):
-                        st.warning(f"⚠️ {file.name} already exists in the system")
-                        continue
-                    
-                    # Determine category based on file extension
-                    ext = os.path.splitext(file.name)[1].lower()
-                    category = get_category_folder(ext)
-                    
-                    # Create category folder
-                    folder_path = os.path.join(BASE_DIR, category)
-                    os.makedirs(folder_path, exist_ok=True)
-                    
-                    # Save file
-                    filepath = os.path.join(folder_path, clean(file.name))
-                    with open(filepath, "wb") as f:
-                        f.write(content)
-                    
-                    # Log the download
-                    log_download(f_hash, file.name, source="Upload")
-                    
-                    # Show success message with colored file type
-                    file_type = os.path.splitext(file.name)[1][1:].upper()
-                    color = '#9E9E9E'  # Default grey
-                    if file_type in ['DOCX', 'DOC']:
-                        color = '#2196F3'  # Blue
-                    elif file_type == 'PDF':
-                        color = '#F44336'  # Red
-                    elif file_type in ['XLSX', 'XLS']:
-                        color = '#4CAF50'  # Green
-                    
-                    st.markdown(
-                        f"✅ Sorted: {file.name} "
-                        f"(<span style='color: {color}'>{file_type}</span>) "
-                        f"→ {category}",
-                        unsafe_allow_html=True
-                    )
-                    
-                except Exception as e:
-                    st.error(f"❌ Error processing {file.name}: {str(e)}")
+            # Uploads stay in the widget across reruns; each is ingested
+            # once per session and its result remembered by file id
+            processed = st.session_state.setdefault("processed_uploads", {})
+            new_files = [f for f in uploaded_files if f.file_id not in processed]
+            if new_files:
+                with st.spinner(f"Sorting {len(new_files)} file(s)..."):
+                    results = ingest_uploads([(f.name, f) for f in new_files])
+                for file, result in zip(new_files, results):
+                    processed[file.file_id] = result
+            results = [processed[f.file_id] for f in uploaded_files]
+
+            saved = sum(r["status"] == "saved" for r in results)
+            duplicates = sum(r["status"] == "duplicate" for r in results)
+            st.success(
+                f"✅ Sorted {saved} file(s); ⚠️ {duplicates} already in the system"
+            )
+            for r in results:
+                if r["status"] == "error":
+                    st.error(f"❌ Error processing {r['name']}: {r['error']}")
+            st.dataframe(
+                pd.DataFrame({
+                    "File": [r["name"] for r in results],
+                    "Type": [
+                        os.path.splitext(r["name"])[1][1:].upper()
+                        for r in results
+                    ],
+                    "Category": [r["category"] or "" for r in results],
+                    "Status": [r["status"] for r in results],
+                }),
+                use_container_width=True, hide_index=True
+            )
+
+    # Fetch and Sort run in the background; show how they are getting on
+    show_sync_status()
 
 # --- Tab 2: Audit Log ---
 with tabs[1]:
     st.header("📜 Download & Sort History")
-    if not os.path.exists(LOG_FILE) or os.stat(LOG_FILE).st_size == 0:
+    if not files_organized:
         st.info("📭 Your activity log is currently empty. Once you start organizing, you'll see trends here.")
         st.stop()
     
     ensure_log()
-    if os.path.exists(LOG_FILE):
+    if os.path.exists(config.LOG_FILE):
         try:
-            # Read the log file with tab separator
+            # Open the columnar log store (compacting new TSV lines first);
+            # rows are only read for the page and filters being shown
             with st.spinner("🔄 Loading log data..."):
-                with open(LOG_FILE, "r") as f:
-                    lines = [ln.strip().split("\t") for ln in f if ln.strip() and len(ln.strip().split("\t")) == 4]
-                if not lines:
+                log_data = open_dataset()
+                if log_data is None:
                     st.info("📭 No valid log data found. Try processing some files first.")
                     st.stop()
             
-            if lines:
+            if log_data is not None:
                 if demo_mode:
                     import random
                     import numpy as np
@@ -441,43 +277,35 @@ with tabs[1]:
                         "Filename": [f"file_{i}.{random.choice(fake_types).lower()}" for i in range(200)],
                         "Source": [random.choice(fake_sources) for _ in range(200)]
                     })
-                    df["Type"] = df["Filename"].apply(lambda x: os.path.splitext(x)[1][1:].upper())
+                    df["Type"] = df["Filename"].str.extract(r"\.([^.]+)$", expand=False).str.upper()
                     st.info("🧪 Demo Mode is active. Displaying simulated log data.")
+                    log_data = frame_dataset(df)
+                    daily = daily_from_log(df)
+                    unique_files = df["Hash"].nunique()
                 else:
-                    # Create DataFrame with proper column names
-                    df = pd.DataFrame(
-                        lines,
-                        columns=["Timestamp", "Hash", "Filename", "Source"]
-                    )
-                    df["Timestamp"] = pd.to_datetime(df["Timestamp"])
-                    
-                    # Extract file extension for Type
-                    def get_file_type(filename):
-                        if pd.isna(filename) or not isinstance(filename, str):
-                            return "UNKNOWN"
-                        ext = os.path.splitext(filename)[1]
-                        return ext[1:].upper() if ext else "UNKNOWN"
-                    
-                    df["Type"] = df["Filename"].apply(get_file_type)
+                    # Per-day counts kept in the index; charts use these
+                    daily = load_daily()
+                    unique_files = count_hashes()
 
                 # Display summary metrics and pie chart
                 st.subheader("📊 Summary")
                 
                 # Summary metrics in columns
                 col1, col2, col3 = st.columns(3)
+                type_totals = daily.groupby("Type")["Files"].sum()
                 with col1:
-                    st.metric("Total Files", len(df))
+                    st.metric("Total Files", int(daily["Files"].sum()))
                 with col2:
-                    st.metric("Unique Files", df["Hash"].nunique())
+                    st.metric("Unique Files", unique_files)
                 with col3:
                     common_type = (
-                        df["Type"].mode().iloc[0] 
-                        if not df["Type"].empty else "N/A"
+                        type_totals.idxmax()
+                        if not type_totals.empty else "N/A"
                     )
                     st.metric("Most Common Type", common_type)
                 
                 # Add pie chart for file types using Altair
-                type_dist = df["Type"].value_counts().reset_index()
+                type_dist = type_totals.reset_index()
                 type_dist.columns = ["Type", "Count"]
                 
                 # Define color scheme for file types
@@ -511,10 +339,9 @@ with tabs[1]:
 
                 # Activity charts
                 st.subheader("📈 Download Activity")
-                valid_dates = df[df["Timestamp"].notna()]
-                if not valid_dates.empty:
-                    min_date = valid_dates["Timestamp"].min()
-                    max_date = valid_dates["Timestamp"].max()
+                if not daily.empty:
+                    min_date = daily["Day"].min()
+                    max_date = daily["Day"].max()
                     date_range = [min_date.date(), max_date.date()]
                     preset_range = st.selectbox("📆 Quick Date Filter", ["Last 3 Months", "Last 6 Months", "Last Month", "Last Week", "Select a Day"])
                     if preset_range == "Last 3 Months":
@@ -539,24 +366,19 @@ with tabs[1]:
                     if isinstance(start_date, datetime.date) and isinstance(end_date, datetime.date):
                         start_date = pd.to_datetime(start_date)
                         end_date = pd.to_datetime(end_date)
-                        mask = (df["Timestamp"] >= start_date) & (df["Timestamp"] <= end_date)
-                        df_range = df[mask].copy()
-                        if df_range.empty:
+                        daily_range = daily[(daily["Day"] >= start_date) & (daily["Day"] <= end_date)]
+                        selected_months = selected_types = None
+                        if daily_range.empty:
                             st.info("📭 No log data found for the selected period. Try a different date or process new files.")
                     
                     # Daily activity chart
-                    daily_counts = df_range.groupby(
-                        df_range["Timestamp"].dt.date
-                    ).size()
+                    daily_counts = roll_up(daily_range).set_index("Period")["Count"]
                     if not daily_counts.empty:
                         st.line_chart(daily_counts)
                         st.subheader("📆 Weekly Trends by File Type")
                         
-                        # Add a 'Week' column from the timestamp
-                        df_range["Week"] = df_range["Timestamp"].dt.to_period("W").apply(lambda r: r.start_time)
-                        
-                        # Group by week and file type
-                        weekly_trends = df_range.groupby(["Week", "Type"]).size().reset_index(name="Count")
+                        # Sum the daily counts by week and file type
+                        weekly_trends = roll_up(daily_range, "W", ["Type"]).rename(columns={"Period": "Week"})
                         
                         # Plot with Altair
                         weekly_chart = alt.Chart(weekly_trends).mark_bar().encode(
@@ -574,18 +396,18 @@ with tabs[1]:
                     
                         st.subheader("📅 Monthly Trends by File Type")
                         chart_type = st.radio("📊 Chart Type", ["📈 Line", "📊 Bar"], horizontal=True)
-                        df_range["Month"] = df_range["Timestamp"].dt.to_period("M").apply(lambda r: r.start_time)
+                        daily_month = daily_range["Day"].dt.to_period("M").dt.start_time
                         # Filter by recent months (e.g., last 6 months)
-                        recent_months = sorted(df_range["Month"].unique())[-6:]
+                        recent_months = sorted(daily_month.unique())[-6:]
                         selected_months = st.multiselect("📅 Select Recent Months", recent_months, default=recent_months)
-                        df_range = df_range[df_range["Month"].isin(selected_months)]
+                        daily_range = daily_range[daily_month.isin(selected_months)]
 
 
-                        unique_types = df_range["Type"].dropna().unique().tolist()
+                        unique_types = daily_range["Type"].unique().tolist()
                         selected_types = st.multiselect("🗂️ Filter by File Type", unique_types, default=unique_types, help="Select file types to include in the charts and logs")
-                        df_range = df_range[df_range["Type"].isin(selected_types)]
+                        daily_range = daily_range[daily_range["Type"].isin(selected_types)]
 
-                        monthly_trends = df_range.groupby(["Month", "Type", "Source"]).size().reset_index(name="Count")
+                        monthly_trends = roll_up(daily_range, "M", ["Type", "Source"]).rename(columns={"Period": "Month"})
                         
                         monthly_chart = alt.Chart(monthly_trends)
                         
@@ -616,7 +438,7 @@ with tabs[1]:
                     st.subheader("📂 File Type Trends")
                     
                     # Bar chart and pie chart side by side
-                    type_counts = df_range.groupby("Type").size()
+                    type_counts = daily_range.groupby("Type")["Files"].sum()
                     if not type_counts.empty:
                         col1, col2 = st.columns(2)
                         
@@ -670,12 +492,20 @@ with tabs[1]:
                                 use_container_width=True
                             )
                     
+                    # The same selections, pushed down to the log store
+                    # (end_date is a day: include everything logged on it)
+                    range_filter = log_filter(
+                        start_date, end_date + pd.Timedelta(days=1),
+                        months=selected_months, types=selected_types
+                    )
+                    range_count = count_rows(log_data, range_filter)
+
                     # Latest files
                     st.subheader("🧮 Latest Files")
-                    latest = df_range.sort_values(
-                        "Timestamp",
-                        ascending=False
-                    ).head(5)
+                    latest = read_rows(
+                        log_data, range_filter, ["Timestamp", "Filename", "Type"],
+                        offset=max(0, range_count - 5), limit=5
+                    ).sort_values("Timestamp", ascending=False)
                     for _, row in latest.iterrows():
                         # Color-code the file type in the display
                         file_type = row['Type']
@@ -711,53 +541,100 @@ with tabs[1]:
                             )
 
                     # Full log view and export
+                    row_filter = range_filter
                     with st.expander("📄 View Full Log"):
-                        # Extract email information first
-                        def extract_source_info(source):
-                            try:
-                                if "(" in source and ")" in source:
-                                    base = source.split("(")[0].strip()
-                                    email = source[source.find("(")+1:source.find(")")]
-                                    return pd.Series([base, email])
-                                else:
-                                    return pd.Series([source.strip(), ""])
-                            except Exception:
-                                return pd.Series(["Unknown", ""])
-                        
-                        # Extract source and email columns safely
-                        source_info_df = df_range["Source"].apply(extract_source_info)
-                        source_info_df.columns = ["Source", "Email"]  # Rename after extraction
+                        # Filter by email sender: type to search the
+                        # sender index; no selection means every sender
+                        if not demo_mode:
+                            sender_query = st.text_input(
+                                "🔎 Search Senders",
+                                help="Type part of an address to find senders"
+                            )
+                            # New options make a new widget, which starts
+                            # empty, so the selection is kept separately and
+                            # handed back as its default.
+                            saved_senders = st.session_state.get(
+                                "selected_senders", []
+                            )
+                            sender_options = sorted(
+                                set(search_senders(sender_query))
+                                | set(saved_senders)
+                            )
+                            selected_senders = st.multiselect(
+                                "✉️ Filter by Sender", sender_options,
+                                default=saved_senders,
+                                help="Leave empty to include all senders"
+                            )
+                            st.session_state["selected_senders"] = (
+                                selected_senders
+                            )
+                            if selected_senders:
+                                row_filter = log_filter(
+                                    start_date, end_date + pd.Timedelta(days=1),
+                                    months=selected_months, types=selected_types,
+                                    senders=selected_senders
+                                )
 
-                        # Drop original Source and concatenate clean columns
-                        df_range = df_range.drop(columns=["Source"], errors='ignore')
-                        df_range = pd.concat([df_range, source_info_df], axis=1)
-                        
-                        # Filter by email sender if available
-                        if "Email" in df_range.columns:
-                            unique_senders = df_range["Email"].dropna().unique().tolist()
-                            if unique_senders:
-                                selected_senders = st.multiselect("✉️ Filter by Sender", unique_senders, default=unique_senders, help="Search or select sender(s) to filter logs")
-                                df_range = df_range[df_range["Email"].isin(selected_senders)]
+                        # Fetch only the page being shown
+                        total_rows = count_rows(log_data, row_filter)
+                        page_col1, page_col2 = st.columns(2)
+                        with page_col1:
+                            page_size = st.selectbox(
+                                "Rows per page", [50, 100, 500], index=1
+                            )
+                        page_count = max(1, -(-total_rows // page_size))
+                        with page_col2:
+                            page = st.number_input(
+                                "Page", min_value=1, max_value=page_count,
+                                value=1
+                            )
+                        st.caption(
+                            f"{total_rows} entries · page {page} of {page_count}"
+                        )
+                        page_df = read_rows(
+                            log_data, row_filter,
+                            ["Timestamp", "Filename", "Type", "Source"],
+                            offset=(page - 1) * page_size, limit=page_size
+                        )
+
+                        # Split "Email (sender)" into Source and Email
+                        source_info_df = split_source(page_df["Source"])
+                        page_df["Source"] = source_info_df["Source"]
+                        page_df["Email"] = source_info_df["Email"]
 
                         # Determine columns based on email visibility
                         display_cols = [
                             "Timestamp", "Filename", "Type", "Source"
                         ]
-                        if show_emails and "Email" in df_range.columns:
+                        if show_emails:
                             display_cols.append("Email")
                         
                         # Display the dataframe with selected columns
                         st.dataframe(
-                            df_range[display_cols],
+                            page_df[display_cols],
                             use_container_width=True
                         )
                     
-                    csv = df_range.to_csv(index=False)
-                    st.download_button(
-                        "📥 Export Log",
-                        csv,
-                        file_name="smartfolder_log.csv"
-                    )
+                    # The CSV is only written when asked for, streamed to a
+                    # file of this request's own, which is deleted once the
+                    # download button holds its bytes
+                    if st.button("📥 Export Log"):
+                        fd, export_path = tempfile.mkstemp(
+                            prefix="smartfolder_log-", suffix=".csv"
+                        )
+                        os.close(fd)
+                        try:
+                            with st.spinner("Preparing export..."):
+                                write_csv(log_data, export_path, row_filter)
+                            with open(export_path, "rb") as export_file:
+                                st.download_button(
+                                    "💾 Download CSV",
+                                    export_file,
+                                    file_name="smartfolder_log.csv",
+                                    mime="text/csv"
+                                )
+                        finally:
+                            os.remove(export_path)
                 else:
                     msg = (
                         "Log file is empty. "
@@ -787,34 +664,93 @@ with tabs[1]:
 # --- Tab 3: Settings ---
 with tabs[2]:
     st.header("⚙️ Settings")
-    st.text_input(
+    # Saved to settings.json and compiled into the rules every sorting
+    # path (email, folders, uploads, the watcher) places files by
+    saved_settings = load_settings()
+    sender_filter = st.text_input(
         "📧 Gmail Filter Email (Optional)",
-        help="Filter emails from specific addresses"
+        value=", ".join(saved_settings["sender_filter"]),
+        help="Only save attachments from these addresses (comma-separated; "
+             "*@example.com matches a whole domain)"
     )
     
-    naming_conventions = [
-        "ProjectName-Type",
-        "Type-ProjectName",
-        "ProjectName-Type-Date",
-        "Type-ProjectName-Date",
-        "Original Filename"
-    ]
-    st.selectbox(
+    naming_conventions = list(NAMING_CONVENTIONS)
+    naming_convention = st.selectbox(
         "🧾 File Naming Convention",
-        naming_conventions
+        naming_conventions,
+        index=naming_conventions.index(saved_settings["naming_convention"])
+        if saved_settings["naming_convention"] in naming_conventions else 0,
+        help="ProjectName is the original file name without its extension"
     )
     
-    st.text_input(
+    folder_prefix = st.text_input(
         "📂 Default Folder Prefix (Optional)",
+        value=saved_settings["folder_prefix"],
         help="Add a prefix to all created folders"
     )
     
-    st.checkbox(
+    only_new = st.checkbox(
         "🆕 Only sort new files",
-        value=True,
+        value=saved_settings["only_new"],
         help="Skip files that have already been processed"
     )
+
+    st.markdown("#### 🧭 Sorting Rules")
+    st.caption(
+        "The first matching rule decides where a file goes; files no rule "
+        "matches go to their category folder. Destinations may use "
+        "{category}, {type}, {sender}, {year}, {month}, {date} and {stem}."
+    )
+    rules_table = st.data_editor(
+        pd.DataFrame(
+            [{
+                "Extensions": ", ".join(rule.get("extensions") or []),
+                "Senders": ", ".join(rule.get("senders") or []),
+                "Min Size (bytes)": rule.get("min_size"),
+                "Max Size (bytes)": rule.get("max_size"),
+                "Filename Regex": rule.get("filename") or "",
+                "Destination": rule.get("destination") or "",
+                "Skip": bool(rule.get("skip")),
+            } for rule in saved_settings["rules"]],
+            columns=["Extensions", "Senders", "Min Size (bytes)",
+                     "Max Size (bytes)", "Filename Regex", "Destination",
+                     "Skip"]
+        ).astype({"Min Size (bytes)": "Int64", "Max Size (bytes)": "Int64",
+                  "Skip": bool}),
+        num_rows="dynamic", use_container_width=True, hide_index=True
+    )
     
     if st.button("💾 Save Settings"):
-        st.caption("Your Inbox Automation Assistant — Built by Loic Konan | ISK LLC")
-        st.success("Settings saved successfully!")
\ No newline at end of file
+        def split_list(text):
+            return [p.strip() for p in str(text or "").split(",") if p.strip()]
+
+        rules = []
+        for row in rules_table.to_dict("records"):
+            rule = {
+                "extensions": split_list(row["Extensions"]),
+                "senders": split_list(row["Senders"]),
+                "min_size": None if pd.isna(row["Min Size (bytes)"])
+                else int(row["Min Size (bytes)"]),
+                "max_size": None if pd.isna(row["Max Size (bytes)"])
+                else int(row["Max Size (bytes)"]),
+                "filename": row["Filename Regex"] or None,
+                "destination": row["Destination"] or None,
+                "skip": bool(row["Skip"]),
+            }
+            if any(v for v in rule.values()):
+                rules.append(rule)
+        new_settings = {
+            "sender_filter": split_list(sender_filter),
+            "naming_convention": naming_convention,
+            "folder_prefix": folder_prefix,
+            "only_new": only_new,
+            "rules": rules,
+        }
+        try:
+            compile_rules(new_settings)
+        except (ValueError, re.error) as e:
+            st.error(f"❌ Invalid rule: {e}")
+        else:
+            save_settings(new_settings)
+            st.caption("Your Inbox Automation Assistant — Built by Loic Konan | ISK LLC")
+            st.success("Settings saved successfully!")
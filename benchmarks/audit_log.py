@@ -0,0 +1,126 @@
+"""Time the Audit Log tab's data path on a large synthetic log.
+
+    python benchmarks/audit_log.py [--rows 1000000] [--senders 5000]
+
+Writes a log of --rows entries into a temporary home directory, then
+reports how long compaction, loading and each DataFrame transform take,
+next to the row-wise versions they replaced, and (when Streamlit's
+AppTest is available) a first run and a rerun of the dashboard script.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from smartfolder import config  # noqa: E402
+from smartfolder.logstore import compact_log, load_log, split_source  # noqa: E402
+from synthetic import write_log  # noqa: E402
+
+
+def timed(label, func, *args):
+    began = time.perf_counter()
+    result = func(*args)
+    print(f"{label:<40} {time.perf_counter() - began:8.3f} s")
+    return result
+
+
+# The row-wise transforms the tab used before, for comparison.
+def old_type(df):
+    def get_file_type(filename):
+        if pd.isna(filename) or not isinstance(filename, str):
+            return "UNKNOWN"
+        ext = os.path.splitext(filename)[1]
+        return ext[1:].upper() if ext else "UNKNOWN"
+    return df["Filename"].apply(get_file_type)
+
+
+def old_periods(df):
+    ts = df["Timestamp"]
+    return (ts.dt.to_period("W").apply(lambda r: r.start_time),
+            ts.dt.to_period("M").apply(lambda r: r.start_time))
+
+
+def new_periods(df):
+    ts = df["Timestamp"]
+    return (ts.dt.to_period("W").dt.start_time,
+            ts.dt.to_period("M").dt.start_time)
+
+
+def old_split_source(df):
+    def extract_source_info(source):
+        try:
+            if "(" in source and ")" in source:
+                base = source.split("(")[0].strip()
+                email = source[source.find("(")+1:source.find(")")]
+                return pd.Series([base, email])
+            else:
+                return pd.Series([source.strip(), ""])
+        except Exception:
+            return pd.Series(["Unknown", ""])
+    return df["Source"].astype(str).apply(extract_source_info)
+
+
+def run_dashboard(app=None):
+    from streamlit.testing.v1 import AppTest
+    if app is not None:
+        app.run()
+        return app
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    os.chdir(root)  # the script loads its images by relative path
+    app = AppTest.from_file(
+        os.path.join(root, "SmartFolder_AI.py"), default_timeout=600
+    )
+    app.secrets["email"] = {"email_user": "bench", "email_pass": "bench"}
+    app.session_state["authenticated"] = True
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--senders", type=int, default=5000)
+    parser.add_argument(
+        "--old", action="store_true",
+        help="also time the row-wise transforms (slow at 1M rows)"
+    )
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="smartfolder-bench-")
+    os.environ["HOME"] = home
+    config.configure({})
+    os.makedirs(config.BASE_DIR)
+    timed(f"write {args.rows:,} log lines", write_log,
+          config.LOG_FILE, args.rows, args.senders)
+
+    timed("compact_log (cold)", compact_log)
+    df = timed("load_log", load_log)
+    timed("load_log (Timestamp, Type; 1 month)", load_log,
+          ["Timestamp", "Type"], df["Timestamp"].max() - pd.DateOffset(months=1),
+          df["Timestamp"].max())
+
+    timed("Week/Month start (vectorized)", new_periods, df)
+    timed("split_source (vectorized)", split_source, df["Source"])
+    if args.old:
+        timed("Type via apply (before)", old_type, df)
+        timed("Week/Month start via apply (before)", old_periods, df)
+        timed("Source split via apply (before)", old_split_source, df)
+
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        print("streamlit AppTest not available; skipping dashboard run")
+        return
+    app = timed("dashboard script run", run_dashboard)
+    timed("dashboard rerun", run_dashboard, app)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Time placing files with compiled sorting rules.
+
+    python benchmarks/rules.py [--files 100000] [--rules 50]
+
+Builds --rules synthetic rules (extension, sender, size and filename
+regex conditions) and places --files synthetic files with the compiled
+RuleSet, next to a naive evaluation that checks every rule in order and
+runs its regex and sender globs per file, and checks both agree.
+"""
+import argparse
+import datetime
+import fnmatch
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from smartfolder import config  # noqa: E402
+from smartfolder.rules import compile_rules  # noqa: E402
+
+WORDS = ["invoice", "contract", "report", "summary", "draft", "minutes",
+         "budget", "proposal", "scan", "statement", "receipt", "plan"]
+
+
+def make_settings(count):
+    exts = sorted(config.FILE_CATEGORIES)
+    rules = []
+    for i in range(count):
+        rule = {"destination": f"Rule{i}/{{year}}"}
+        if i % 2 == 0:
+            rule["extensions"] = random.sample(exts, 2)
+        if i % 3 == 0:
+            rule["senders"] = [f"*@client{i}.com"]
+        if i % 4 == 0:
+            rule["min_size"] = random.randrange(1 << 20)
+        if i % 5 != 4:
+            rule["filename"] = (
+                f"(?i){random.choice(WORDS)}[_-]{random.randrange(100)}"
+            )
+        rules.append(rule)
+    return {"rules": rules, "naming_convention": "ProjectName-Type-Date"}
+
+
+def make_files(count, rules):
+    exts = sorted(config.FILE_CATEGORIES)
+    files = []
+    for i in range(count):
+        ext = random.choice(exts)
+        name = (f"{random.choice(WORDS)}_{random.randrange(100)}_"
+                f"{random.choice(WORDS)}-{i}{ext}")
+        sender = f"user{i % 97}@client{random.randrange(rules)}.com"
+        files.append((name, ext, random.randrange(2 << 20), sender))
+    return files
+
+
+def naive_match(settings, filename, ext, size, sender):
+    """Rule index per file the way a per-file interpreter would find it."""
+    for i, rule in enumerate(settings["rules"]):
+        exts = rule.get("extensions")
+        if exts and ext not in exts:
+            continue
+        if size < (rule.get("min_size") or 0):
+            continue
+        senders = rule.get("senders")
+        if senders and not any(fnmatch.fnmatch(sender, p) for p in senders):
+            continue
+        pattern = rule.get("filename")
+        if pattern and not re.search(pattern, filename):
+            continue
+        return i
+    return None
+
+
+def timed(label, func, *args):
+    began = time.perf_counter()
+    result = func(*args)
+    print(f"{label:<40} {time.perf_counter() - began:8.3f} s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--rules", type=int, default=50)
+    args = parser.parse_args()
+
+    config.configure({})
+    settings = make_settings(args.rules)
+    files = make_files(args.files, args.rules)
+    when = datetime.date.today()
+
+    ruleset = timed(f"compile {args.rules} rules", compile_rules, settings)
+    compiled = timed(f"match {args.files:,} files (compiled)", lambda: [
+        None if (rule := ruleset.match(n, e, s, u)) is None else rule.index
+        for n, e, s, u in files
+    ])
+    timed(f"place {args.files:,} files (compiled)",
+          lambda: [ruleset.place(n, e, s, u, when) for n, e, s, u in files])
+    naive = timed(f"match {args.files:,} files (naive)",
+                  lambda: [naive_match(settings, *f) for f in files])
+    if compiled != naive:
+        raise SystemExit("compiled and naive rule matches differ")
+    matched = sum(i is not None for i in compiled)
+    print(f"{matched:,} of {args.files:,} files matched a rule")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""Reproducible timings of SmartFolder's hot paths, with a JSON report.
+
+    python benchmarks/suite.py [--log-rows 10000 100000 ...] [--files 500]
+        [--file-sizes 4096 65536 1048576] [--messages 100]
+        [--output report.json] [--baseline previous.json]
+
+Builds every input from --seed in a temporary directory: a Downloads
+folder of --files files drawn from --file-sizes (some duplicates, some
+types sorting skips), --messages RFC822 messages with --attachments
+attachments each, and an audit log for each --log-rows size (10k to 10M
+rows). Each benchmark runs --repeat times, on fresh inputs where it
+changes them, and the report keeps every time and the best. Timed:
+
+  file_hash                 hashing the Downloads folder's files
+  save_attachments          saving the messages' attachments
+  move_existing_files       sorting the Downloads folder
+  has_been_downloaded       --lookups dedup checks on one open index,
+                            half of them hits
+  header_metrics_cold       the dashboard header's totals on a new index
+  header_metrics            ...and once the index is up to date
+  audit_log_cold            compacting the log into the Parquet store
+  audit_log                 the Audit Log tab's reads and DataFrame
+                            transforms on the compacted store
+
+Log rotation is turned off so every run does the same work. The report
+records the Python version, platform and git revision. With --baseline,
+an earlier report, the run exits with status 1 if any benchmark's best
+time (per file, row or lookup, where it counts them) is more than
+--tolerance slower than it was there.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from smartfolder import config  # noqa: E402
+from smartfolder.hashing import file_hash  # noqa: E402
+from smartfolder.index import has_been_downloaded, open_index  # noqa: E402
+from smartfolder.logstore import (  # noqa: E402
+    count_rows, log_filter, open_dataset, read_rows, split_source, store_dir
+)
+from smartfolder.organizer import (  # noqa: E402
+    move_existing_files, save_attachments
+)
+from smartfolder.rollups import load_daily, roll_up, totals  # noqa: E402
+from synthetic import (  # noqa: E402
+    make_downloads, make_messages, message_attachments, write_log
+)
+
+SECRETS = {"log_rotate_mb": 0, "log_rotate_days": 0}
+
+
+def use_base_dir(path):
+    """Point the app at path as its download folder, creating it."""
+    config.configure(SECRETS, base_dir=path)
+    os.makedirs(path, exist_ok=True)
+
+
+def measure(name, run, setup=None, repeat=3, items=None, unit="items",
+            **params):
+    """Time run(*setup()) repeat times; returns the result record."""
+    seconds = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        began = time.perf_counter()
+        run(*args)
+        seconds.append(time.perf_counter() - began)
+    best = min(seconds)
+    record = {
+        "name": name, "params": params, "seconds": seconds, "best": best,
+        "median": statistics.median(seconds),
+    }
+    if items:
+        record["items"] = items
+        record["unit"] = unit
+        record["per_second"] = items / best if best else None
+    rate = (f"  {record['per_second']:,.0f} {unit}/s"
+            if record.get("per_second") else "")
+    label = name + "".join(f" {k}={v}" for k, v in params.items())
+    print(f"{label:<48} {best:8.3f} s{rate}")
+    return record
+
+
+def key(record):
+    return record["name"], json.dumps(record["params"], sort_keys=True)
+
+
+def bench_files(args, work, rng):
+    results = []
+    downloads = os.path.join(work, "downloads-template")
+    total = make_downloads(downloads, args.files, args.file_sizes, rng)
+    paths = [entry.path for entry in os.scandir(downloads)]
+    results.append(measure(
+        "file_hash", lambda: [file_hash(p) for p in paths],
+        repeat=args.repeat, items=total, unit="bytes", files=len(paths)
+    ))
+
+    messages = make_messages(
+        args.messages, args.attachments, args.file_sizes, rng=rng
+    )
+    attachments = list(message_attachments(messages))
+
+    def fresh_mail():
+        base = tempfile.mkdtemp(dir=work)
+        use_base_dir(os.path.join(base, "EmailDownloads"))
+        return ()
+    results.append(measure(
+        "save_attachments", lambda: save_attachments(attachments),
+        fresh_mail, args.repeat, items=len(attachments), unit="files",
+        messages=args.messages, attachments=len(attachments)
+    ))
+
+    def fresh_folder():
+        base = tempfile.mkdtemp(dir=work)
+        use_base_dir(os.path.join(base, "EmailDownloads"))
+        folder = os.path.join(base, "Downloads")
+        shutil.copytree(downloads, folder)
+        return (folder,)
+    results.append(measure(
+        "move_existing_files", move_existing_files, fresh_folder,
+        args.repeat, items=len(paths), unit="files", files=len(paths)
+    ))
+    return results
+
+
+def audit_log_reads(dataset):
+    """What the Audit Log tab reads on a first render."""
+    daily = load_daily()
+    roll_up(daily)
+    roll_up(daily, "W", ["Type"])
+    roll_up(daily, "M", ["Type", "Source"])
+    end = daily["Day"].max() + pd.Timedelta(days=1)
+    row_filter = log_filter(end - pd.Timedelta(days=30), end)
+    count_rows(dataset, row_filter)
+    page = read_rows(
+        dataset, row_filter, ["Timestamp", "Filename", "Type", "Source"],
+        limit=100
+    )
+    split_source(page["Source"])
+
+
+def bench_log(args, work, rows, rng):
+    results = []
+    base = os.path.join(work, f"log-{rows}", "EmailDownloads")
+    use_base_dir(base)
+    write_log(config.LOG_FILE, rows, args.senders, rng)
+    with closing(open_index()) as conn:
+        present = [h for (h,) in conn.execute(
+            "SELECT hash FROM hashes LIMIT ?", (args.lookups // 2,)
+        )]
+        lookups = present + [
+            f"{rng.getrandbits(128):032x}"
+            for _ in range(args.lookups - len(present))
+        ]
+        results.append(measure(
+            "has_been_downloaded",
+            lambda: [has_been_downloaded(h, conn) for h in lookups],
+            repeat=args.repeat, items=len(lookups), unit="lookups",
+            rows=rows, lookups=len(lookups)
+        ))
+
+    def drop_index():
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(config.INDEX_FILE + suffix):
+                os.remove(config.INDEX_FILE + suffix)
+        return ()
+    results.append(measure(
+        "header_metrics_cold", totals, drop_index, args.repeat,
+        items=rows, unit="rows", rows=rows
+    ))
+    results.append(measure(
+        "header_metrics", totals, repeat=args.repeat, rows=rows
+    ))
+
+    def drop_store():
+        shutil.rmtree(store_dir(), ignore_errors=True)
+        return ()
+    results.append(measure(
+        "audit_log_cold", open_dataset, drop_store, args.repeat,
+        items=rows, unit="rows", rows=rows
+    ))
+    dataset = open_dataset()
+    results.append(measure(
+        "audit_log", audit_log_reads, lambda: (dataset,), args.repeat,
+        rows=rows
+    ))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cost(record):
+    """Seconds per item where the record counts items, else best time."""
+    return record["best"] / record["items"] if record.get("items") else (
+        record["best"]
+    )
+
+
+def compare(results, baseline_path, tolerance):
+    """Print regressions against an earlier report; True if any."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {key(r): r for r in json.load(f)["results"]}
+    regressed = False
+    for record in results:
+        before = baseline.get(key(record))
+        if before is None or not cost(before):
+            continue
+        change = cost(record) / cost(before) - 1
+        if change > tolerance:
+            regressed = True
+            params = "".join(
+                f" {k}={v}" for k, v in record["params"].items()
+            )
+            print(f"REGRESSION {record['name']}{params}: "
+                  f"{before['best']:.3f} s -> {record['best']:.3f} s "
+                  f"({change:+.0%} per item)")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--log-rows", type=int, nargs="+", default=[10_000, 100_000],
+        help="audit log sizes to benchmark (default: 10000 100000)"
+    )
+    parser.add_argument("--senders", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument(
+        "--file-sizes", type=int, nargs="+", default=[4096, 65536, 1048576],
+        help="file sizes in bytes to draw from"
+    )
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--attachments", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--output", default="benchmark-report.json",
+        help="where to write the JSON report"
+    )
+    parser.add_argument("--baseline", help="an earlier report to compare to")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="slowdown against --baseline counted as a regression "
+             "(default: 0.2, i.e. 20%%)"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix="smartfolder-bench-")
+    try:
+        use_base_dir(os.path.join(work, "files", "EmailDownloads"))
+        results = bench_files(args, work, rng)
+        for rows in args.log_rows:
+            results += bench_log(args, work, rows, rng)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "hash_algorithm": config.HASH_ALGORITHM,
+        "args": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Synthetic inputs for the benchmarks, reproducible from a seeded RNG.
+
+Every generator takes an rng (random.Random, or the random module), so
+the same seed always produces the same mailboxes, folders and logs.
+"""
+import datetime
+import os
+import random
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.policy import default as default_policy
+
+TYPES = ["pdf", "docx", "doc", "xlsx", "xls", "pptx", "ppt", "txt"]
+_MIME_SUBTYPES = {
+    "pdf": "pdf", "doc": "msword", "xls": "vnd.ms-excel",
+    "ppt": "vnd.ms-powerpoint",
+    "docx": "vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pptx": "vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+# Files in a Downloads folder that sorting leaves alone.
+OTHER_TYPES = ["txt", "jpg", "zip", "crdownload"]
+
+
+def write_log(path, rows, senders, rng=random):
+    """Write rows log lines spread over two years, half from email."""
+    start = datetime.datetime(2023, 1, 1)
+    step = datetime.timedelta(days=730) / rows
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(rows):
+            ts = (start + step * i).strftime("%Y-%m-%d %H:%M:%S")
+            kind = rng.random()
+            if kind < 0.5:
+                source = f"Email (sender{rng.randrange(senders)}@example.com)"
+            elif kind < 0.8:
+                source = "Downloads"
+            else:
+                source = "Upload"
+            f.write(
+                f"{ts}\t{rng.getrandbits(128):032x}\t"
+                f"report_{i}.{rng.choice(TYPES)}\t{source}\n"
+            )
+
+
+def document_bytes(ext, size, rng=random):
+    """size bytes of content for a file of type ext.
+
+    PDFs start with their header, so content sniffing recognises them;
+    other types are random bytes under their extension.
+    """
+    head = b"%PDF-1.7\n" if ext == "pdf" else b""
+    return head + rng.randbytes(max(0, size - len(head)))
+
+
+def make_downloads(folder, files, sizes, rng=random, duplicates=0.1,
+                   others=0.2):
+    """Fill folder with files of the given sizes; returns the total bytes.
+
+    A fraction of the files are byte-for-byte copies of earlier ones
+    (duplicates) and a fraction are types sorting leaves alone (others).
+    """
+    os.makedirs(folder, exist_ok=True)
+    written, total = [], 0
+    for i in range(files):
+        if written and rng.random() < duplicates:
+            data = rng.choice(written)
+            ext = "pdf" if data.startswith(b"%PDF") else rng.choice(
+                [t for t in _MIME_SUBTYPES if t != "pdf"]
+            )
+        else:
+            ext = (rng.choice(OTHER_TYPES) if rng.random() < others
+                   else rng.choice(list(_MIME_SUBTYPES)))
+            data = document_bytes(ext, rng.choice(sizes), rng)
+            if len(written) < 64:
+                written.append(data)
+        with open(os.path.join(folder, f"file_{i}.{ext}"), "wb") as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+
+def make_messages(count, attachments, sizes, senders=100, rng=random):
+    """Return count RFC822 messages (bytes), each with attachments files."""
+    messages = []
+    for i in range(count):
+        msg = EmailMessage()
+        msg["From"] = f"Sender {i % senders} <sender{i % senders}@example.com>"
+        msg["To"] = "me@example.com"
+        msg["Subject"] = f"Documents {i}"
+        msg["Date"] = "Mon, 02 Jan 2023 10:00:00 +0000"
+        msg.set_content("Please find the documents attached.")
+        for j in range(attachments):
+            ext = rng.choice(list(_MIME_SUBTYPES))
+            msg.add_attachment(
+                document_bytes(ext, rng.choice(sizes), rng),
+                maintype="application", subtype=_MIME_SUBTYPES[ext],
+                filename=f"message_{i}_{j}.{ext}"
+            )
+        messages.append(msg.as_bytes())
+    return messages
+
+
+def message_attachments(messages):
+    """(filename, content, From) for every attachment, as the IMAP fetch
+    hands them to save_attachments()."""
+    parser = BytesParser(policy=default_policy)
+    for raw in messages:
+        msg = parser.parsebytes(raw)
+        for part in msg.iter_attachments():
+            yield part.get_filename(), part.get_content(), str(msg["From"])
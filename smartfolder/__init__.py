@@ -0,0 +1,19 @@
+"""SmartFolder AI core: email sync, dedup index and file organizing.
+
+Importable without Streamlit; the dashboard (SmartFolder_AI.py) and the
+command line (``python -m smartfolder``) are both thin layers over it.
+"""
+from .hashing import file_hash
+from .imap import fetch_attachments
+from .index import LogWriter, has_been_downloaded, log_download
+from .organizer import move_existing_files, save_attachments
+
+__all__ = [
+    "LogWriter",
+    "fetch_attachments",
+    "file_hash",
+    "has_been_downloaded",
+    "log_download",
+    "move_existing_files",
+    "save_attachments",
+]
@@ -0,0 +1,100 @@
+"""Command line entry point: ``python -m smartfolder sync|watch``."""
+import argparse
+import logging
+
+from . import config
+from .sync import run_forever, run_once
+from .watcher import watch
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="smartfolder",
+        description="Headless email sync and folder sorting for SmartFolder AI."
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="log debug output"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync = commands.add_parser(
+        "sync", help="fetch new attachments and sort folders"
+    )
+    sync.add_argument(
+        "--watch", action="store_true",
+        help="keep running, repeating the sync every --interval seconds"
+    )
+    sync.add_argument(
+        "--interval", type=float, default=300,
+        help="seconds between runs in --watch mode (default: 300)"
+    )
+    sync.add_argument(
+        "--folder", action="append", dest="folders", metavar="PATH",
+        help="folder to sort; repeatable (default: your Downloads folder)"
+    )
+    sync.add_argument(
+        "--depth", type=int, default=None,
+        help="subfolder levels to descend into when sorting; -1 for no "
+             "limit (default: organize_max_depth, or 0)"
+    )
+    sync.add_argument(
+        "--exclude", action="append", dest="excludes", metavar="PATTERN",
+        help="glob (or re:REGEX) of paths to leave alone; repeatable"
+    )
+    sync.add_argument(
+        "--no-email", action="store_true", help="skip the email sync"
+    )
+    sync.add_argument(
+        "--no-sort", action="store_true", help="skip sorting folders"
+    )
+    sync.add_argument(
+        "--workers", type=int, default=None,
+        help="size of the worker pool (default: one per job)"
+    )
+
+    watch = commands.add_parser(
+        "watch", help="sort files the moment they land in a folder"
+    )
+    watch.add_argument(
+        "folders", nargs="*", metavar="FOLDER",
+        help="folders to watch (default: your Downloads folder)"
+    )
+    watch.add_argument(
+        "--settle", type=float, default=None,
+        help="seconds without writes before a file counts as complete "
+             "when no close event is seen (default: 1)"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    if args.command == "sync":
+        if args.depth is not None:
+            config.ORGANIZE_MAX_DEPTH = args.depth
+        if args.excludes:
+            config.ORGANIZE_EXCLUDES = args.excludes
+        folders = [] if args.no_sort else (
+            args.folders or [config.DOWNLOADS_DIR]
+        )
+        if args.watch:
+            try:
+                run_forever(
+                    args.interval, not args.no_email, folders, args.workers
+                )
+            except KeyboardInterrupt:
+                pass
+        else:
+            status = run_once(not args.no_email, folders)
+            failed = any("error" in job for job in status["jobs"].values())
+            return 1 if failed else 0
+    elif args.command == "watch":
+        try:
+            watch(args.folders, args.settle)
+        except KeyboardInterrupt:
+            pass
+    return 0
@@ -0,0 +1,131 @@
+"""Runtime settings shared by the dashboard and the command line.
+
+Values come from Streamlit-style secrets: the dashboard passes
+``st.secrets`` to ``configure()``; headless runs read
+``.streamlit/secrets.toml`` (project, then ``~/.streamlit``) and fall back
+to the ``EMAIL_USER`` / ``EMAIL_PASS`` environment variables.
+"""
+import os
+from pathlib import Path
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+    import toml
+
+FILE_CATEGORIES = {
+    ".pdf": "PDFs",
+    ".docx": "WordDocs",
+    ".doc": "WordDocs",
+    ".xlsx": "Excels",
+    ".xls": "Excels",
+    ".pptx": "PowerPoints",
+    ".ppt": "PowerPoints"
+}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+IMAP_MAILBOX = "inbox"
+
+
+def load_secrets():
+    """Read secrets.toml the way Streamlit does, without Streamlit."""
+    secrets = {}
+    for path in (Path.home() / ".streamlit" / "secrets.toml",
+                 Path.cwd() / ".streamlit" / "secrets.toml"):
+        if not path.is_file():
+            continue
+        if tomllib is None:
+            secrets.update(toml.load(str(path)))
+        else:
+            with open(path, "rb") as f:
+                secrets.update(tomllib.load(f))
+    return secrets
+
+
+def configure(secrets=None, base_dir=None):
+    """(Re)load every setting from a secrets mapping.
+
+    Paths derived from the base directory are recomputed, so passing
+    base_dir points the whole app at another location.
+    """
+    global EMAIL, APP_PASSWORD, DOWNLOADS_DIR, BASE_DIR, LOG_FILE, INDEX_FILE
+    global HASH_ALGORITHM, IMAP_HOST, IMAP_PORT, IMAP_SSL, IMAP_POOL_SIZE
+    global IMAP_BATCH_SIZE, INITIAL_SYNC_DAYS, ATTACHMENT_CHUNK_SIZE
+    global IMAP_MAX_IN_FLIGHT, ORGANIZE_WORKERS, ORGANIZE_BATCH_SIZE
+    global ORGANIZE_MAX_DEPTH, ORGANIZE_EXCLUDES
+    global LOG_ROTATE_BYTES, LOG_ROTATE_DAYS, LOG_RETENTION_DAYS
+    global LOG_BATCH_SIZE, LOG_BATCH_DELAY, LOG_FSYNC, SNIFF_CONTENT
+    global OBJECT_STORE
+    secrets = load_secrets() if secrets is None else secrets
+
+    credentials = secrets.get("email", {})
+    EMAIL = credentials.get("email_user") or os.environ.get("EMAIL_USER")
+    APP_PASSWORD = (
+        credentials.get("email_pass") or os.environ.get("EMAIL_PASS")
+    )
+
+    DOWNLOADS_DIR = str(Path.home() / "Downloads")
+    BASE_DIR = base_dir or os.path.join(DOWNLOADS_DIR, "EmailDownloads")
+    LOG_FILE = os.path.join(BASE_DIR, "download_log.txt")
+    INDEX_FILE = os.path.join(BASE_DIR, "download_index.db")
+
+    # Content hash used for dedup: "md5" (default), "blake2b", or "xxh3"
+    # when the xxhash package is installed. Digests other than MD5 are
+    # logged with an "<algorithm>:" prefix, so existing MD5 entries stay
+    # valid.
+    HASH_ALGORITHM = secrets.get("hash_algorithm", "md5")
+
+    # IMAP server and fetch concurrency. Point host/port at a local server
+    # with imap_ssl = false to run against a stand-in.
+    IMAP_HOST = secrets.get("imap_host", "imap.gmail.com")
+    IMAP_PORT = int(secrets.get("imap_port", 993))
+    IMAP_SSL = bool(secrets.get("imap_ssl", True))
+    IMAP_POOL_SIZE = int(secrets.get("imap_pool_size", 4))
+    IMAP_BATCH_SIZE = int(secrets.get("imap_batch_size", 50))
+    # How far back the first sync of a mailbox looks; later syncs resume
+    # from the last UID processed.
+    INITIAL_SYNC_DAYS = int(secrets.get("initial_sync_days", 1))
+    # Attachments are fetched in pieces of this many (encoded) bytes, and
+    # at most IMAP_MAX_IN_FLIGHT fetch batches are buffered ahead of the
+    # writer. Together with IMAP_BATCH_SIZE these bound memory use.
+    ATTACHMENT_CHUNK_SIZE = int(
+        secrets.get("attachment_chunk_size", 1024 * 1024)
+    )
+    IMAP_MAX_IN_FLIGHT = int(
+        secrets.get("imap_max_in_flight", IMAP_POOL_SIZE)
+    )
+    # Folder sorting hashes and moves files on this many threads, handing
+    # each one ORGANIZE_BATCH_SIZE directory entries at a time.
+    ORGANIZE_WORKERS = int(
+        secrets.get("organize_workers", min(32, (os.cpu_count() or 1) + 4))
+    )
+    ORGANIZE_BATCH_SIZE = int(secrets.get("organize_batch_size", 64))
+    # How many subfolder levels sorting descends into (0: top level only,
+    # -1: no limit) and glob / "re:"-prefixed regex patterns to skip.
+    ORGANIZE_MAX_DEPTH = int(secrets.get("organize_max_depth", 0))
+    ORGANIZE_EXCLUDES = list(secrets.get("organize_excludes", []))
+    # Recognise PDFs and Office documents by content too (see sniff), so
+    # files with a missing or wrong extension are still filed correctly.
+    SNIFF_CONTENT = bool(secrets.get("sniff_content", True))
+    # Keep each distinct file once under BASE_DIR/.objects and make the
+    # files in category folders hard links to it (see objects).
+    OBJECT_STORE = bool(secrets.get("object_store", False))
+    # download_log.txt is rotated into gzip archives once it reaches
+    # log_rotate_mb or its first entry is log_rotate_days old (0 turns a
+    # limit off); archives older than log_retention_days are deleted
+    # (0: keep them all). Counts and dedup hashes outlive their archive.
+    LOG_ROTATE_BYTES = int(
+        float(secrets.get("log_rotate_mb", 64)) * 1024 * 1024
+    )
+    LOG_ROTATE_DAYS = int(secrets.get("log_rotate_days", 30))
+    LOG_RETENTION_DAYS = int(secrets.get("log_retention_days", 0))
+    # Log records are buffered and appended in one write once
+    # log_batch_size are waiting or the oldest is log_batch_delay seconds
+    # old; log_fsync makes each append durable before it returns.
+    LOG_BATCH_SIZE = int(secrets.get("log_batch_size", 64))
+    LOG_BATCH_DELAY = float(secrets.get("log_batch_delay", 1.0))
+    LOG_FSYNC = bool(secrets.get("log_fsync", False))
+
+
+configure()
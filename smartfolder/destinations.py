@@ -0,0 +1,115 @@
+"""Putting files into folders without overwriting anything.
+
+Files are written to a temporary name and then given their final name in
+one step that fails, rather than replaces, if the name is taken: a hard
+link where the filesystem has them, otherwise an exclusively created
+placeholder that the file is renamed over. A Destination lists its
+folder once per batch and picks the first free name for each file,
+suffixing " (1)", " (2)", ... before the extension on a clash, so a
+different file with the same name is kept beside the earlier one instead
+of replacing it or being skipped.
+"""
+import errno
+import os
+import shutil
+import tempfile
+import threading
+
+# Errors from os.link that mean "no hard link here", not "fail".
+NO_LINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP,
+                  errno.EOPNOTSUPP, errno.ENOSYS}
+
+
+def rename_new(src, dst):
+    """Rename src to dst, raising FileExistsError if dst exists.
+
+    Readers never see a partly written dst: across devices src is first
+    copied to a temporary file beside dst.
+    """
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in NO_LINK_ERRNOS:
+            raise
+        _rename_over_placeholder(src, dst, copy=e.errno == errno.EXDEV)
+        return
+    os.remove(src)
+
+
+def _rename_over_placeholder(src, dst, copy):
+    """Claim dst with an empty file, then rename (or copy) src over it."""
+    os.close(os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    try:
+        if copy:
+            _copy_over(src, dst)
+        else:
+            os.replace(src, dst)
+    except BaseException:
+        os.remove(dst)
+        raise
+    if copy:
+        os.remove(src)
+
+
+def _copy_over(src, dst):
+    """Replace dst with a copy of src, made beside dst first."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(dst), prefix=".incoming-"
+    )
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class Destination:
+    """A folder files are saved into, with its names listed once.
+
+    Names handed out by reserve() count as taken from then on, so files
+    in one batch never collide with each other either. Safe to share
+    between threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._names = None
+        self._lock = threading.Lock()
+
+    def reserve(self, name, relist=False):
+        """Return the path of the first free name for name in the folder.
+
+        Names are compared case-insensitively, so the result is free on
+        case-insensitive filesystems too. relist reads the folder again,
+        for when another process has taken names since.
+        """
+        with self._lock:
+            if self._names is None or relist:
+                listed = {n.casefold() for n in os.listdir(self.path)}
+                self._names = listed | (self._names or set())
+            stem, ext = os.path.splitext(name)
+            candidate, n = name, 0
+            while candidate.casefold() in self._names:
+                n += 1
+                candidate = f"{stem} ({n}){ext}"
+            self._names.add(candidate.casefold())
+            return os.path.join(self.path, candidate)
+
+    def put(self, name, place, path=None):
+        """Create a file under the first free name for name; return its path.
+
+        place(path) creates the file, raising FileExistsError rather than
+        replacing one (see rename_new); if another process took the name
+        first, the next free one is tried. path is one already reserved.
+        """
+        path = path or self.reserve(name)
+        while True:
+            try:
+                place(path)
+                return path
+            except FileExistsError:
+                path = self.reserve(name, relist=True)
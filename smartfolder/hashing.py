@@ -0,0 +1,66 @@
+"""Content hashing for dedup: streaming full digests."""
+import hashlib
+import os
+
+from . import config
+
+try:
+    import xxhash
+except ImportError:  # optional fast hash
+    xxhash = None
+
+
+def new_hasher(algorithm):
+    if algorithm == "xxh3":
+        if xxhash is None:
+            raise ValueError("xxh3 hashing requires the xxhash package")
+        return xxhash.xxh3_128()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.new(algorithm)
+
+
+def file_hash(source, algorithm=None):
+    """Hash bytes, a file path, or a binary file-like object.
+
+    Paths and file objects are read in config.HASH_CHUNK_SIZE chunks, so memory
+    use does not grow with file size. File objects are read from their
+    current position.
+    """
+    algorithm = algorithm or config.HASH_ALGORITHM
+    hasher = new_hasher(algorithm)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        hasher.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            _hash_stream(hasher, f)
+    else:
+        _hash_stream(hasher, source)
+    return hex_digest(hasher, algorithm)
+
+
+def hex_digest(hasher, algorithm):
+    digest = hasher.hexdigest()
+    return digest if algorithm == "md5" else f"{algorithm}:{digest}"
+
+
+def digest_algorithm(digest):
+    """Return the algorithm that produced a logged digest."""
+    return digest.split(":", 1)[0] if ":" in digest else "md5"
+
+
+def _hash_stream(hasher, f):
+    buf = bytearray(config.HASH_CHUNK_SIZE)
+    view = memoryview(buf)
+    readinto = getattr(f, "readinto", None)
+    while True:
+        if readinto is not None:
+            n = readinto(buf)
+            if not n:
+                break
+            hasher.update(view[:n])
+        else:
+            chunk = f.read(config.HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
@@ -0,0 +1,583 @@
+"""IMAP access: a pooled, batched fetcher and the attachment stream."""
+import binascii
+import datetime
+import email
+import email.header
+import email.utils
+import imaplib
+import logging
+import os
+import queue
+import quopri
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from . import config
+from .index import ensure_log, normalize_sender, open_index
+from .rules import current_rules
+from .sniff import HEAD_BYTES, could_be_document
+
+log = logging.getLogger(__name__)
+
+
+def connect_to_gmail():
+    if config.IMAP_SSL:
+        mail = imaplib.IMAP4_SSL(config.IMAP_HOST, config.IMAP_PORT)
+    else:
+        mail = imaplib.IMAP4(config.IMAP_HOST, config.IMAP_PORT)
+    mail.login(config.EMAIL, config.APP_PASSWORD)
+    mail.select(config.IMAP_MAILBOX)
+    return mail
+
+
+_FETCH_TOKEN = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}\Z'
+    rb'|((?:[^\s()"\[\]]+|\[[^\]]*\])+))'
+)
+
+
+def _fetch_tokens(data):
+    """Flatten an imaplib FETCH response into tokens, literals included."""
+    for item in data:
+        if item is None:
+            continue
+        head, literal = item if isinstance(item, tuple) else (item, None)
+        pos = 0
+        while pos < len(head):
+            m = _FETCH_TOKEN.match(head, pos)
+            if not m or m.end() == pos:
+                break
+            pos = m.end()
+            opening, closing_, quoted, size, atom = m.groups()
+            if opening:
+                yield "("
+            elif closing_:
+                yield ")"
+            elif quoted is not None:
+                yield re.sub(rb"\\(.)", rb"\1", quoted)
+            elif size is not None:
+                yield literal if literal is not None else b""
+            elif atom is not None:
+                yield None if atom.upper() == b"NIL" else atom
+
+
+def _nest(tokens):
+    out = []
+    for token in tokens:
+        if token == "(":
+            out.append(_nest(tokens))
+        elif token == ")":
+            return out
+        else:
+            out.append(token)
+    return out
+
+
+def parse_fetch_response(data):
+    """Parse UID FETCH results into one {ITEM: value} dict per message.
+
+    Parenthesized lists (e.g. BODYSTRUCTURE) become nested Python lists;
+    literals and strings are bytes, NIL is None.
+    """
+    messages = []
+    flat = _nest(iter(list(_fetch_tokens(data))))
+    for value in flat:
+        if isinstance(value, list):
+            pairs = iter(value)
+            messages.append({
+                key.upper().decode("ascii", "replace"): item
+                for key, item in zip(pairs, pairs)
+                if isinstance(key, bytes)
+            })
+    return messages
+
+
+class IMAPPool:
+    """A few logged-in IMAP connections shared by fetch worker threads.
+
+    UID FETCH requests are split into batches of ``batch_size`` and spread
+    across the pool; results come back in the order the UIDs were given.
+    At most ``max_in_flight`` batches are fetched ahead of the consumer.
+    No more than ``size`` connections are ever open: every command, the
+    consumer's own (fetch_part, search, ...) included, waits for one.
+    """
+
+    def __init__(self, size=None, batch_size=None, connect=None,
+                 max_in_flight=None):
+        self.size = max(1, size or config.IMAP_POOL_SIZE)
+        self.batch_size = max(1, batch_size or config.IMAP_BATCH_SIZE)
+        self.max_in_flight = max(1, max_in_flight or config.IMAP_MAX_IN_FLIGHT)
+        self._connect = connect or connect_to_gmail
+        self._idle = queue.LifoQueue()
+        self._checkouts = threading.BoundedSemaphore(self.size)
+        self._executor = ThreadPoolExecutor(
+            self.size, thread_name_prefix="imap-fetch"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while not self._idle.empty():
+            try:
+                self._idle.get_nowait().logout()
+            except Exception:
+                pass
+
+    def _run(self, command, *args):
+        return self._with_connection(lambda mail: mail.uid(command, *args))
+
+    def _with_connection(self, action):
+        # A connection is only opened when none is idle and fewer than
+        # `size` are checked out, so at most `size` are ever open.
+        with self._checkouts:
+            try:
+                mail = self._idle.get_nowait()
+            except queue.Empty:
+                mail = self._connect()
+            try:
+                result = action(mail)
+            except Exception:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+                raise
+            self._idle.put(mail)
+            return result
+
+    def mailbox_state(self, mailbox=None):
+        """Re-select the mailbox and return (UIDVALIDITY, HIGHESTMODSEQ).
+
+        HIGHESTMODSEQ is None unless the server supports CONDSTORE.
+        """
+        def select(mail):
+            status, data = mail.select(mailbox or config.IMAP_MAILBOX)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"SELECT failed: {data}")
+            validity = mail.response("UIDVALIDITY")[1][0]
+            modseq = mail.response("HIGHESTMODSEQ")[1][0]
+            return int(validity), int(modseq) if modseq else None
+        return self._with_connection(select)
+
+    def search(self, criteria):
+        status, data = self._run("SEARCH", None, criteria)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+        return [int(uid) for uid in data[0].split()] if data[0] else []
+
+    def _fetch_batch(self, batch, query):
+        try:
+            uid_set = ",".join(str(uid) for uid in batch)
+            status, data = self._run("FETCH", uid_set, query)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        except Exception as e:
+            return {}, e
+        found = {}
+        for item in parse_fetch_response(data):
+            if item.get("UID") is not None:
+                found[int(item["UID"])] = item
+        return found, None
+
+    def fetch(self, uids, query):
+        """Yield (uid, items, error) for each UID, in the order given."""
+        uids = list(uids)
+        return self.fetch_batches(
+            (uids[i:i + self.batch_size], query)
+            for i in range(0, len(uids), self.batch_size)
+        )
+
+    def fetch_batches(self, requests):
+        """Like fetch(), for an iterable of (uids, query) batches."""
+        requests = iter(requests)
+        pending = deque()
+
+        def submit():
+            for batch, query in requests:
+                pending.append((batch, self._executor.submit(
+                    self._fetch_batch, batch, query
+                )))
+                return
+
+        for _ in range(self.max_in_flight):
+            submit()
+        while pending:
+            batch, future = pending.popleft()
+            found, error = future.result()
+            submit()
+            for uid in batch:
+                if error is not None:
+                    yield uid, None, error
+                elif uid in found:
+                    yield uid, found[uid], None
+
+    def fetch_part(self, uid, section, offset, length):
+        """Fetch one byte range of a MIME part of a single message."""
+        status, data = self._run(
+            "FETCH", str(uid), f"(UID BODY.PEEK[{section}]<{offset}.{length}>)"
+        )
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        for item in parse_fetch_response(data):
+            if item.get("UID") is not None and int(item["UID"]) == uid:
+                return item.get(f"BODY[{section}]<{offset}>") or b""
+        return b""
+
+
+def _decode_filename(params):
+    """Pull a filename out of BODYSTRUCTURE parameter pairs.
+
+    Handles RFC 2231 (filename*, filename*0*) and RFC 2047 encoded words.
+    """
+    if not params:
+        return None
+    pairs = [
+        (params[i].decode("ascii", "replace").lower(),
+         '"%s"' % params[i + 1].decode("utf-8", "replace")
+         .replace("\\", "\\\\").replace('"', '\\"'))
+        for i in range(0, len(params) - 1, 2)
+        if isinstance(params[i], bytes) and isinstance(params[i + 1], bytes)
+    ]
+    for name, value in email.utils.decode_params([("", "")] + pairs)[1:]:
+        if name in ("filename", "name"):
+            value = email.utils.unquote(
+                email.utils.collapse_rfc2231_value(value)
+            )
+            return str(email.header.make_header(
+                email.header.decode_header(value)
+            ))
+    return None
+
+
+def attachment_parts(structure, section=""):
+    """Yield (section, filename, encoding, size, mime type) per named leaf.
+
+    Walks a parsed BODYSTRUCTURE the way msg.walk() walks a message,
+    including attached message/rfc822 parts. Only parts that carry a
+    Content-Disposition and a filename are yielded, as before.
+    """
+    if structure and isinstance(structure[0], list):
+        for i, child in enumerate(
+            (c for c in structure if isinstance(c, list)), 1
+        ):
+            yield from attachment_parts(
+                child, f"{section}.{i}" if section else str(i)
+            )
+        return
+    section = section or "1"
+    maintype = (structure[0] or b"").decode("ascii", "replace").lower()
+    subtype = (structure[1] or b"").decode("ascii", "replace").lower()
+    # Extension data starts after the basic fields, which are longer for
+    # text (line count) and message/rfc822 (envelope, body, line count).
+    ext = 7
+    if maintype == "text":
+        ext = 8
+    elif (maintype, subtype) == ("message", "rfc822"):
+        ext = 10
+        inner = structure[8] if len(structure) > 8 else None
+        if isinstance(inner, list) and inner:
+            if isinstance(inner[0], list):
+                yield from attachment_parts(inner, section)
+            else:
+                yield from attachment_parts(inner, f"{section}.1")
+    disposition = structure[ext + 1] if len(structure) > ext + 1 else None
+    if not isinstance(disposition, list):
+        return
+    filename = _decode_filename(
+        disposition[1] if len(disposition) > 1 else None
+    ) or _decode_filename(structure[2])
+    if filename:
+        encoding = (structure[5] or b"7bit").decode("ascii", "replace")
+        size = int(structure[6]) if (structure[6] or b"").isdigit() else 0
+        yield (section, filename, encoding.lower(), size,
+               f"{maintype}/{subtype}")
+
+
+# MIME types of parts fetched (and then sniffed) even when the filename's
+# extension is missing or not categorized.
+DOCUMENT_MIME_TYPES = {
+    "application/pdf", "application/msword", "application/vnd.ms-excel",
+    "application/vnd.ms-powerpoint", "application/octet-stream",
+}
+
+
+def wanted_part(filename, mime_type):
+    """Whether an attachment part may hold a document to file."""
+    if os.path.splitext(filename)[1].lower() in config.FILE_CATEGORIES:
+        return True
+    return config.SNIFF_CONTENT and (
+        mime_type in DOCUMENT_MIME_TYPES or mime_type.startswith(
+            "application/vnd.openxmlformats-officedocument."
+        )
+    )
+
+
+def decoded_size_range(size, encoding):
+    """Bounds (min, max) on the decoded size of a part whose encoded size,
+    as BODYSTRUCTURE gives it, is size.
+
+    base64 allows for a line break every 60 or more characters, and
+    quoted-printable for anything from no escapes to escaping every byte.
+    """
+    if encoding == "base64":
+        return max(0, size * 60 // 62 * 3 // 4 - 2), size * 3 // 4
+    if encoding == "quoted-printable":
+        return size // 3, size
+    return size, size
+
+
+def ruled_out(rules, part, sender):
+    """Whether rules skip an attachment part before any of it is fetched.
+
+    Judged by the part's filename extension and decoded size range; parts
+    whose type is only known once sniffed are checked after download.
+    """
+    _, filename, encoding, size, _ = part
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in config.FILE_CATEGORIES:
+        return not rules.accepts_sender(sender)
+    return rules.skips(
+        filename, ext, *decoded_size_range(size, encoding), sender
+    )
+
+
+def worth_fetching(filename, first, encoding):
+    """Whether to fetch the rest of a part, given its first chunk.
+
+    Parts wanted only for their MIME type (see wanted_part) are dropped
+    once their first bytes show they are not a document sniffing would
+    recognise.
+    """
+    if os.path.splitext(filename)[1].lower() in config.FILE_CATEGORIES:
+        return True
+    # Enough encoded bytes for HEAD_BYTES decoded, with line breaks.
+    head = first[:2 * HEAD_BYTES]
+    try:
+        head = next(decode_chunks([head], encoding), b"")
+    except (binascii.Error, ValueError):
+        return True
+    return could_be_document(head)
+
+
+def decode_chunks(chunks, encoding):
+    """Decode a transfer-encoded part piece by piece.
+
+    Each chunk is split at the last boundary the encoding can decode on
+    its own (4-byte base64 groups, line ends for quoted-printable); the
+    remainder is carried into the next chunk.
+    """
+    if encoding not in ("base64", "quoted-printable"):
+        yield from chunks
+        return
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        if encoding == "base64":
+            pending = pending.translate(None, b" \t\r\n")
+            cut = len(pending) - len(pending) % 4
+        else:
+            cut = pending.rfind(b"\n") + 1
+        if cut:
+            ready, pending = pending[:cut], pending[cut:]
+            yield (binascii.a2b_base64(ready) if encoding == "base64"
+                   else quopri.decodestring(ready))
+    if pending:
+        yield (binascii.a2b_base64(pending) if encoding == "base64"
+               else quopri.decodestring(pending))
+
+
+class PartStream:
+    """An attachment's decoded bytes, fetched as they are iterated.
+
+    A consumer that cannot save them calls failed(), which keeps the
+    message below the mailbox watermark so the next sync fetches it again.
+    """
+
+    def __init__(self, chunks, on_failure):
+        self._chunks = chunks
+        self._on_failure = on_failure
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def failed(self):
+        self._on_failure()
+
+
+def new_message_uids(pool, conn, mailbox=None):
+    """Return (uids, state) for messages not yet synced from a mailbox.
+
+    Sync resumes after the last UID processed as long as UIDVALIDITY is
+    unchanged. When the server reports HIGHESTMODSEQ (CONDSTORE) and it has
+    not moved, nothing changed and the search is skipped. The first sync,
+    or one after UIDVALIDITY changes, looks back config.INITIAL_SYNC_DAYS.
+    """
+    key = f"{config.EMAIL}/{mailbox or config.IMAP_MAILBOX}"
+    validity, modseq = pool.mailbox_state(mailbox)
+    row = conn.execute(
+        "SELECT uidvalidity, last_uid, highest_modseq FROM imap_state "
+        "WHERE mailbox = ?", (key,)
+    ).fetchone()
+    if row and row[0] == validity:
+        last_uid = row[1]
+        if modseq is not None and row[2] == modseq:
+            return [], (key, validity, last_uid, modseq)
+        # "n:*" always matches the newest message, even if it is below n.
+        uids = [
+            uid for uid in pool.search(f"UID {last_uid + 1}:*")
+            if uid > last_uid
+        ]
+    else:
+        last_uid = 0
+        since = datetime.timedelta(days=config.INITIAL_SYNC_DAYS)
+        date = (datetime.date.today() - since).strftime("%d-%b-%Y")
+        uids = pool.search(f'(SINCE "{date}")')
+    return uids, (key, validity, last_uid, modseq)
+
+
+def save_sync_state(conn, state, uids, failed):
+    """Advance the mailbox watermark past every UID fully processed.
+
+    The watermark stops below the first failed message so it is retried
+    next time, and the MODSEQ shortcut is disabled until it succeeds.
+    """
+    key, validity, last_uid, modseq = state
+    if failed:
+        last_uid = max(last_uid, min(failed) - 1)
+        modseq = None
+    elif uids:
+        last_uid = max(last_uid, max(uids))
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO imap_state VALUES (?, ?, ?, ?)",
+            (key, validity, last_uid, modseq)
+        )
+
+
+def fetch_attachments(rules=None):
+    """Stream the attachments of new emails without downloading bodies.
+
+    Yields (filename, chunks, email_from) as parts arrive, where chunks is
+    a PartStream of decoded bytes. Only messages newer than the mailbox
+    watermark are considered. BODYSTRUCTURE and the From header are fetched
+    first; only the MIME parts whose filename maps to a config.FILE_CATEGORIES
+    folder, or whose MIME type is a document type and whose first chunk
+    could start one (see wanted_part, worth_fetching), are then fetched
+    with BODY.PEEK[<section>], in pieces of config.ATTACHMENT_CHUNK_SIZE,
+    so memory use does not depend on how many or how large the
+    attachments are. Parts that rules (default: the saved Settings) would
+    skip for their sender, extension or size are never fetched (see
+    ruled_out). The watermark advances once every yielded
+    attachment has been consumed, and not past a message whose fetch
+    failed or whose attachment the consumer reported it could not save.
+    """
+    ensure_log()
+    try:
+        rules = rules or current_rules()
+        with IMAPPool() as pool, closing(open_index()) as conn:
+            email_ids, sync_state = new_message_uids(pool, conn)
+            failed = set()
+
+            # Pass 1: structure and sender only.
+            wanted = {}
+            senders = {}
+            structures = pool.fetch(
+                email_ids,
+                "(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM)])"
+            )
+            for email_id, data, error in structures:
+                try:
+                    if error is not None:
+                        raise error
+                    header = next(
+                        (v for k, v in data.items()
+                         if k.startswith("BODY[HEADER")), b""
+                    ) or b""
+                    senders[email_id] = email.message_from_bytes(
+                        header
+                    ).get("From", "Unknown")
+                    sender = normalize_sender(senders[email_id])
+                    parts = [
+                        part for part in attachment_parts(
+                            data.get("BODYSTRUCTURE") or []
+                        )
+                        if wanted_part(part[1], part[4])
+                        and not ruled_out(rules, part, sender)
+                    ]
+                    if parts:
+                        wanted[email_id] = parts
+                except Exception as e:
+                    failed.add(email_id)
+                    log.warning("Error processing email %s: %s", email_id, e)
+
+            # Pass 2: the first chunk of each wanted part, batching runs of
+            # messages that need the same sections into one request.
+            def part_requests():
+                batch, batch_sections = [], None
+                for email_id, parts in wanted.items():
+                    sections = tuple(part[0] for part in parts)
+                    if batch and (sections != batch_sections
+                                  or len(batch) >= pool.batch_size):
+                        yield batch, _part_query(batch_sections)
+                        batch = []
+                    batch.append(email_id)
+                    batch_sections = sections
+                if batch:
+                    yield batch, _part_query(batch_sections)
+
+            def part_chunks(email_id, section, first):
+                # Continue with ranged fetches until a short chunk.
+                chunk, offset = first, 0
+                try:
+                    while True:
+                        yield chunk
+                        offset += len(chunk)
+                        if len(chunk) < config.ATTACHMENT_CHUNK_SIZE:
+                            return
+                        chunk = pool.fetch_part(
+                            email_id, section, offset, config.ATTACHMENT_CHUNK_SIZE
+                        )
+                except Exception:
+                    failed.add(email_id)
+                    raise
+
+            for email_id, data, error in pool.fetch_batches(part_requests()):
+                if error is not None:
+                    failed.add(email_id)
+                    log.warning("Error processing email %s: %s", email_id, error)
+                    continue
+                for section, filename, encoding, _, _ in wanted[email_id]:
+                    first = (data.get(f"BODY[{section}]<0>")
+                             or data.get(f"BODY[{section}]") or b"")
+                    if first and worth_fetching(filename, first, encoding):
+                        yield (
+                            filename,
+                            PartStream(
+                                decode_chunks(
+                                    part_chunks(email_id, section, first),
+                                    encoding
+                                ),
+                                lambda email_id=email_id: failed.add(email_id)
+                            ),
+                            senders[email_id]
+                        )
+
+            save_sync_state(conn, sync_state, email_ids, failed)
+
+    except Exception as e:
+        log.error("Email fetch failed: %s", e)
+
+
+def _part_query(sections):
+    return "(UID %s)" % " ".join(
+        f"BODY.PEEK[{section}]<0.{config.ATTACHMENT_CHUNK_SIZE}>"
+        for section in sections
+    )
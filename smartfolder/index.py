@@ -0,0 +1,554 @@
+"""The download log and the SQLite index kept alongside it.
+
+download_log.txt is the append-only record of every file handled; it is
+rotated into archived segments as it grows (see logfile). The index
+(download_index.db) is derived from it and holds the dedup hash set, a
+stat cache, per-mailbox sync state, and the daily counts and sender index
+behind the Audit Log tab. These outlive the archived
+segments they were counted from.
+"""
+import datetime
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+from contextlib import closing
+
+from . import config
+from .hashing import digest_algorithm, file_hash
+from .logfile import (
+    append_log, ensure_log, first_segment, live_segment, log_lock,
+    prune_archives, read_log, rotate_log, rotation_due
+)
+
+# Bumped whenever the tables derived from log lines change, so existing
+# indexes re-read the log once to fill them.
+DERIVED_VERSION = "2"
+# Claims on content not logged within this many seconds (the claiming
+# process died) are given up.
+CLAIM_TIMEOUT = 3600
+
+
+def open_index():
+    """Open the hash index, folding in any log lines it has not seen yet.
+
+    The index is a SQLite table keyed by hash, so dedup checks are a
+    primary-key lookup instead of a scan of the whole log. It remembers
+    which log segment and how far into it it has read; a fresh index is
+    rebuilt from the archived segments and the live log on first use.
+
+    It also holds a stat cache of digests for files already seen on
+    disk, per-day file counts by type and source for the Audit Log
+    charts, sniffed document types by hash and the files on disk sniffed
+    as not documents (see sniff), and claims on content being saved but
+    not logged yet (see claim_hash).
+    """
+    ensure_log()
+    conn = sqlite3.connect(config.INDEX_FILE, timeout=30)
+    # WAL lets concurrent organizer workers read while one commits, and
+    # NORMAL sync skips the per-commit fsync (the TSV log is the record).
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS hashes (hash TEXT PRIMARY KEY)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        # Size fingerprints kept by earlier versions, no longer used.
+        conn.execute("DROP TABLE IF EXISTS fingerprints")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS imap_state ("
+            "mailbox TEXT PRIMARY KEY, uidvalidity INTEGER NOT NULL, "
+            "last_uid INTEGER NOT NULL, highest_modseq INTEGER)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stat_cache ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, "
+            "hash TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily_counts ("
+            "day TEXT NOT NULL, type TEXT NOT NULL, source TEXT NOT NULL, "
+            "files INTEGER NOT NULL, PRIMARY KEY (day, type, source))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS senders ("
+            "id INTEGER PRIMARY KEY, address TEXT NOT NULL UNIQUE, "
+            "files INTEGER NOT NULL, last_seen TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sender_months ("
+            "sender_id INTEGER NOT NULL, month TEXT NOT NULL, "
+            "files INTEGER NOT NULL, PRIMARY KEY (sender_id, month))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS content_types ("
+            "hash TEXT PRIMARY KEY, ext TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sniff_misses ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS claims ("
+            "hash TEXT PRIMARY KEY, claimed_at REAL NOT NULL)"
+        )
+    sync_index(conn)
+    return conn
+
+
+def file_type(filename):
+    """Upper-case extension without the dot, or "UNKNOWN"."""
+    ext = filename.rsplit(".", 1)[1] if "." in filename else ""
+    return ext.upper() or "UNKNOWN"
+
+
+def base_source(source_info):
+    """"Email (sender)" -> "Email"; other sources are returned as-is."""
+    if "(" in source_info and ")" in source_info:
+        return source_info.split("(")[0].strip()
+    return source_info.strip()
+
+
+def sender_of(source_info):
+    """Normalized sender address from "Email (sender)", or None.
+
+    "Name <addr>" is reduced to the address, and case is folded, so one
+    mailbox is always the same sender.
+    """
+    if "(" not in source_info or ")" not in source_info:
+        return None
+    return normalize_sender(
+        source_info[source_info.find("(") + 1:source_info.find(")")]
+    )
+
+
+def normalize_sender(sender):
+    """"Name <Addr@Example.com>" -> "addr@example.com"; None if empty."""
+    match = re.search(r"<([^>]*)>", sender or "")
+    sender = (match.group(1) if match else sender or "").strip().lower()
+    return sender or None
+
+
+def _log_position(conn):
+    """(segment, offset) of the next log byte to index."""
+    rows = dict(conn.execute(
+        "SELECT key, value FROM meta WHERE key IN ('log_segment', 'log_offset')"
+    ))
+    # Indexes from before rotation read only the first segment.
+    return int(rows.get("log_segment", 1)), int(rows.get("log_offset", 0))
+
+
+def sync_index(conn):
+    """Index every complete log line appended since the last sync.
+
+    Runs under a write lock, so concurrent syncs never count a line twice
+    in the derived counts, and catches up across segments rotated away
+    since the last sync.
+    """
+    try:
+        position = live_segment(), os.path.getsize(config.LOG_FILE)
+    except FileNotFoundError:
+        position = None  # mid-rotation
+    if position == _log_position(conn):
+        return
+    with log_lock(), conn:
+        conn.execute("BEGIN IMMEDIATE")
+        segment, offset = _log_position(conn)
+        indexed = segment, offset
+        version = conn.execute(
+            "SELECT value FROM meta WHERE key = 'derived_version'"
+        ).fetchone()
+        try:
+            blocks = read_log(segment, offset, config.HASH_CHUNK_SIZE)
+        except ValueError:
+            version = None
+            indexed = segment, 0  # the live log was replaced
+        merge = False
+        if version != (DERIVED_VERSION,):
+            # The log was truncated or replaced, or the derived tables
+            # predate this index: rebuild from every segment still kept.
+            segment, offset = first_segment(), 0
+            # Once retention has pruned the oldest archives, their counts
+            # and hashes exist only here, so they are merged, not wiped.
+            merge = segment > 1
+            if not merge:
+                for table in ("hashes", "daily_counts", "senders",
+                              "sender_months"):
+                    conn.execute(f"DELETE FROM {table}")
+                conn.execute("DELETE FROM meta WHERE key = 'md5_digests'")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('derived_version', ?)",
+                (DERIVED_VERSION,)
+            )
+            blocks = read_log(segment, offset, config.HASH_CHUNK_SIZE)
+            if merge:
+                blocks = _split_blocks(blocks, indexed)
+        hashes = []
+        counts = Counter()
+        sender_counts = Counter()
+        last_seen = {}
+        # When merging: what lines past the old position add.
+        fresh = Counter()
+        fresh_senders = Counter()
+        for segment, start, offset, data in blocks:
+            unseen = merge and (segment, start) >= indexed
+            for raw in data.split(b"\n")[:-1]:
+                parts = raw.decode("utf-8", "replace").strip().split("\t")
+                if len(parts) == 4:
+                    hashes.append((parts[1],))
+                    key = (
+                        parts[0][:10], file_type(parts[2]),
+                        base_source(parts[3])
+                    )
+                    counts[key] += 1
+                    if unseen:
+                        fresh[key] += 1
+                    sender = sender_of(parts[3])
+                    if sender:
+                        sender_counts[(sender, parts[0][:7])] += 1
+                        if unseen:
+                            fresh_senders[(sender, parts[0][:7])] += 1
+                        last_seen[sender] = max(
+                            parts[0], last_seen.get(sender, parts[0])
+                        )
+        conn.executemany("INSERT OR IGNORE INTO hashes VALUES (?)", hashes)
+        if any(":" not in digest for digest, in hashes):
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('md5_digests', '1')"
+            )
+        if merge:
+            _merge_counts(
+                conn, counts, fresh, sender_counts, fresh_senders, last_seen
+            )
+        else:
+            conn.executemany(
+                "INSERT INTO daily_counts VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (day, type, source) "
+                "DO UPDATE SET files = files + excluded.files",
+                [(*key, n) for key, n in counts.items()]
+            )
+            _index_senders(conn, sender_counts, last_seen)
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+            [("log_segment", str(segment)), ("log_offset", str(offset))]
+        )
+
+
+def _split_blocks(blocks, position):
+    """Split the log block holding position in two there."""
+    for segment, start, end, data in blocks:
+        if segment == position[0] and start < position[1] < end:
+            cut = position[1] - start
+            yield segment, start, position[1], data[:cut]
+            yield segment, position[1], end, data[cut:]
+        else:
+            yield segment, start, end, data
+
+
+def _index_senders(conn, sender_counts, last_seen):
+    """Intern new senders and add to their per-month file counts."""
+    totals = Counter()
+    for (sender, _), n in sender_counts.items():
+        totals[sender] += n
+    conn.executemany(
+        "INSERT INTO senders (address, files, last_seen) VALUES (?, ?, ?) "
+        "ON CONFLICT (address) DO UPDATE SET "
+        "files = files + excluded.files, "
+        "last_seen = max(last_seen, excluded.last_seen)",
+        [(sender, n, last_seen[sender]) for sender, n in totals.items()]
+    )
+    conn.executemany(
+        "INSERT INTO sender_months "
+        "SELECT id, ?, ? FROM senders WHERE address = ? "
+        "ON CONFLICT (sender_id, month) "
+        "DO UPDATE SET files = files + excluded.files",
+        [(month, n, sender) for (sender, month), n in sender_counts.items()]
+    )
+
+
+def _merge_counts(conn, counts, fresh, sender_counts, fresh_senders,
+                  last_seen):
+    """Fold counts re-read from the segments still kept into the tables.
+
+    Days and months after the first one those segments cover get the
+    re-read counts. The first may also have lines in a pruned segment, so
+    it keeps its count plus what lines not indexed before add (fresh,
+    fresh_senders); earlier ones are left as they are.
+    """
+    if not counts:
+        return
+    first_day = min(day for day, _, _ in counts)
+    conn.execute("DELETE FROM daily_counts WHERE day > ?", (first_day,))
+    conn.executemany(
+        "INSERT INTO daily_counts VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (day, type, source) DO UPDATE SET files = files + ?",
+        [(*key, n, fresh[key]) for key, n in counts.items()]
+    )
+    conn.execute(
+        "DELETE FROM sender_months WHERE month > ?", (first_day[:7],)
+    )
+    conn.executemany(
+        "INSERT INTO senders (address, files, last_seen) VALUES (?, 0, ?) "
+        "ON CONFLICT (address) DO UPDATE SET "
+        "last_seen = max(last_seen, excluded.last_seen)",
+        list(last_seen.items())
+    )
+    conn.executemany(
+        "INSERT INTO sender_months "
+        "SELECT id, ?, ? FROM senders WHERE address = ? "
+        "ON CONFLICT (sender_id, month) DO UPDATE SET files = files + ?",
+        [(month, n, sender, fresh_senders[(sender, month)])
+         for (sender, month), n in sender_counts.items()]
+    )
+    conn.execute(
+        "UPDATE senders SET files = (SELECT coalesce(sum(files), 0) "
+        "FROM sender_months WHERE sender_id = senders.id)"
+    )
+
+
+def has_been_downloaded(file_hash_value, conn=None):
+    """Whether content with this digest is in the log.
+
+    Callers that already hold an index connection pass it as conn, which
+    makes the check a single lookup; it then sees the log as of that
+    connection's last sync_index(). Without conn the index is opened and
+    synced for this one check.
+    """
+    if conn is None:
+        with closing(open_index()) as conn:
+            return has_been_downloaded(file_hash_value, conn)
+    return conn.execute(
+        "SELECT 1 FROM hashes WHERE hash = ?", (file_hash_value,)
+    ).fetchone() is not None
+
+
+def legacy_md5(conn):
+    """Whether content must also be looked up by its MD5 digest.
+
+    True while HASH_ALGORITHM is not md5 but the log holds MD5 digests,
+    logged before it was switched. sync_index notes in meta when it
+    indexes one, so the table is scanned at most once to find out.
+    """
+    if config.HASH_ALGORITHM == "md5":
+        return False
+    row = conn.execute(
+        "SELECT value FROM meta WHERE key = 'md5_digests'"
+    ).fetchone()
+    if row is None:
+        found = conn.execute(
+            "SELECT 1 FROM hashes WHERE instr(hash, ':') = 0 LIMIT 1"
+        ).fetchone() is not None
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('md5_digests', ?)",
+                (str(int(found)),)
+            )
+        return found
+    return row[0] == "1"
+
+
+def known_by_md5(conn, source):
+    """Whether content is in the log under the MD5 digest it was logged
+    with before HASH_ALGORITHM changed; source is anything file_hash()
+    reads. Always False once no MD5 digests are left (see legacy_md5)."""
+    return legacy_md5(conn) and has_been_downloaded(
+        file_hash(source, "md5"), conn
+    )
+
+
+def claim_hash(conn, file_hash_value):
+    """Reserve content for saving; False if it is logged or claimed.
+
+    The check and the claim are one write transaction, so of two sessions
+    or workers saving the same content at once exactly one gets True.
+    The claim lasts until the content is logged (LogWriter.flush) or is
+    given back with release_hash.
+    """
+    return bool(claim_hashes(conn, [file_hash_value]))
+
+
+def claim_hashes(conn, file_hash_values):
+    """claim_hash for many digests in one transaction; returns those won."""
+    wanted = list(dict.fromkeys(file_hash_values))
+    claimed = set()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        known = set()
+        for i in range(0, len(wanted), 500):
+            chunk = wanted[i:i + 500]
+            known.update(r[0] for r in conn.execute(
+                "SELECT hash FROM hashes WHERE hash IN "
+                f"({', '.join('?' * len(chunk))})", chunk
+            ))
+        now = time.time()
+        for digest in wanted:
+            if digest in known:
+                continue
+            conn.execute(
+                "DELETE FROM claims WHERE hash = ? AND claimed_at < ?",
+                (digest, now - CLAIM_TIMEOUT)
+            )
+            if conn.execute(
+                "INSERT OR IGNORE INTO claims VALUES (?, ?)", (digest, now)
+            ).rowcount == 1:
+                claimed.add(digest)
+    return claimed
+
+
+def release_hash(conn, file_hash_value):
+    """Give back a claim when saving the content failed."""
+    release_hashes(conn, [file_hash_value])
+
+
+def release_hashes(conn, file_hash_values):
+    with conn:
+        conn.executemany(
+            "DELETE FROM claims WHERE hash = ?",
+            [(digest,) for digest in file_hash_values]
+        )
+
+
+def count_hashes():
+    """Number of distinct contents in the log."""
+    with closing(open_index()) as conn:
+        return conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+
+def _stat_key(stat_result):
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+def _cached_digest(conn, path, stat_result):
+    row = conn.execute(
+        "SELECT hash FROM stat_cache WHERE path = ? AND size = ? "
+        "AND mtime_ns = ? AND inode = ?", (path, *_stat_key(stat_result))
+    ).fetchone()
+    if row and digest_algorithm(row[0]) == config.HASH_ALGORITHM:
+        return row[0]
+    return None
+
+
+def cached_file_hash(conn, path, stat_result):
+    """Return the digest of path, reading it only if its stat changed."""
+    digest = _cached_digest(conn, path, stat_result)
+    if digest:
+        return digest
+    digest = file_hash(path)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO stat_cache VALUES (?, ?, ?, ?, ?)",
+            (path, *_stat_key(stat_result), digest)
+        )
+    return digest
+
+
+def is_known_file(conn, path, stat_result):
+    """Check a file's digest against the log; returns (known, digest).
+
+    The digest comes from the stat cache when the file has not changed
+    since it was last hashed. A file not logged under it is also looked
+    up by MD5 while the log holds digests from before a hash_algorithm
+    switch (see known_by_md5).
+    """
+    digest = cached_file_hash(conn, path, stat_result)
+    known = has_been_downloaded(digest, conn) or known_by_md5(conn, path)
+    return known, digest
+
+
+class LogWriter:
+    """Buffers download records and appends them to the log together.
+
+    Records are flushed once LOG_BATCH_SIZE are waiting or the oldest has
+    waited LOG_BATCH_DELAY seconds, and when the with block exits. A flush
+    is one locked append (see logfile.append_log), after which the lines
+    are folded into the index and the records' claims are released.
+    Without conn, each flush opens the index itself; batch_size overrides
+    LOG_BATCH_SIZE.
+    """
+
+    def __init__(self, conn=None, batch_size=None):
+        self.conn = conn
+        self.batch_size = batch_size or config.LOG_BATCH_SIZE
+        self._records = []
+        self._oldest = None
+
+    def add(self, file_hash_value, filename, source="Email", email_from=None):
+        """Queue one processed file; see log_download for the fields."""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        source_info = f"{source} ({email_from})" if email_from else source
+        self._records.append((
+            f"{timestamp}\t{file_hash_value}\t{filename}\t{source_info}\n",
+            file_hash_value
+        ))
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if (len(self._records) >= self.batch_size
+                or time.monotonic() - self._oldest >= config.LOG_BATCH_DELAY):
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        records, self._records, self._oldest = self._records, [], None
+        append_log("".join(line for line, _ in records).encode("utf-8"))
+        if self.conn is None:
+            with closing(open_index()) as conn:
+                self._index(conn, records)
+        else:
+            sync_index(self.conn)
+            self._index(self.conn, records)
+
+    @staticmethod
+    def _index(conn, records):
+        with conn:
+            conn.executemany(
+                "DELETE FROM claims WHERE hash = ?",
+                [(file_hash_value,) for _, file_hash_value in records]
+            )
+        rotate_if_due(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def log_download(file_hash_value, filename, source="Email", email_from=None,
+                 conn=None):
+    """Log a processed file with timestamp, source, and email information.
+
+    Callers that already hold an index connection can pass it as conn;
+    callers logging many files should use a LogWriter.
+    """
+    with LogWriter(conn) as writer:
+        writer.add(file_hash_value, filename, source, email_from)
+
+
+def rotate_if_due(conn):
+    """Rotate the log once it is due (see logfile.rotation_due).
+
+    Archives past the retention period are then pruned, except any the
+    index or the Parquet store has not read yet. Pruned lines are gone
+    for good, so a store not built yet is built first to keep them.
+    Returns the new archive path, or None.
+    """
+    if not rotation_due():
+        return None
+    archive = rotate_log(only_if_due=True)
+    if archive:
+        # Imported here: pyarrow is only needed once a segment is archived.
+        from .logstore import compact_log, compacted_position
+        before = _log_position(conn)[0]
+        store = compacted_position()
+        if store is None and config.LOG_RETENTION_DAYS:
+            compact_log()
+            store = compacted_position()
+        if store is not None:
+            before = min(before, store[0])
+        prune_archives(before)
+    return archive
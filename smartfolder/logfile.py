@@ -0,0 +1,248 @@
+"""download_log.txt as a series of segments: rotation and retention.
+
+The live log is the newest segment. Rotating renames it into
+BASE_DIR/log_archive as download_log.<n>.txt, starts a fresh live log,
+and then gzips the archived segment. Readers that fold the log into the
+index or the Parquet store remember a (segment, offset) position and
+catch up across archived segments, so rotation never loses or repeats
+what they have counted, and they only ever read the live segment's tail.
+
+Appends and reads hold a shared lock on download_log.lock and rotation
+holds it exclusively, so a segment is never renamed under a writer.
+Writers additionally lock the live log itself while appending, so
+batches from concurrent sessions and processes never interleave.
+"""
+import contextlib
+import datetime
+import gzip
+import os
+import re
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends and rotation are not serialized
+    fcntl = None
+
+from . import config
+
+_ARCHIVE_NAME = re.compile(r"^download_log\.(\d+)\.txt(\.gz)?$")
+
+
+def ensure_log():
+    os.makedirs(config.BASE_DIR, exist_ok=True)
+    if not os.path.exists(config.LOG_FILE):
+        with open(config.LOG_FILE, "w", encoding="utf-8"):
+            pass
+
+
+def archive_dir():
+    return os.path.join(config.BASE_DIR, "log_archive")
+
+
+def _open_created(path, flags):
+    """os.open with O_CREAT, creating BASE_DIR on first use."""
+    try:
+        return os.open(path, flags | os.O_CREAT, 0o644)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.open(path, flags | os.O_CREAT, 0o644)
+
+
+@contextlib.contextmanager
+def log_lock(exclusive=False):
+    """Hold the log lock: shared to append or read, exclusive to rotate."""
+    fd = _open_created(config.LOG_FILE + ".lock", os.O_RDWR)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def append_log(data):
+    """Append bytes (whole lines) to the live log in a single write.
+
+    The write is serialized with other writers by an exclusive lock on
+    the log file, and fsynced when LOG_FSYNC is set.
+    """
+    with log_lock():
+        fd = _open_created(config.LOG_FILE, os.O_WRONLY | os.O_APPEND)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if config.LOG_FSYNC:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def archived_segments():
+    """Map segment number -> archive path (plain preferred over .gz)."""
+    segments = {}
+    try:
+        names = os.listdir(archive_dir())
+    except FileNotFoundError:
+        return segments
+    for name in names:
+        match = _ARCHIVE_NAME.match(name)
+        if match:
+            seg = int(match.group(1))
+            if seg not in segments or not match.group(2):
+                segments[seg] = os.path.join(archive_dir(), name)
+    return segments
+
+
+def _counter_file():
+    return os.path.join(archive_dir(), "next_segment")
+
+
+def live_segment(archives=None):
+    """Segment number of the live log."""
+    archives = archived_segments() if archives is None else archives
+    try:
+        with open(_counter_file(), encoding="utf-8") as f:
+            counter = int(f.read().strip() or 1)
+    except FileNotFoundError:
+        counter = 1
+    return max([counter, 1] + [seg + 1 for seg in archives])
+
+
+def first_segment():
+    archives = archived_segments()
+    return min(archives) if archives else live_segment(archives)
+
+
+def _open_segment(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def read_log(segment, offset, block_size=1024 * 1024):
+    """Return an iterator of (segment, start, end, data) log blocks.
+
+    Each block holds complete lines only. Reading starts at offset in
+    segment and continues through every later archived segment and the
+    live log; archived segments removed by retention are skipped. Each
+    segment after the first starts with an empty block at offset 0, so a
+    caller that saves each block's end leaves a finished segment behind
+    even while the next holds no lines, rather than reopening (for a
+    gzip archive, decompressing) it on every read. Raises
+    ValueError when the position is past the end of the live log (it was
+    truncated or replaced), and the caller should start over from
+    (first_segment(), 0). Call with the log lock held.
+    """
+    archives = archived_segments()
+    live = live_segment(archives)
+    if segment > live or (
+        segment == live and os.path.getsize(config.LOG_FILE) < offset
+    ):
+        raise ValueError("log position is past the end of the log")
+    paths = [(seg, archives[seg]) for seg in sorted(archives) if seg >= segment]
+    return _read_blocks(
+        paths + [(live, config.LOG_FILE)], segment, offset, block_size
+    )
+
+
+def _read_blocks(paths, segment, offset, block_size):
+    for seg, path in paths:
+        start = offset if seg == segment else 0
+        if seg != segment:
+            yield seg, 0, 0, b""
+        with _open_segment(path) as f:
+            f.seek(start)
+            pending = b""
+            while True:
+                data = f.read(block_size)
+                if not data:
+                    break  # a trailing partial line is picked up next time
+                pending += data
+                cut = pending.rfind(b"\n") + 1
+                if cut:
+                    yield seg, start, start + cut, pending[:cut]
+                    start += cut
+                    pending = pending[cut:]
+
+
+def _segment_started(path):
+    """Timestamp of the first entry in a log file, or None."""
+    with open(path, "rb") as f:
+        head = f.readline().split(b"\t", 1)[0].decode("utf-8", "replace")
+    try:
+        return datetime.datetime.strptime(head, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def rotation_due():
+    """True when the live log is over LOG_ROTATE_BYTES or LOG_ROTATE_DAYS."""
+    try:
+        size = os.path.getsize(config.LOG_FILE)
+        if not size:
+            return False
+        if config.LOG_ROTATE_BYTES and size >= config.LOG_ROTATE_BYTES:
+            return True
+        if config.LOG_ROTATE_DAYS:
+            started = _segment_started(config.LOG_FILE)
+            age = datetime.timedelta(days=config.LOG_ROTATE_DAYS)
+            return (started is not None
+                    and datetime.datetime.now() - started >= age)
+    except FileNotFoundError:
+        pass  # being rotated right now
+    return False
+
+
+def rotate_log(only_if_due=False):
+    """Archive the live log as a gzip segment and start a new one.
+
+    With only_if_due, rotation_due() is checked again under the lock, so
+    writers racing to rotate the same segment rotate it once. Returns the
+    archive path, or None if nothing was rotated.
+    """
+    with log_lock(exclusive=True):
+        if only_if_due and not rotation_due():
+            return None
+        if not os.path.exists(config.LOG_FILE) or not os.path.getsize(
+                config.LOG_FILE):
+            return None
+        os.makedirs(archive_dir(), exist_ok=True)
+        seg = live_segment()
+        plain = os.path.join(archive_dir(), f"download_log.{seg:06d}.txt")
+        os.replace(config.LOG_FILE, plain)
+        ensure_log()
+        with open(_counter_file() + ".tmp", "w", encoding="utf-8") as f:
+            f.write(str(seg + 1))
+        os.replace(_counter_file() + ".tmp", _counter_file())
+    # Readers use the plain file until the compressed copy is complete.
+    with open(plain, "rb") as src, gzip.open(plain + ".gz.tmp", "wb") as dst:
+        shutil.copyfileobj(src, dst, config.HASH_CHUNK_SIZE)
+    os.replace(plain + ".gz.tmp", plain + ".gz")
+    with log_lock(exclusive=True):
+        os.remove(plain)
+    return plain + ".gz"
+
+
+def prune_archives(before=None):
+    """Delete archived segments older than LOG_RETENTION_DAYS (0: keep).
+
+    Only segments numbered below before (when given) are eligible, so a
+    reader that has not caught up yet keeps its input. The index and the
+    Parquet store keep their counts for pruned segments; only the raw
+    lines are dropped. Returns the removed paths.
+    """
+    if not config.LOG_RETENTION_DAYS:
+        return []
+    cutoff = time.time() - config.LOG_RETENTION_DAYS * 86400
+    removed = []
+    with log_lock(exclusive=True):
+        for seg, path in archived_segments().items():
+            if before is not None and seg >= before:
+                continue
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed.append(path)
+    return removed
@@ -0,0 +1,454 @@
+"""Columnar copy of the download log for the Audit Log tab.
+
+download_log.txt stays the write-ahead log: every writer appends to it
+as before. compact_log() folds complete lines it has not seen yet into
+Parquet files under BASE_DIR/log_store, partitioned by month, with the
+timestamp already parsed, the file type and source dictionary-encoded,
+and the normalized sender address in its own column. load_log() then
+reads only the columns and months it is asked for.
+
+Part files are named after the log segment and offset of the first line
+they hold, and the position reached is saved after each block, so a
+compaction that is interrupted and rerun, even once more lines have been
+appended, rewrites the same files instead of duplicating rows.
+Compaction catches up across segments rotated into the archive since it
+last ran (see logfile).
+
+A month's small parts are merged into a new part under a fresh name, and
+a _merge journal in the month folder lists the parts it replaces until
+they are gone; compaction first finishes (or, if the merged part was
+never completed, abandons) any merge a crash left. Compaction holds an
+exclusive lock on log_store.lock throughout, so the dashboard and the
+sync daemon never compact, merge or rebuild the store at the same time.
+"""
+import contextlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: compaction is only serialized in-process
+    fcntl = None
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from . import config
+from .index import sender_of
+from .logfile import ensure_log, first_segment, log_lock, read_log
+from .senders import sender_months
+
+COLUMNS = ["Timestamp", "Hash", "Filename", "Source"]
+# Bumped when the stored columns change; older stores are rebuilt.
+STORE_VERSION = "3"
+# Once a month has this many part files they are merged into one.
+MAX_PARTS_PER_MONTH = 16
+# Log bytes parsed per step when catching up on a large backlog.
+COMPACT_BLOCK_SIZE = 64 * 1024 * 1024
+
+_lock = threading.Lock()
+_MERGE_GENERATION = re.compile(r"^(.*?)(?:\.m(\d+))?\.parquet$")
+
+
+def store_dir():
+    return os.path.join(config.BASE_DIR, "log_store")
+
+
+def _position_file():
+    return os.path.join(store_dir(), "_position")
+
+
+def _version_file():
+    return os.path.join(store_dir(), "_version")
+
+
+def compacted_position():
+    """(segment, offset) compaction has reached, or None without a store."""
+    try:
+        with open(_position_file(), encoding="utf-8") as f:
+            segment, offset = f.read().split()
+    except (FileNotFoundError, ValueError):
+        return None
+    return int(segment), int(offset)
+
+
+def _write_position(segment, offset):
+    tmp_path = _position_file() + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f"{segment} {offset}")
+    os.replace(tmp_path, _position_file())
+
+
+def _senders(source):
+    """Dictionary-encoded Sender for a dictionary-encoded Source column.
+
+    sender_of() runs once per distinct source, not per row.
+    """
+    chunks = []
+    for chunk in source.chunks if isinstance(
+            source, pa.ChunkedArray) else [source]:
+        senders = pa.array(
+            [sender_of(value) for value in chunk.dictionary.to_pylist()],
+            pa.string()
+        )
+        chunks.append(pc.dictionary_encode(senders.take(chunk.indices)))
+    return pa.chunked_array(chunks, pa.dictionary(pa.int32(), pa.string()))
+
+
+def parse_log_lines(data):
+    """Parse raw TSV log bytes into an Arrow table.
+
+    Lines without exactly four fields are skipped, as everywhere else the
+    log is read. Adds a dictionary-encoded Type (upper-case extension, or
+    "UNKNOWN"), Sender (see index.sender_of) and the "YYYY-MM" month used
+    for partitioning.
+    """
+    table = pa_csv.read_csv(
+        io.BytesIO(data),
+        read_options=pa_csv.ReadOptions(column_names=COLUMNS),
+        parse_options=pa_csv.ParseOptions(
+            delimiter="\t", quote_char=False,
+            invalid_row_handler=lambda row: "skip"
+        ),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in COLUMNS}
+        ),
+    )
+    timestamps = pc.strptime(
+        pc.utf8_trim_whitespace(table["Timestamp"]),
+        format="%Y-%m-%d %H:%M:%S", unit="s", error_is_null=True
+    )
+    ext = pc.struct_field(
+        pc.extract_regex(table["Filename"], r"\.(?P<ext>[^.]+)$"), [0]
+    )
+    file_type = pc.fill_null(pc.utf8_upper(ext), "UNKNOWN")
+    source = pc.dictionary_encode(pc.utf8_trim_whitespace(table["Source"]))
+    return pa.table({
+        "Timestamp": timestamps,
+        "Hash": table["Hash"],
+        "Filename": table["Filename"],
+        "Source": source,
+        "Type": pc.dictionary_encode(file_type),
+        "Sender": _senders(source),
+        "month": pc.fill_null(pc.strftime(timestamps, "%Y-%m"), "unknown"),
+    })
+
+
+def _write_table(table, folder, name):
+    # Dot-prefixed while being written, so readers never see half a file.
+    tmp_path = os.path.join(folder, "." + name)
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, os.path.join(folder, name))
+    return os.path.join(folder, name)
+
+
+def _write_parts(table, segment, start):
+    # A rerun reads at least the same lines from the same start, so it
+    # replaces every part an interrupted run left.
+    for month in pc.unique(table["month"]).to_pylist():
+        rows = table.filter(pc.equal(table["month"], month)).drop(["month"])
+        folder = os.path.join(store_dir(), f"month={month}")
+        os.makedirs(folder, exist_ok=True)
+        _write_table(rows, folder, f"part-{segment:06d}-{start:015d}.parquet")
+
+
+def _month_folders():
+    for name in os.listdir(store_dir()):
+        folder = os.path.join(store_dir(), name)
+        if name.startswith("month=") and os.path.isdir(folder):
+            yield folder
+
+
+def _merged_name(first):
+    """Name for a merge of parts starting with first; sorts in its place.
+
+    "part-S-O.parquet" becomes "part-S-O.m1.parquet", and merging that
+    again "part-S-O.m2.parquet", so the name always differs from every
+    part it replaces.
+    """
+    stem, generation = _MERGE_GENERATION.match(first).groups()
+    return f"{stem}.m{int(generation or 0) + 1}.parquet"
+
+
+def _finish_merge(folder, journal):
+    """Remove the parts a completed merge replaced, then its journal."""
+    with open(journal, encoding="utf-8") as f:
+        merged, *parts = f.read().split()
+    for part in parts:
+        if part != merged:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(folder, part))
+    os.remove(journal)
+
+
+def _recover_merges():
+    """Finish or abandon merges an interrupted compaction left behind."""
+    for folder in _month_folders():
+        journal = os.path.join(folder, "_merge")
+        if not os.path.exists(journal):
+            continue
+        with open(journal, encoding="utf-8") as f:
+            merged = f.read().split()[0]
+        if os.path.exists(os.path.join(folder, merged)):
+            _finish_merge(folder, journal)
+        else:
+            # Every replaced part is still there; drop the half-written
+            # merge (readers skip dot-files) and the journal.
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(folder, "." + merged))
+            os.remove(journal)
+
+
+def _merge_small_parts():
+    for folder in _month_folders():
+        parts = sorted(
+            p for p in os.listdir(folder)
+            if p.startswith("part-") and p.endswith(".parquet")
+        )
+        if len(parts) < MAX_PARTS_PER_MONTH:
+            continue
+        merged = _merged_name(parts[0])
+        journal = os.path.join(folder, "_merge")
+        with open(journal + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join([merged] + parts))
+        os.replace(journal + ".tmp", journal)
+        _write_table(pa.concat_tables(
+            [pq.read_table(os.path.join(folder, p)) for p in parts],
+            promote_options="permissive"
+        ), folder, merged)
+        _finish_merge(folder, journal)
+
+
+@contextlib.contextmanager
+def _store_lock():
+    """Hold an exclusive lock on the store, shared by every process.
+
+    The lock file sits beside log_store, which a rebuild deletes.
+    """
+    fd = os.open(store_dir() + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def compact_log():
+    """Fold log lines appended since the last compaction into the store.
+
+    Returns the number of log bytes consumed. A log that shrank (replaced
+    or truncated) makes the store rebuild from the oldest segment kept.
+    """
+    with _lock:
+        os.makedirs(store_dir(), exist_ok=True)
+        ensure_log()
+        with _store_lock():
+            _recover_merges()
+            return _compact()
+
+
+def _compact():
+    with log_lock():
+        try:
+            with open(_version_file(), encoding="utf-8") as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            version = None
+        segment, offset = compacted_position() or (first_segment(), 0)
+        try:
+            blocks = read_log(segment, offset, COMPACT_BLOCK_SIZE)
+        except ValueError:
+            version = None
+        if version != STORE_VERSION:
+            shutil.rmtree(store_dir())
+            os.makedirs(store_dir())
+            with open(_version_file(), "w", encoding="utf-8") as f:
+                f.write(STORE_VERSION)
+            segment, offset = first_segment(), 0
+            blocks = read_log(segment, offset, COMPACT_BLOCK_SIZE)
+        consumed = 0
+        for segment, start, offset, data in blocks:
+            table = parse_log_lines(data) if data else None
+            if table is not None and table.num_rows:
+                _write_parts(table, segment, start)
+            _write_position(segment, offset)
+            consumed += offset - start
+    if consumed:
+        _merge_small_parts()
+    return consumed
+
+
+def _empty_table(columns):
+    return pa.schema([
+        ("Timestamp", pa.timestamp("s")), ("Hash", pa.string()),
+        ("Filename", pa.string()),
+        ("Source", pa.dictionary(pa.int32(), pa.string())),
+        ("Type", pa.dictionary(pa.int32(), pa.string())),
+        ("Sender", pa.dictionary(pa.int32(), pa.string())),
+    ]).empty_table().select(columns)
+
+
+def open_dataset():
+    """Compact new lines, then return the store as an Arrow dataset.
+
+    Returns None while the store holds no rows.
+    """
+    compact_log()
+    if not any(
+        name.startswith("month=") for name in os.listdir(store_dir())
+    ):
+        return None
+    return ds.dataset(
+        store_dir(), format="parquet",
+        partitioning=ds.partitioning(
+            pa.schema([("month", pa.string())]), flavor="hive"
+        ),
+    )
+
+
+def frame_dataset(df):
+    """Wrap a log DataFrame (e.g. demo data) as an in-memory dataset."""
+    table = pa.Table.from_pandas(
+        df.sort_values("Timestamp")[COLUMNS + ["Type"]],
+        preserve_index=False
+    )
+    source = pc.dictionary_encode(table["Source"])
+    table = table.set_column(
+        table.schema.get_field_index("Source"), "Source", source
+    ).append_column("Sender", _senders(source))
+    return ds.dataset(table.append_column(
+        "month", pc.strftime(table["Timestamp"], "%Y-%m")
+    ))
+
+
+def log_filter(start=None, end=None, months=None, types=None, sources=None,
+               senders=None):
+    """Build a dataset filter from the Audit Log selections.
+
+    start/end bound Timestamp as [start, end); months are month starts to
+    keep; types and sources are exact Type / Source values; senders are
+    normalized addresses. Time bounds prune the month partitions they
+    rule out, and senders prune to the months the sender index lists.
+    """
+    clauses = []
+    if start is not None:
+        clauses.append(ds.field("month") >= start.strftime("%Y-%m"))
+        clauses.append(
+            ds.field("Timestamp") >= pa.scalar(start, pa.timestamp("s"))
+        )
+    if end is not None:
+        clauses.append(ds.field("month") <= end.strftime("%Y-%m"))
+        clauses.append(
+            ds.field("Timestamp") < pa.scalar(end, pa.timestamp("s"))
+        )
+    if months is not None:
+        clauses.append(
+            ds.field("month").isin([m.strftime("%Y-%m") for m in months])
+        )
+    if types is not None:
+        clauses.append(ds.field("Type").isin(list(types)))
+    if sources is not None:
+        clauses.append(ds.field("Source").isin(list(sources)))
+    if senders is not None:
+        clauses.append(ds.field("month").isin(sender_months(senders)))
+        clauses.append(ds.field("Sender").isin(list(senders)))
+    row_filter = None
+    for clause in clauses:
+        row_filter = clause if row_filter is None else row_filter & clause
+    return row_filter
+
+
+def count_rows(dataset, row_filter=None):
+    return dataset.count_rows(filter=row_filter)
+
+
+def read_rows(dataset, row_filter=None, columns=None, offset=0, limit=None):
+    """Read matching rows (in log order) as a DataFrame.
+
+    With limit, only rows offset..offset+limit are materialized.
+    """
+    columns = columns or COLUMNS + ["Type"]
+    if limit is None:
+        table = dataset.to_table(columns=columns, filter=row_filter)
+    else:
+        scanner = dataset.scanner(columns=columns, filter=row_filter)
+        stop = min(offset + limit, scanner.count_rows())
+        table = (scanner.take(pa.array(range(offset, stop), pa.int64()))
+                 if stop > offset else _empty_table(columns))
+    return table.to_pandas()
+
+
+def write_csv(dataset, path, row_filter=None, columns=None):
+    """Stream matching rows to a CSV file one record batch at a time.
+
+    The rows go to a uniquely named file beside path that replaces it once
+    complete, so concurrent exports never write into each other's files.
+    """
+    columns = columns or COLUMNS + ["Type"]
+    schema = pa.schema([
+        pa.field(name, pa.string()) if name != "Timestamp"
+        else pa.field(name, pa.timestamp("s")) for name in columns
+    ])
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".export-",
+        suffix=".csv"
+    )
+    os.close(fd)
+    try:
+        with pa_csv.CSVWriter(tmp_path, schema) as writer:
+            for batch in dataset.to_batches(
+                    columns=columns, filter=row_filter):
+                writer.write_table(
+                    pa.Table.from_batches([batch]).cast(schema)
+                )
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def load_log(columns=None, start=None, end=None):
+    """Return the log as a DataFrame, compacting any new lines first.
+
+    columns limits what is read (default: all, plus Type); start and end
+    bound Timestamp as [start, end) and prune month partitions.
+    Timestamp is datetime64, Type and Source are categoricals.
+    """
+    columns = columns or COLUMNS + ["Type"]
+    dataset = open_dataset()
+    if dataset is None:
+        return _empty_table(columns).to_pandas()
+    return read_rows(dataset, log_filter(start, end), columns)
+
+
+def split_source(source):
+    """Split "Email (sender)" values into categorical Source and Email.
+
+    The pattern is matched once per distinct value rather than per row;
+    values without a parenthesised sender get an empty Email.
+    """
+    source = source.astype("category")
+    categories = source.cat.categories.to_series(index=range(
+        len(source.cat.categories)
+    )).astype(str)
+    parts = categories.str.extract(
+        r"^(?P<Source>[^(]*)\((?P<Email>[^)]*)\)"
+    )
+    parts["Source"] = parts["Source"].str.strip().fillna(categories.str.strip())
+    parts["Email"] = parts["Email"].fillna("")
+    codes = source.cat.codes.to_numpy()
+    result = {}
+    for col in ("Source", "Email"):
+        part_codes, uniques = pd.factorize(parts[col])
+        result[col] = pd.Categorical.from_codes(part_codes[codes], uniques)
+    return pd.DataFrame(result, index=source.index)
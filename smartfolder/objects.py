@@ -0,0 +1,172 @@
+"""Content-addressed storage: each distinct file's bytes kept once.
+
+With object_store on, saved content lives in BASE_DIR/.objects under its
+hash and the files in category folders are hard links to it, so content
+saved again under another name or in another folder costs a link rather
+than a copy. Where a hard link cannot be made (another device, a
+filesystem without them, an inode's link limit) the object is cloned
+instead: a reflink on filesystems that share blocks, else a plain copy.
+prune_objects() deletes objects no category file links to any more.
+"""
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from . import config
+from .destinations import NO_LINK_ERRNOS, rename_new
+
+OBJECTS_DIR = ".objects"
+# ioctl that makes a file share another's blocks (Btrfs, XFS, bcachefs).
+_FICLONE = getattr(fcntl, "FICLONE", None) or (
+    0x40049409 if fcntl is not None and sys.platform.startswith("linux")
+    else None
+)
+# Objects this recently added or linked are never pruned, so ones being
+# saved right now (or cloned, and so never linked) are left alone.
+PRUNE_GRACE_SECONDS = 3600
+
+
+def objects_dir():
+    return os.path.join(config.BASE_DIR, OBJECTS_DIR)
+
+
+def object_path(digest):
+    """Where content with this digest is stored.
+
+    Objects are fanned out over subdirectories by the first two hex
+    digits, so no one directory grows too large to list.
+    """
+    hex_digest = digest.rpartition(":")[2]
+    return os.path.join(
+        objects_dir(), hex_digest[:2], digest.replace(":", "-")
+    )
+
+
+def has_object(digest):
+    return os.path.exists(object_path(digest))
+
+
+def _clone(src, dst):
+    """Copy src to dst, sharing blocks (a reflink) where the filesystem can."""
+    if _FICLONE is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in NO_LINK_ERRNOS:
+            raise
+        _clone(src, dst)
+
+
+def _temp_name(folder):
+    return os.path.join(folder, f".incoming-{secrets.token_hex(8)}")
+
+
+def _install(src, dst):
+    """Link (or clone) src to dst atomically, replacing any file there."""
+    tmp_path = _temp_name(os.path.dirname(dst))
+    try:
+        _link(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+
+def add_object(digest, path):
+    """Store the file at path under digest unless that content is stored.
+
+    path is left in place; returns the object's path.
+    """
+    obj = object_path(digest)
+    if not os.path.exists(obj):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        _install(path, obj)
+    return obj
+
+
+def write_object(digest, data):
+    """Store bytes under digest unless that content is stored already."""
+    obj = object_path(digest)
+    if os.path.exists(obj):
+        return obj
+    os.makedirs(os.path.dirname(obj), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(obj), prefix=".incoming-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, obj)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return obj
+
+
+def link_object(digest, dest):
+    """Create dest as a link to stored content.
+
+    Raises FileExistsError rather than replacing a file at dest.
+    """
+    obj = object_path(digest)
+    try:
+        os.link(obj, dest)
+        return
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in NO_LINK_ERRNOS:
+            raise
+    tmp_path = _temp_name(os.path.dirname(dest))
+    try:
+        _clone(obj, tmp_path)
+        rename_new(tmp_path, dest)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+
+def prune_objects():
+    """Delete objects no file links to any more; returns how many.
+
+    An object's only remaining link is its own once every category file
+    made from it is deleted. Objects cloned rather than linked look the
+    same, and deleting those is harmless: the clones are whole files.
+    """
+    removed = 0
+    cutoff = time.time() - PRUNE_GRACE_SECONDS
+    try:
+        fans = list(os.scandir(objects_dir()))
+    except FileNotFoundError:
+        return 0
+    for fan in fans:
+        if not fan.is_dir(follow_symlinks=False):
+            continue
+        with os.scandir(fan.path) as entries:
+            for entry in entries:
+                st = entry.stat(follow_symlinks=False)
+                # Names starting with "." are temporary files left by
+                # an interrupted save.
+                if st.st_ctime < cutoff and (
+                        st.st_nlink == 1 or entry.name.startswith(".")):
+                    os.remove(entry.path)
+                    removed += 1
+    return removed
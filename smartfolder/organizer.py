@@ -0,0 +1,526 @@
+"""Filing attachments and local files into category folders.
+
+Where a file goes is decided by the compiled Settings rules (see rules):
+by default its category folder, under its own name. With object_store on
+its content is kept once under BASE_DIR/.objects and the file placed
+there is a link to it (see objects).
+"""
+import fnmatch
+import logging
+import os
+import re
+import stat
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing
+
+from . import config
+from .destinations import Destination, rename_new
+from .hashing import file_hash, hex_digest, new_hasher
+from .index import (
+    LogWriter, cached_file_hash, claim_hash, claim_hashes,
+    has_been_downloaded, is_known_file, known_by_md5, legacy_md5,
+    log_download, normalize_sender, open_index, release_hash, release_hashes
+)
+from .objects import add_object, has_object, link_object, write_object
+from .rules import current_rules
+from .sniff import detect_extension, sniff_file, typed_name
+
+log = logging.getLogger(__name__)
+
+# Suffixes of files browsers and download tools are still writing.
+_INCOMPLETE_SUFFIXES = (".crdownload", ".part", ".partial", ".download", ".tmp")
+
+
+def clean(text):
+    return text.replace("/", "_").replace("\\", "_")
+
+
+def get_category_folder(extension):
+    return config.FILE_CATEGORIES.get(extension.lower(), "Others")
+
+
+def _sniffable(name):
+    """Whether a file without a categorized extension is worth sniffing."""
+    return (
+        config.SNIFF_CONTENT and not name.startswith(".")
+        and not name.lower().endswith(_INCOMPLETE_SUFFIXES)
+    )
+
+
+def _typed(conn, digest, filename, source):
+    """(extension, filename) to file content under, sniffing if enabled."""
+    if not config.SNIFF_CONTENT:
+        return os.path.splitext(filename)[1].lower(), filename
+    return typed_name(filename, detect_extension(conn, digest, source))
+
+
+def save_attachments(attachments, rules=None):
+    """Write attachments as they stream in, hashing while writing.
+
+    Each attachment's content (bytes, or an iterable of byte chunks) goes
+    to a temporary file and is renamed into place where rules (default:
+    the saved Settings) put it, unless they skip it or its hash is logged
+    or claimed by another session. A different file already there keeps
+    its name and the new one gets a numbered suffix (see destinations).
+    Content that could not be saved has its failed() method called, if it
+    has one (see imap.PartStream).
+    """
+    saved_files = []
+    rules = rules or current_rules()
+    folders = {}
+    os.makedirs(config.BASE_DIR, exist_ok=True)
+    with closing(open_index()) as conn, LogWriter(conn) as writer:
+        for filename, content, email_from in attachments:
+            saved = _save_attachment(
+                conn, writer, rules, folders, filename, content, email_from
+            )
+            if saved:
+                saved_files.append(saved)
+    return saved_files
+
+
+def _folder(folders, relative):
+    """The Destination for BASE_DIR/relative, created on first use and
+    cached in folders, so it is listed once per batch."""
+    destination = folders.get(relative)
+    if destination is None:
+        path = os.path.join(config.BASE_DIR, relative)
+        os.makedirs(path, exist_ok=True)
+        destination = folders.setdefault(relative, Destination(path))
+    return destination
+
+
+def _save_attachment(conn, writer, rules, folders, filename, content,
+                     email_from):
+    chunks = (
+        [content] if isinstance(content, (bytes, bytearray)) else content
+    )
+    fd, tmp_path = tempfile.mkstemp(dir=config.BASE_DIR, prefix=".incoming-")
+    f_hash = None
+    try:
+        hasher = new_hasher(config.HASH_ALGORITHM)
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        digest = hex_digest(hasher, config.HASH_ALGORITHM)
+        ext, filename = _typed(conn, digest, filename, tmp_path)
+        if ext not in config.FILE_CATEGORIES:
+            return None
+        placement = rules.place(
+            filename, ext, size, normalize_sender(email_from)
+        )
+        if placement is None:
+            return None
+        if rules.only_new:
+            if known_by_md5(conn, tmp_path) or not claim_hash(conn, digest):
+                return None
+            f_hash = digest
+        filepath = _folder(folders, placement[0]).put(
+            clean(placement[1]),
+            lambda path: _place_content(digest, tmp_path, path)
+        )
+        writer.add(
+            digest, os.path.basename(filepath), source="Email",
+            email_from=email_from
+        )
+        f_hash = None  # logged; the writer releases the claim
+        return filepath
+    except Exception as e:
+        log.warning("Could not save attachment %s: %s", filename, e)
+        # Streamed from IMAP: have the message fetched again next sync.
+        report_failure = getattr(content, "failed", None)
+        if report_failure is not None:
+            report_failure()
+        return None
+    finally:
+        if f_hash:
+            release_hash(conn, f_hash)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _place_content(digest, src, dest):
+    """Rename the file at src to dest or, with OBJECT_STORE on, store it
+    once under its digest and make dest a link to it.
+
+    Raises FileExistsError, leaving src in place, if dest exists.
+    """
+    if not config.OBJECT_STORE:
+        rename_new(src, dest)
+        return
+    add_object(digest, src)
+    link_object(digest, dest)
+    os.remove(src)
+
+
+def _upload_content(fileobj):
+    """The upload's bytes without copying when it is an in-memory buffer."""
+    if hasattr(fileobj, "getbuffer"):
+        return fileobj.getbuffer()
+    fileobj.seek(0)
+    return fileobj.read()
+
+
+def _write_upload(fileobj, digest, destination, name, path):
+    """Save an upload at its reserved path, or the next free name if
+    another process has taken it since; returns the path used."""
+    if config.OBJECT_STORE:
+        # Content already stored costs a link, not a write.
+        if not has_object(digest):
+            write_object(digest, _upload_content(fileobj))
+        return destination.put(
+            name, lambda dest: link_object(digest, dest), path
+        )
+    fd, tmp_path = tempfile.mkstemp(
+        dir=destination.path, prefix=".incoming-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_upload_content(fileobj))
+        return destination.put(
+            name, lambda dest: rename_new(tmp_path, dest), path
+        )
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def ingest_uploads(uploads, workers=None, source="Upload", rules=None):
+    """Hash, dedup, store and log a batch of uploaded files together.
+
+    uploads is a sequence of (filename, file object) pairs, e.g. from
+    Streamlit's file uploader. Files are hashed and written on a pool of
+    ORGANIZE_WORKERS threads, duplicates (of the log, of each other, or of
+    uploads other sessions are saving) are ruled out with one claim
+    transaction, and the new files are logged in one append. rules
+    (default: the saved Settings) decide where each goes; names already
+    taken, on disk or earlier in the batch, get a numbered suffix in
+    upload order. Claims on uploads that end up not logged are given
+    back, even when the batch fails part way. Returns one
+    dict per upload, in order, with its "name", "status" ("saved",
+    "duplicate", "skipped" or "error"), "category", "path" and "error".
+    """
+    uploads = list(uploads)
+    results = [
+        {"name": name, "status": None, "category": None, "path": None,
+         "error": None} for name, _ in uploads
+    ]
+    if not uploads:
+        return results
+    workers = workers or config.ORGANIZE_WORKERS
+    rules = rules or current_rules()
+    folders = category_folders(rules.prefix)
+    pool = ThreadPoolExecutor(workers, thread_name_prefix="ingest")
+    with pool, closing(open_index()) as conn:
+        digests = list(pool.map(
+            lambda upload: file_hash(_upload_content(upload[1])), uploads
+        ))
+        claimed = None
+        if rules.only_new:
+            wanted = digests
+            if legacy_md5(conn):
+                # Content logged before hash_algorithm was switched.
+                md5s = pool.map(
+                    lambda upload: file_hash(
+                        _upload_content(upload[1]), "md5"
+                    ), uploads
+                )
+                wanted = [
+                    digest for digest, md5 in zip(digests, md5s)
+                    if not has_been_downloaded(md5, conn)
+                ]
+            claimed = claim_hashes(conn, wanted)
+        # Claims not handed to the writer yet, given back however the
+        # batch ends (see index.claim_hash).
+        held = set(claimed or ())
+        jobs = {}
+        try:
+            for i, ((name, fileobj), digest) in enumerate(
+                    zip(uploads, digests)):
+                result = results[i]
+                if claimed is not None:
+                    if digest not in claimed:
+                        result["status"] = "duplicate"
+                        continue
+                    claimed.discard(digest)  # later copies are duplicates
+                ext, name = _typed(conn, digest, name, fileobj)
+                placement = rules.place(
+                    name, ext, len(_upload_content(fileobj))
+                )
+                if placement is None:
+                    result["status"] = "skipped"
+                    continue
+                result["category"] = get_category_folder(ext)
+                destination = _folder(folders, placement[0])
+                name = clean(placement[1])
+                jobs[i] = pool.submit(
+                    _write_upload, fileobj, digest, destination, name,
+                    destination.reserve(name)
+                )
+
+            with LogWriter(conn, batch_size=len(jobs) or None) as writer:
+                for i, job in jobs.items():
+                    try:
+                        results[i]["path"] = job.result()
+                    except Exception as e:
+                        results[i]["status"] = "error"
+                        results[i]["error"] = str(e)
+                        continue
+                    results[i]["status"] = "saved"
+                    results[i]["name"] = os.path.basename(results[i]["path"])
+                    writer.add(digests[i], results[i]["name"], source=source)
+                    held.discard(digests[i])
+        finally:
+            for job in jobs.values():
+                job.cancel()
+            release_hashes(conn, held)
+    return results
+
+
+def category_folders(prefix=""):
+    """Create every category folder under BASE_DIR once.
+
+    Returns {folder relative to BASE_DIR: Destination}, the cache
+    _folder() adds rule destinations to; prefix is the Settings folder
+    prefix.
+    """
+    folders = {}
+    for category in {*config.FILE_CATEGORIES.values(), "Others"}:
+        _folder(folders, prefix + category)
+    return folders
+
+
+def organize_file(conn, full_path, stat_result=None, folders=None,
+                  writer=None, rules=None):
+    """File one local file where rules (default: the saved Settings) say.
+
+    Returns the destination path, or None if the file was left alone: not
+    a categorized type (by extension or, see sniff, by content), skipped
+    by a rule, or already organized. A different file already at the
+    destination keeps its name and this one gets a numbered suffix.
+    Content already in the log is recognised from the stat cache without
+    reading the file when it has not changed, and content another worker
+    or session is filing right now is claimed (see index.claim_hash) and
+    left alone. Batch callers pass the stat from the directory scan, the
+    folders from category_folders(), a LogWriter to log through, and the
+    rules compiled for the run.
+    """
+    filename = os.path.basename(full_path)
+    ext = os.path.splitext(filename)[1].lower()
+    categorized = ext in config.FILE_CATEGORIES
+    if not categorized and not _sniffable(filename):
+        return None
+    stat_result = stat_result or os.stat(full_path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+    # Ruled out before hashing, so other files cost a few small reads,
+    # once.
+    if not categorized and sniff_file(conn, full_path, stat_result) is None:
+        return None
+    rules = rules or current_rules()
+    if rules.only_new:
+        known, f_hash = is_known_file(conn, full_path, stat_result)
+        if known:
+            return None
+    else:
+        f_hash = cached_file_hash(conn, full_path, stat_result)
+    ext, filename = _typed(conn, f_hash, filename, full_path)
+    if ext not in config.FILE_CATEGORIES:
+        return None
+    placement = rules.place(filename, ext, stat_result.st_size)
+    if placement is None:
+        return None
+    if rules.only_new and not claim_hash(conn, f_hash):
+        return None
+    try:
+        dest_path = _move_into(
+            full_path, f_hash, placement, {} if folders is None else folders
+        )
+    except BaseException:
+        if rules.only_new:
+            release_hash(conn, f_hash)
+        raise
+    name = os.path.basename(dest_path)
+    if writer is None:
+        log_download(f_hash, name, source="Downloads", conn=conn)
+    else:
+        writer.add(f_hash, name, source="Downloads")
+    with conn:
+        conn.execute("DELETE FROM stat_cache WHERE path = ?", (full_path,))
+    return dest_path
+
+
+def _move_into(full_path, digest, placement, folders):
+    """Move a file to its (folder, name) placement, under the next free
+    name if that one is taken; returns the new path."""
+    return _folder(folders, placement[0]).put(
+        clean(placement[1]),
+        lambda dest: _place_content(digest, full_path, dest)
+    )
+
+
+def compile_excludes(patterns):
+    """Build a predicate for paths (relative, "/"-separated) to skip.
+
+    Patterns are globs matched against the entry name or its relative
+    path; a "re:" prefix makes the rest a regular expression searched in
+    the relative path.
+    """
+    regexes = [re.compile(p[3:]) for p in patterns if p.startswith("re:")]
+    globs = [p for p in patterns if not p.startswith("re:")]
+
+    def excluded(rel_path, name):
+        return (
+            any(fnmatch.fnmatch(name, g) or fnmatch.fnmatch(rel_path, g)
+                for g in globs)
+            or any(r.search(rel_path) for r in regexes)
+        )
+    return excluded
+
+
+def _dir_key(stat_result):
+    return stat_result.st_dev, stat_result.st_ino
+
+
+def walk_files(folder, max_depth=0, excludes=()):
+    """Yield DirEntry objects for regular files under folder to organize.
+
+    These are files with a categorized extension and, when SNIFF_CONTENT
+    is on, any other file organize_file() would sniff.
+
+    Descends at most max_depth levels below folder (negative for no
+    limit). Directories are read one at a time with os.scandir, so only
+    the queue of directories still to visit is held in memory. BASE_DIR,
+    excluded paths, and directories already visited (e.g. through a
+    symlink loop) are skipped.
+    """
+    excluded = compile_excludes(excludes)
+    skip = {_dir_key(os.stat(folder))}
+    try:
+        skip.add(_dir_key(os.stat(config.BASE_DIR)))
+    except FileNotFoundError:
+        pass
+    pending = [(folder, "", 0)]
+    while pending:
+        path, prefix, depth = pending.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    rel_path = prefix + entry.name
+                    if excluded(rel_path, entry.name):
+                        continue
+                    if entry.is_dir():
+                        if 0 <= max_depth <= depth:
+                            continue
+                        key = _dir_key(entry.stat())
+                        if key not in skip:
+                            skip.add(key)
+                            pending.append(
+                                (entry.path, rel_path + "/", depth + 1)
+                            )
+                        continue
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if (ext in config.FILE_CATEGORIES
+                            or _sniffable(entry.name)) and entry.is_file():
+                        yield entry
+        except OSError as e:
+            if path == folder:
+                raise
+            log.warning("Cannot read %s: %s", path, e)
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _organize_batch(entries, folders, rules):
+    """Organize a batch of DirEntry objects on one index connection.
+
+    The batch's log lines are appended together when it finishes.
+    """
+    moved, errors = [], []
+    with closing(open_index()) as conn, LogWriter(conn) as writer:
+        for entry in entries:
+            try:
+                dest_path = organize_file(
+                    conn, entry.path, entry.stat(), folders, writer, rules
+                )
+                if dest_path:
+                    moved.append(dest_path)
+            except (IOError, OSError) as e:
+                errors.append(f"Error processing {entry.name}: {str(e)}")
+            except Exception as e:
+                errors.append(f"Error with file {entry.name}: {str(e)}")
+    return moved, errors, len(entries)
+
+
+def move_existing_files(folder=None, workers=None, max_depth=None,
+                        excludes=None, progress=None, rules=None):
+    """Move categorized files from folder (default: Downloads) into BASE_DIR.
+
+    The folder is walked lazily (see walk_files; max_depth and excludes
+    default to ORGANIZE_MAX_DEPTH and ORGANIZE_EXCLUDES) and files are
+    hashed and moved by a pool of workers (ORGANIZE_WORKERS), in batches of
+    ORGANIZE_BATCH_SIZE that each share one index connection. Files are
+    placed by rules, compiled from the saved Settings once per run unless
+    given. After each
+    batch, progress(files_seen, files_moved) is called from the calling
+    thread. Problems with individual files are logged as warnings and
+    skipped.
+    """
+    moved_files = []
+    errors = []
+    seen = 0
+    workers = workers or config.ORGANIZE_WORKERS
+    if max_depth is None:
+        max_depth = config.ORGANIZE_MAX_DEPTH
+    if excludes is None:
+        excludes = config.ORGANIZE_EXCLUDES
+
+    def collect(job):
+        nonlocal seen
+        moved, failed, count = job.result()
+        moved_files.extend(moved)
+        errors.extend(failed)
+        seen += count
+        if progress:
+            progress(seen, len(moved_files))
+
+    try:
+        current_dir = folder or config.DOWNLOADS_DIR
+        rules = rules or current_rules()
+        folders = category_folders(rules.prefix)
+        with ThreadPoolExecutor(workers, thread_name_prefix="organize") as pool:
+            pending = set()
+            entries = walk_files(current_dir, max_depth, excludes)
+            for batch in _batches(entries, config.ORGANIZE_BATCH_SIZE):
+                # Keep the scan only a little ahead of the workers.
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for job in done:
+                        collect(job)
+                pending.add(
+                    pool.submit(_organize_batch, batch, folders, rules)
+                )
+            for job in pending:
+                collect(job)
+
+    except Exception as e:
+        log.error("Error accessing folder: %s", e)
+        return moved_files
+
+    for error in errors:
+        log.warning(error)
+
+    return moved_files
@@ -0,0 +1,202 @@
+"""Where each file goes: the Settings tab's rules compiled for dispatch.
+
+Settings (see settings) hold an ordered list of rules, each matching on
+extension, sender, size and a filename regex and naming a destination
+folder template; the first rule that matches wins and files nothing
+matches go to their category folder. compile_rules() turns the settings
+into a RuleSet once per run: rules are bucketed by extension so a file
+is only tested against rules that can apply to it, filename regexes and
+sender globs are compiled, and templates are checked up front, so placing
+a file never re-reads or re-parses the settings. Conditions are tested
+cheapest first and a rule's regex only runs once the rest have matched.
+accepts_sender() and skips() let the email sync drop attachments before
+downloading them, when only their name and approximate size are known.
+"""
+import datetime
+import fnmatch
+import os
+import re
+import string
+import threading
+
+from . import config
+from .settings import NAMING_CONVENTIONS, load_settings, settings_file
+
+# Fields available to destination and file name templates.
+NAME_FIELDS = {
+    "name", "stem", "ext", "type", "category", "sender", "date", "year",
+    "month", "day",
+}
+
+
+def _check_template(template):
+    for _, field, spec, conversion in string.Formatter().parse(template):
+        if field is not None and field not in NAME_FIELDS:
+            raise ValueError(f"unknown field {{{field}}} in {template!r}")
+        if spec or conversion:
+            raise ValueError(f"format specs are not supported: {template!r}")
+    return template
+
+
+def _sender_matcher(patterns):
+    """Compile address globs ("*@example.com") into one fullmatch."""
+    if not patterns:
+        return None
+    return re.compile(
+        "|".join(fnmatch.translate(p.strip().lower()) for p in patterns)
+    ).fullmatch
+
+
+class Rule:
+    """One compiled rule; see settings.DEFAULTS for the fields."""
+
+    def __init__(self, index, spec):
+        self.index = index
+        self.extensions = {
+            e.lower() if e.startswith(".") else "." + e.lower()
+            for e in spec.get("extensions") or ()
+        }
+        self.senders = _sender_matcher(spec.get("senders"))
+        self.min_size = spec.get("min_size") or 0
+        self.max_size = spec.get("max_size")
+        self.pattern = spec.get("filename") or None
+        self.compiled = re.compile(self.pattern) if self.pattern else None
+        self.skip = bool(spec.get("skip"))
+        self.destination = _check_template(
+            spec.get("destination") or "{category}"
+        )
+        self.filename = spec.get("name_template")
+        if self.filename:
+            _check_template(self.filename)
+
+    def fits(self, size):
+        return size >= self.min_size and (
+            self.max_size is None or size <= self.max_size
+        )
+
+    def applies(self, filename, sender):
+        """Whether the sender and filename conditions hold."""
+        if self.senders is not None and not (sender and self.senders(sender)):
+            return False
+        return self.compiled is None or bool(self.compiled.search(filename))
+
+
+class RuleSet:
+    """Settings compiled for placing files; build with compile_rules()."""
+
+    def __init__(self, settings):
+        self.only_new = bool(settings.get("only_new", True))
+        self.prefix = settings.get("folder_prefix") or ""
+        self.allowed_senders = _sender_matcher(settings.get("sender_filter"))
+        self.name_template = _check_template(NAMING_CONVENTIONS.get(
+            settings.get("naming_convention"), "{name}"
+        ))
+        self.rules = [
+            Rule(i, spec) for i, spec in enumerate(settings.get("rules") or ())
+        ]
+        # Extension -> candidate rules in order; rules without an
+        # extension condition are candidates for every extension.
+        self._any_extension = tuple(r for r in self.rules if not r.extensions)
+        self._by_extension = {}
+        for ext in {e for r in self.rules for e in r.extensions}:
+            self._by_extension[ext] = tuple(
+                r for r in self.rules if not r.extensions or ext in r.extensions
+            )
+        self._dates = (None, None)
+
+    def match(self, filename, ext, size, sender=None):
+        """The first rule matching the file, or None."""
+        for rule in self._by_extension.get(ext, self._any_extension):
+            if rule.fits(size) and rule.applies(filename, sender):
+                return rule
+        return None
+
+    def accepts_sender(self, sender):
+        """Whether the sender filter lets attachments from sender in.
+
+        sender is a normalized address; None (no sender) is let in.
+        """
+        return sender is None or self.allowed_senders is None or bool(
+            self.allowed_senders(sender)
+        )
+
+    def skips(self, filename, ext, min_size, max_size, sender=None):
+        """Whether place() returns None for every size in [min_size,
+        max_size], e.g. a part whose exact decoded size is not known yet.
+
+        Answers False whenever some size in the range might be placed.
+        """
+        if not self.accepts_sender(sender):
+            return True
+        for rule in self._by_extension.get(ext, self._any_extension):
+            if not rule.applies(filename, sender):
+                continue
+            if rule.skip and rule.fits(min_size) and rule.fits(max_size):
+                return True
+            if not rule.skip and rule.min_size <= max_size and (
+                    rule.max_size is None or rule.max_size >= min_size):
+                return False  # places some sizes in the range
+        return False
+
+    def _date_fields(self, when):
+        if self._dates[0] != when:
+            self._dates = (when, {
+                "date": when.strftime("%Y-%m-%d"), "year": when.strftime("%Y"),
+                "month": when.strftime("%m"), "day": when.strftime("%d"),
+            })
+        return self._dates[1]
+
+    def place(self, filename, ext, size, sender=None, when=None):
+        """Return (folder relative to BASE_DIR, file name), or None to skip.
+
+        sender is the normalized address for email attachments (see
+        index.sender_of); when defaults to now.
+        """
+        if not self.accepts_sender(sender):
+            return None
+        rule = self.match(filename, ext, size, sender)
+        if rule is not None and rule.skip:
+            return None
+        when = when or datetime.date.today()
+        stem = filename[:-len(ext)] if ext and filename.lower().endswith(
+            ext) else filename
+        fields = {
+            "name": filename, "stem": stem, "ext": ext,
+            "type": ext[1:].upper() or "UNKNOWN",
+            "category": config.FILE_CATEGORIES.get(ext, "Others"),
+            "sender": sender or "", **self._date_fields(when),
+        }
+        destination = "{category}" if rule is None else rule.destination
+        name_template = (rule and rule.filename) or self.name_template
+        folder = self.prefix + destination.format_map(fields)
+        parts = [p for p in folder.replace("\\", "/").split("/")
+                 if p not in ("", ".", "..")]
+        return os.path.join(*parts or ["Others"]), name_template.format_map(
+            fields
+        )
+
+
+def compile_rules(settings=None):
+    """Compile settings (default: the saved ones) into a RuleSet.
+
+    Raises ValueError or re.error for an invalid rule.
+    """
+    return RuleSet(load_settings() if settings is None else settings)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def current_rules():
+    """The saved settings compiled, recompiled only when the file changes."""
+    try:
+        st = os.stat(settings_file())
+        stamp = (settings_file(), st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stamp = (settings_file(), None, None)
+    with _cache_lock:
+        if _cache.get("stamp") != stamp:
+            _cache["rules"] = compile_rules()
+            _cache["stamp"] = stamp
+        return _cache["rules"]
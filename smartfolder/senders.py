@@ -0,0 +1,37 @@
+"""Sender lookups for the Audit Log tab.
+
+Senders are interned in the index (senders table) as they are logged,
+with per-month file counts (sender_months), so finding a sender is a
+search over distinct addresses and filtering by one only has to read
+the months it appears in.
+"""
+from contextlib import closing
+
+from .index import open_index
+
+
+def search_senders(text="", limit=50):
+    """Addresses containing text (case-insensitive), busiest first."""
+    pattern = "%" + text.strip().lower().replace("\\", "\\\\").replace(
+        "%", "\\%").replace("_", "\\_") + "%"
+    with closing(open_index()) as conn:
+        rows = conn.execute(
+            "SELECT address FROM senders WHERE address LIKE ? ESCAPE '\\' "
+            "ORDER BY files DESC, address LIMIT ?", (pattern, limit)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def sender_months(addresses):
+    """Sorted "YYYY-MM" months in which any of addresses sent files."""
+    addresses = list(addresses)
+    if not addresses:
+        return []
+    with closing(open_index()) as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT m.month FROM sender_months m "
+            "JOIN senders s ON s.id = m.sender_id "
+            f"WHERE s.address IN ({', '.join('?' * len(addresses))}) "
+            "ORDER BY m.month", addresses
+        ).fetchall()
+    return [row[0] for row in rows]
@@ -0,0 +1,61 @@
+"""User settings from the dashboard's Settings tab.
+
+Stored as JSON in BASE_DIR/settings.json, so the dashboard, the command
+line and background syncs share them. Missing keys take their defaults.
+"""
+import json
+import os
+import tempfile
+
+from . import config
+
+# File name templates offered by the Settings tab (see rules.NAME_FIELDS).
+NAMING_CONVENTIONS = {
+    "Original Filename": "{name}",
+    "ProjectName-Type": "{stem}-{type}{ext}",
+    "Type-ProjectName": "{type}-{stem}{ext}",
+    "ProjectName-Type-Date": "{stem}-{type}-{date}{ext}",
+    "Type-ProjectName-Date": "{type}-{stem}-{date}{ext}",
+}
+
+DEFAULTS = {
+    # Only save attachments from these addresses ("*@example.com" globs
+    # allowed); empty for every sender.
+    "sender_filter": [],
+    "naming_convention": "Original Filename",
+    # Prepended to every folder created under BASE_DIR.
+    "folder_prefix": "",
+    # Skip content already in the log; off files duplicates again.
+    "only_new": True,
+    # Ordered rules, first match wins: {"extensions": [".pdf"],
+    # "senders": ["*@client.com"], "min_size": 0, "max_size": null,
+    # "filename": "(?i)invoice", "destination": "Invoices/{year}"}, plus
+    # optional "name_template" (overrides naming_convention) and "skip":
+    # true to leave matching files alone. Every condition is optional.
+    "rules": [],
+}
+
+
+def settings_file():
+    return os.path.join(config.BASE_DIR, "settings.json")
+
+
+def load_settings():
+    """Return the saved settings merged over DEFAULTS."""
+    settings = json.loads(json.dumps(DEFAULTS))
+    try:
+        with open(settings_file(), encoding="utf-8") as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    return settings
+
+
+def save_settings(settings):
+    """Write settings atomically; unknown keys are dropped."""
+    os.makedirs(config.BASE_DIR, exist_ok=True)
+    values = {key: settings.get(key, DEFAULTS[key]) for key in DEFAULTS}
+    fd, tmp_path = tempfile.mkstemp(dir=config.BASE_DIR, prefix=".settings-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(values, f, indent=2)
+    os.replace(tmp_path, settings_file())
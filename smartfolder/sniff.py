@@ -0,0 +1,171 @@
+"""Recognising document types from a few bytes of their content.
+
+Extensions lie or go missing, so files are also classified by content:
+PDFs by their "%PDF-" header, OLE2 compound files (.doc, .xls, .ppt) by
+the stream names in their first directory sector, and OOXML zips (.docx,
+.xlsx, .pptx) by the member names in the zip's central directory, found
+from the end-of-central-directory record. Only those regions are read,
+so the cost per file is a few small reads whatever its size. Results are
+cached per content hash in the index's content_types table, and files on
+disk found not to be documents in its sniff_misses table.
+"""
+import os
+import struct
+
+from . import config
+
+# Bytes searched for the PDF header (it may follow a little junk).
+HEAD_BYTES = 1024
+# The end-of-central-directory record is 22 bytes plus a comment of up
+# to 64 KiB, and at most this much of the central directory is read.
+ZIP_TAIL_BYTES = 22 + 0xFFFF
+CENTRAL_DIRECTORY_BYTES = 64 * 1024
+
+_OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_OLE2_STREAMS = {
+    "WordDocument": ".doc",
+    "Workbook": ".xls",
+    "Book": ".xls",
+    "PowerPoint Document": ".ppt",
+}
+_OOXML_PARTS = {"word/": ".docx", "xl/": ".xlsx", "ppt/": ".pptx"}
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+def _sniff_ole2(f, header):
+    """Extension from the stream names in an OLE2 file's first directory
+    sector, or None."""
+    if len(header) < 0x34:
+        return None
+    sector_size = 1 << struct.unpack_from("<H", header, 0x1E)[0]
+    first_dir = struct.unpack_from("<I", header, 0x30)[0]
+    if sector_size not in (512, 4096) or first_dir >= 0xFFFFFFFA:
+        return None
+    directory = _read_at(f, (first_dir + 1) * sector_size, sector_size)
+    for pos in range(0, len(directory) - 127, 128):
+        name_len = struct.unpack_from("<H", directory, pos + 0x40)[0]
+        if not 2 <= name_len <= 64:
+            continue
+        name = directory[pos:pos + name_len - 2].decode("utf-16-le", "replace")
+        if name in _OLE2_STREAMS:
+            return _OLE2_STREAMS[name]
+    return None
+
+
+def _sniff_ooxml(f):
+    """Extension from the member names in a zip's central directory, or
+    None for other zips."""
+    size = f.seek(0, os.SEEK_END)
+    tail_start = max(0, size - ZIP_TAIL_BYTES)
+    tail = _read_at(f, tail_start, size - tail_start)
+    eocd = tail.rfind(b"PK\x05\x06")
+    if eocd < 0 or len(tail) - eocd < 22:
+        return None
+    cd_size, cd_offset = struct.unpack_from("<II", tail, eocd + 12)
+    if cd_offset == 0xFFFFFFFF:  # Zip64; not used by Office documents
+        return None
+    directory = _read_at(
+        f, cd_offset, min(cd_size, CENTRAL_DIRECTORY_BYTES)
+    )
+    pos = 0
+    while directory.startswith(b"PK\x01\x02", pos) and pos + 46 <= len(
+            directory):
+        name_len, extra_len, comment_len = struct.unpack_from(
+            "<HHH", directory, pos + 28
+        )
+        name = directory[pos + 46:pos + 46 + name_len].decode(
+            "utf-8", "replace"
+        )
+        for prefix, ext in _OOXML_PARTS.items():
+            if name.startswith(prefix):
+                return ext
+        pos += 46 + name_len + extra_len + comment_len
+    return None
+
+
+def sniff(source):
+    """Return the document extension (".pdf", ".docx", ...) or None.
+
+    source is a path or a seekable binary file object; a file object's
+    position is restored afterwards.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return sniff(f)
+    position = source.tell()
+    try:
+        head = _read_at(source, 0, HEAD_BYTES)
+        if head.startswith(_OLE2_MAGIC):
+            return _sniff_ole2(source, head)
+        if head.startswith(b"PK\x03\x04"):
+            return _sniff_ooxml(source)
+        if b"%PDF-" in head:
+            return ".pdf"
+        return None
+    finally:
+        source.seek(position)
+
+
+def could_be_document(head):
+    """Whether content starting with head (HEAD_BYTES or more of it, if
+    there is that much) may be a document sniff() recognises."""
+    head = head[:HEAD_BYTES]
+    return (
+        head.startswith((_OLE2_MAGIC, b"PK\x03\x04")) or b"%PDF-" in head
+    )
+
+
+def sniff_file(conn, path, stat_result):
+    """sniff(path), remembering files that are not documents.
+
+    A file found not to be one is not read again until its size or
+    modification time changes.
+    """
+    key = (path, stat_result.st_size, stat_result.st_mtime_ns)
+    if conn.execute(
+        "SELECT 1 FROM sniff_misses WHERE path = ? AND size = ? "
+        "AND mtime_ns = ?", key
+    ).fetchone():
+        return None
+    ext = sniff(path)
+    if ext is None:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sniff_misses VALUES (?, ?, ?)", key
+            )
+    return ext
+
+
+def detect_extension(conn, digest, source):
+    """sniff(source), cached by content digest in the index."""
+    row = conn.execute(
+        "SELECT ext FROM content_types WHERE hash = ?", (digest,)
+    ).fetchone()
+    if row is not None:
+        return row[0] or None
+    ext = sniff(source)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO content_types VALUES (?, ?)",
+            (digest, ext or "")
+        )
+    return ext
+
+
+def typed_name(filename, sniffed):
+    """Return (extension, filename) to file content under.
+
+    A name whose extension belongs to the sniffed type's category is
+    kept; otherwise the sniffed extension is appended, so "scan" holding
+    a PDF is filed as "scan.pdf". Without a sniffed type the name's own
+    extension is used.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if sniffed is None or config.FILE_CATEGORIES.get(
+            ext) == config.FILE_CATEGORIES.get(sniffed):
+        return ext, filename
+    return sniffed, filename + sniffed
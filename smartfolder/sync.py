@@ -0,0 +1,190 @@
+"""Scheduled email sync and folder sorting, independent of the dashboard.
+
+Each run fetches new attachments and sorts the configured folders on a
+small worker pool, prunes unreferenced stored objects (see objects), then
+records a summary in sync_status.json for the dashboard to display.
+While folders are being sorted, the files checked and moved so far are
+kept there too. The dashboard's own Fetch and Sort buttons start a run on
+a background thread (start_run) rather than doing the work inside the
+script.
+"""
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config
+from .imap import fetch_attachments
+from .objects import prune_objects
+from .organizer import move_existing_files, save_attachments
+
+log = logging.getLogger(__name__)
+
+# Held while a run started by start_run is in progress
+_run_lock = threading.Lock()
+# Most warnings and errors from one run kept in its status
+STATUS_MESSAGES = 50
+
+
+def sync_email():
+    """Fetch new attachments and file them; returns the saved paths."""
+    return save_attachments(fetch_attachments())
+
+
+def run_once(email=True, folders=(), executor=None, max_depth=None,
+             excludes=None):
+    """Run one email sync and sort each folder, concurrently.
+
+    max_depth and excludes are passed on to move_existing_files. Until
+    the run finishes, the status file keeps the previous run's summary
+    plus "progress": {folder: {"seen": n, "moved": n}}, updated after
+    each batch of files. Returns the status dict that is then written to
+    the status file, including the first STATUS_MESSAGES warnings and
+    errors logged during the run.
+    """
+    started = datetime.datetime.now()
+    records = []
+    handler = logging.Handler(logging.WARNING)
+    handler.emit = records.append
+    logging.getLogger(__package__).addHandler(handler)
+    try:
+        results = _run_jobs(
+            email, folders, executor, max_depth, excludes,
+            _progress_reporter(started)
+        )
+    finally:
+        logging.getLogger(__package__).removeHandler(handler)
+    status = {
+        "started": started.strftime("%Y-%m-%d %H:%M:%S"),
+        "finished": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "jobs": results,
+        "messages": [
+            {"level": r.levelname, "message": r.getMessage()}
+            for r in records[:STATUS_MESSAGES]
+        ],
+    }
+    write_status(status)
+    log.info("Sync finished: %s", results)
+    return status
+
+
+def _progress_reporter(started):
+    """Return progress(folder), a move_existing_files progress callback
+    that records the folder's counts in the status file."""
+    previous = read_status() or {}
+    progress = {}
+    lock = threading.Lock()
+
+    def for_folder(folder):
+        def report(seen, moved):
+            with lock:
+                progress[folder] = {"seen": seen, "moved": moved}
+                write_status({
+                    **previous,
+                    "running": started.strftime("%Y-%m-%d %H:%M:%S"),
+                    "progress": progress,
+                })
+        return report
+    return for_folder
+
+
+def _run_jobs(email, folders, executor, max_depth, excludes, progress):
+    jobs = {}
+    results = {}
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(
+            max(1, int(email) + len(folders)), thread_name_prefix="sync"
+        )
+    try:
+        if email:
+            if config.EMAIL and config.APP_PASSWORD:
+                jobs["email"] = executor.submit(sync_email)
+            else:
+                log.error("Email credentials are not configured")
+        for folder in folders:
+            jobs[folder] = executor.submit(
+                move_existing_files, folder, max_depth=max_depth,
+                excludes=excludes, progress=progress(folder)
+            )
+        for name, job in jobs.items():
+            try:
+                results[name] = {"files": len(job.result())}
+            except Exception as e:
+                log.exception("Sync job %s failed: %s", name, e)
+                results[name] = {"error": str(e)}
+    finally:
+        if own_executor:
+            executor.shutdown()
+    if config.OBJECT_STORE:
+        try:
+            pruned = prune_objects()
+            if pruned:
+                log.info("Pruned %d unreferenced object(s)", pruned)
+        except OSError as e:
+            log.warning("Could not prune objects: %s", e)
+    return results
+
+
+def run_forever(interval, email=True, folders=(), workers=None):
+    """Repeat run_once every interval seconds until interrupted."""
+    workers = workers or max(1, int(email) + len(folders))
+    with ThreadPoolExecutor(workers, thread_name_prefix="sync") as executor:
+        while True:
+            began = time.monotonic()
+            run_once(email, folders, executor)
+            time.sleep(max(0.0, interval - (time.monotonic() - began)))
+
+
+def start_run(email=True, folders=(), max_depth=None, excludes=None):
+    """Start run_once on a background thread unless one is still going.
+
+    Returns whether a run was started; its summary appears in
+    read_status() once it finishes.
+    """
+    if not _run_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            run_once(email, folders, max_depth=max_depth, excludes=excludes)
+        except Exception:
+            log.exception("Sync failed")
+        finally:
+            _run_lock.release()
+    threading.Thread(target=run, name="sync-run", daemon=True).start()
+    return True
+
+
+def is_running():
+    """Whether a run started by start_run is in progress."""
+    return _run_lock.locked()
+
+
+def status_file():
+    return os.path.join(config.BASE_DIR, "sync_status.json")
+
+
+def write_status(status):
+    os.makedirs(config.BASE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=config.BASE_DIR, prefix=".status-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(status, f)
+    os.replace(tmp_path, status_file())
+
+
+def read_status():
+    """Return the last run summary, or None if no run has finished yet.
+
+    During a run that sorts folders it also holds "running" (the start
+    time) and "progress" (see run_once), and may hold no summary yet.
+    """
+    try:
+        with open(status_file(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,298 @@
+"""Sort files as they land, driven by filesystem events instead of rescans.
+
+On Linux this reads inotify directly; elsewhere it uses watchdog. A file
+is sorted as soon as the writer closes it or it is renamed into the
+folder (the usual way browsers finish a download). Files that only
+produce create/modify events are sorted once they have been quiet for
+``settle`` seconds. Empty files are left alone: browsers such as Firefox
+close an empty placeholder under the final name and later rename the
+finished download over it. Before a file is sorted its size and mtime
+are checked again, and a file that changed since its last event waits
+another quiet period.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from contextlib import closing
+
+from . import config
+from .index import open_index
+from .organizer import move_existing_files, organize_file
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # optional: only needed for watch mode
+    FileSystemEventHandler = object
+    Observer = None
+
+log = logging.getLogger(__name__)
+
+# Seconds a file must go without events before it is treated as complete.
+SETTLE_SECONDS = 1.0
+
+# inotify(7) event bits.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+    | IN_DELETE
+)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    """Minimal inotify reader.
+
+    Used instead of watchdog on Linux because watchdog holds every event
+    queued behind an unpaired move-out for half a second, and the watcher
+    itself moves each sorted file out of the folder.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._folders = {}
+
+    def add(self, folder):
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(folder), _WATCH_MASK
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), folder)
+        self._folders[wd] = folder
+
+    def read(self):
+        """Return [(path, mask)]; path is None on queue overflow."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, pos)
+            name = data[pos + 16:pos + 16 + length].rstrip(b"\0")
+            pos += 16 + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif name and wd in self._folders and not mask & IN_ISDIR:
+                events.append((
+                    os.path.join(self._folders[wd], os.fsdecode(name)), mask
+                ))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Events(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_closed(self, event):
+        # Only emitted for files closed after writing (IN_CLOSE_WRITE).
+        if not event.is_directory:
+            self.watcher.touch(event.src_path, ready=True)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.forget(event.src_path)
+            self.watcher.touch(event.dest_path, ready=True)
+
+    def on_deleted(self, event):
+        self.watcher.forget(event.src_path)
+
+
+class FolderWatcher:
+    """Watch folders (non-recursively) and sort new files into BASE_DIR."""
+
+    def __init__(self, folders, settle=None, initial_scan=True):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.settle = SETTLE_SECONDS if settle is None else settle
+        self.initial_scan = initial_scan
+        self._due = {}
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._inotify = None
+        self._observer = None
+        if sys.platform.startswith("linux"):
+            self._inotify = _Inotify()
+            self._stop_r, self._stop_w = os.pipe()
+        elif Observer is None:
+            raise RuntimeError("watch mode requires the watchdog package")
+        else:
+            self._observer = Observer()
+        self._threads = [threading.Thread(
+            target=self._run, name="folder-watcher", daemon=True
+        )]
+        if self._inotify is not None:
+            self._threads.append(threading.Thread(
+                target=self._read_inotify, name="inotify-reader", daemon=True
+            ))
+
+    def touch(self, path, ready=False):
+        """Note activity on path; ready means the file is complete.
+
+        An empty file is never ready, since it may be a placeholder for a
+        download still in progress.
+        """
+        seen = _stat_key(path)
+        delay = 0 if ready and seen and seen[0] else self.settle
+        with self._wakeup:
+            self._due[path] = time.monotonic() + delay, seen
+            self._wakeup.notify()
+
+    def forget(self, path):
+        with self._wakeup:
+            self._due.pop(path, None)
+
+    def start(self):
+        if self._inotify is not None:
+            for folder in self.folders:
+                self._inotify.add(folder)
+        else:
+            handler = _Events(self)
+            for folder in self.folders:
+                self._observer.schedule(handler, folder, recursive=False)
+            self._observer.start()
+        for thread in self._threads:
+            thread.start()
+        # Files that arrived while nobody was watching.
+        if self.initial_scan:
+            self.rescan()
+
+    def rescan(self):
+        for folder in self.folders:
+            move_existing_files(folder)
+
+    def stop(self):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._inotify is not None:
+            os.write(self._stop_w, b"x")
+        else:
+            self._observer.stop()
+            self._observer.join()
+        for thread in self._threads:
+            thread.join()
+        if self._inotify is not None:
+            self._inotify.close()
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+
+    def _read_inotify(self):
+        while True:
+            readable, _, _ = select.select(
+                [self._inotify.fd, self._stop_r], [], []
+            )
+            if self._stop_r in readable:
+                return
+            for path, mask in self._inotify.read():
+                if path is None:
+                    log.warning("inotify queue overflowed; rescanning")
+                    self.rescan()
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.touch(path, ready=True)
+                elif mask & (IN_CREATE | IN_MODIFY):
+                    self.touch(path)
+                else:
+                    self.forget(path)
+
+    def _take_due(self):
+        """Wait for the files whose quiet period is over.
+
+        Returns [(path, (size, mtime_ns) when last touched)].
+        """
+        with self._wakeup:
+            while not self._stopping:
+                now = time.monotonic()
+                ready = [
+                    (p, seen) for p, (due, seen) in self._due.items()
+                    if due <= now
+                ]
+                if ready:
+                    for path, _ in ready:
+                        del self._due[path]
+                    return ready
+                timeout = None
+                if self._due:
+                    timeout = min(due for due, _ in self._due.values()) - now
+                self._wakeup.wait(timeout)
+            return []
+
+    def _run(self):
+        with closing(open_index()) as conn:
+            while True:
+                paths = self._take_due()
+                if not paths:
+                    return
+                folders = {}
+                for path, seen in paths:
+                    try:
+                        try:
+                            stat_result = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        if not stat.S_ISREG(stat_result.st_mode):
+                            continue
+                        if (stat_result.st_size,
+                                stat_result.st_mtime_ns) != seen:
+                            self.touch(path)  # still being written
+                            continue
+                        if not stat_result.st_size:
+                            log.debug("Leaving empty file %s", path)
+                            continue
+                        dest_path = organize_file(
+                            conn, path, stat_result, folders=folders
+                        )
+                        if dest_path:
+                            log.info("Sorted %s -> %s", path, dest_path)
+                    except Exception as e:
+                        log.warning("Error processing %s: %s", path, e)
+
+
+def _stat_key(path):
+    """(size, mtime_ns) of path, or None if it is gone."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+
+def watch(folders=None, settle=None):
+    """Sort files in folders as they arrive until interrupted."""
+    watcher = FolderWatcher(folders or [config.DOWNLOADS_DIR], settle)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(3600)
+    finally:
+        watcher.stop()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from smartfolder import config  # noqa: E402
+
+
+@pytest.fixture
+def configure(tmp_path):
+    """Point the app at a fresh folder; returns configure(**secrets).
+
+    Log rotation is off unless the test turns it on.
+    """
+    def configure(**secrets):
+        secrets = {"log_rotate_mb": 0, "log_rotate_days": 0, **secrets}
+        config.configure(secrets, base_dir=str(tmp_path / "EmailDownloads"))
+        os.makedirs(config.BASE_DIR, exist_ok=True)
+        return config
+    configure()
+    yield configure
+    config.configure()
+
+
+@pytest.fixture
+def base_dir(configure):
+    return config.BASE_DIR
@@ -0,0 +1,212 @@
+"""A tiny threaded IMAP4rev1 server holding one mailbox in memory.
+
+It understands just the commands the fetcher sends: LOGIN, SELECT, UID
+SEARCH and UID FETCH of UID, BODYSTRUCTURE, the From header and (ranges
+of) body sections.
+"""
+import email
+import email.utils
+import re
+import socketserver
+import threading
+import urllib.parse
+
+
+def _quote(value):
+    if value is None:
+        return b"NIL"
+    if isinstance(value, str):
+        value = value.encode()
+    return b'"' + value.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+
+
+def _params(pairs):
+    if not pairs:
+        return b"NIL"
+    out = []
+    for key, value in pairs:
+        if isinstance(value, tuple):  # RFC 2231
+            key, value = key + "*", "%s'%s'%s" % (
+                value[0] or "", value[1] or "",
+                urllib.parse.quote(email.utils.collapse_rfc2231_value(value))
+            )
+        out.append(_quote(key) + b" " + _quote(value))
+    return b"(" + b" ".join(out) + b")"
+
+
+def _raw_payload(part):
+    payload = part.get_payload(decode=False)
+    return payload.encode() if isinstance(payload, str) else payload
+
+
+def bodystructure(part):
+    if part.is_multipart():
+        children = b"".join(bodystructure(p) for p in part.get_payload())
+        return (b"(" + children + b" "
+                + _quote(part.get_content_subtype().upper()) + b")")
+    raw = _raw_payload(part)
+    disposition = part.get("Content-Disposition")
+    if disposition:
+        disposition = (
+            b"(" + _quote(disposition.split(";")[0].strip().upper()) + b" "
+            + _params(part.get_params(header="content-disposition")[1:])
+            + b")"
+        )
+    else:
+        disposition = b"NIL"
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        _params((part.get_params() or [None])[1:]), b"NIL", b"NIL",
+        _quote(part.get("Content-Transfer-Encoding", "7BIT").upper()),
+        str(len(raw)).encode(),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(raw.count(b"\n")).encode())
+    fields += [b"NIL", disposition, b"NIL", b"NIL"]
+    return b"(" + b" ".join(fields) + b")"
+
+
+def section_bytes(msg, section):
+    part = msg
+    for n in map(int, section.split(".")):
+        if part.is_multipart():
+            part = part.get_payload()[n - 1]
+        elif n != 1:
+            raise KeyError(section)
+    return _raw_payload(part)
+
+
+class Mailbox:
+    """The messages served, and a record of what clients did."""
+
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = []  # (uid, raw bytes)
+        self.next_uid = 1
+        self.fetched = []  # (UID set, items) of every UID FETCH
+        self.logins = 0
+        self.connected = 0
+        self.peak_connected = 0
+        self._lock = threading.Lock()
+
+    def add(self, raw):
+        self.messages.append((self.next_uid, raw))
+        self.next_uid += 1
+        return self.next_uid - 1
+
+    def fetched_uids(self):
+        return {
+            int(uid) for uid_set, _ in self.fetched
+            for uid in uid_set.split(b",") if uid.isdigit()
+        }
+
+    def _connection(self, delta):
+        with self._lock:
+            self.connected += delta
+            self.peak_connected = max(self.peak_connected, self.connected)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def send(self, line):
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        mailbox._connection(1)
+        try:
+            self.send(b"* OK stand-in ready")
+            for line in self.rfile:
+                tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+                command, _, args = rest.partition(b" ")
+                if not self.command(mailbox, tag, command.upper(), args):
+                    return
+        finally:
+            mailbox._connection(-1)
+
+    def command(self, mailbox, tag, command, args):
+        if command == b"CAPABILITY":
+            self.send(b"* CAPABILITY IMAP4rev1")
+        elif command == b"LOGIN":
+            with mailbox._lock:
+                mailbox.logins += 1
+        elif command in (b"SELECT", b"EXAMINE"):
+            self.send(b"* %d EXISTS" % len(mailbox.messages))
+            self.send(b"* OK [UIDVALIDITY %d] ok" % mailbox.uidvalidity)
+            self.send(b"* OK [UIDNEXT %d] ok" % mailbox.next_uid)
+        elif command == b"LOGOUT":
+            self.send(b"* BYE")
+            self.send(tag + b" OK bye")
+            return False
+        elif command == b"UID":
+            sub, _, args = args.partition(b" ")
+            if sub.upper() == b"SEARCH":
+                self.search(mailbox, args)
+            elif sub.upper() == b"FETCH":
+                self.fetch(mailbox, args)
+            else:
+                self.send(tag + b" BAD unknown command")
+                return True
+        elif command != b"NOOP":
+            self.send(tag + b" BAD unknown command")
+            return True
+        self.send(tag + b" OK done")
+        return True
+
+    def search(self, mailbox, args):
+        after = re.search(rb"UID (\d+):\*", args)
+        uids = [
+            uid for uid, _ in mailbox.messages
+            if not after or uid >= int(after.group(1))
+        ]
+        if after and not uids and mailbox.messages:
+            uids = [mailbox.messages[-1][0]]  # "n:*" matches the newest
+        self.send(b"* SEARCH " + b" ".join(b"%d" % uid for uid in uids))
+
+    def fetch(self, mailbox, args):
+        uid_set, _, items = args.partition(b" ")
+        mailbox.fetched.append((uid_set, items))
+        wanted = {int(uid) for uid in uid_set.split(b",")}
+        for seq, (uid, raw) in enumerate(mailbox.messages, 1):
+            if uid not in wanted:
+                continue
+            msg = email.message_from_bytes(raw)
+            head = [b"UID %d" % uid]
+            if b"BODYSTRUCTURE" in items.upper():
+                head.append(b"BODYSTRUCTURE " + bodystructure(msg))
+            literals = []
+            if b"HEADER.FIELDS" in items.upper():
+                literals.append((
+                    b"BODY[HEADER.FIELDS (FROM)]",
+                    b"From: %s\r\n\r\n" % msg["From"].encode()
+                ))
+            for m in re.finditer(
+                    rb"BODY\.PEEK\[([\d.]+)\](?:<(\d+)\.(\d+)>)?", items):
+                data = section_bytes(msg, m.group(1).decode())
+                name = b"BODY[" + m.group(1) + b"]"
+                if m.group(2):
+                    offset, length = int(m.group(2)), int(m.group(3))
+                    data = data[offset:offset + length]
+                    name += b"<%d>" % offset
+                literals.append((name, data))
+            line = b"* %d FETCH (" % seq + b" ".join(head)
+            for name, data in literals:
+                self.wfile.write(
+                    line + b" " + name + b" {%d}\r\n" % len(data) + data
+                )
+                line = b""
+            self.send(line + b")")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve(mailbox):
+    """Serve mailbox on a free local port; returns the server."""
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.mailbox = mailbox
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,104 @@
+import datetime
+import os
+import threading
+import time
+
+import pytest
+
+from streamlit.testing.v1 import AppTest
+
+from smartfolder import sync
+
+APP = os.path.join(os.path.dirname(__file__), os.pardir, "SmartFolder_AI.py")
+SENDERS = ["a@example.com", "c@example.com"] + [
+    f"user{i}@example.org" for i in range(20)
+]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The dashboard, logged in, over a log of 600 files."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.chdir(os.path.dirname(APP))
+    base = tmp_path / "Downloads" / "EmailDownloads"
+    base.mkdir(parents=True)
+    start = datetime.datetime.now() - datetime.timedelta(days=5)
+    with open(base / "download_log.txt", "w", encoding="utf-8") as f:
+        for i in range(600):
+            ts = start + datetime.timedelta(minutes=10 * i)
+            f.write(f"{ts:%Y-%m-%d %H:%M:%S}\th{i}\tfile{i}.pdf\t"
+                    f"Email ({SENDERS[i % len(SENDERS)]})\n")
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.secrets["email"] = {"email_user": "me@example.com", "email_pass": "x"}
+    at.session_state["authenticated"] = True
+    yield at.run()
+    from smartfolder import config
+    config.configure()
+
+
+def labelled(widgets, text):
+    return next(w for w in widgets if text in w.label)
+
+
+def entries(at):
+    return next(c.value for c in at.caption if "entries" in c.value)
+
+
+def test_sender_filter_survives_new_searches(app):
+    assert not app.exception
+    labelled(app.text_input, "Search Senders").input("c@ex").run()
+    labelled(app.multiselect, "Filter by Sender").select("c@example.com").run()
+    filtered = entries(app)
+    assert filtered.startswith(f"{600 // len(SENDERS) + 1} entries")
+
+    for query in ("user1", "nobody", ""):
+        labelled(app.text_input, "Search Senders").input(query).run()
+        assert not app.exception
+        assert labelled(app.multiselect, "Filter by Sender").value == [
+            "c@example.com"
+        ]
+        assert entries(app) == filtered
+
+    labelled(app.text_input, "Search Senders").input("user1").run()
+    labelled(app.multiselect, "Filter by Sender").unselect(
+        "c@example.com"
+    ).run()
+    labelled(app.text_input, "Search Senders").input("").run()
+    assert labelled(app.multiselect, "Filter by Sender").value == []
+    assert entries(app).startswith("600 entries")
+
+
+def test_export_leaves_no_file_behind(app, tmp_path, monkeypatch):
+    exports = tmp_path / "tmp"
+    exports.mkdir()
+    monkeypatch.setattr("tempfile.tempdir", str(exports))
+    labelled(app.button, "Export Log").click().run()
+    assert not app.exception
+    assert not any("rror" in e.value for e in app.error)
+    assert list(exports.iterdir()) == []
+
+
+def test_sort_progress_is_shown_while_it_runs(app, monkeypatch):
+    reported = threading.Event()
+    release = threading.Event()
+
+    def move_existing_files(folder, max_depth=None, excludes=None,
+                            progress=None):
+        progress(64, 10)
+        reported.set()
+        release.wait(10)
+        return [folder] * 12
+    monkeypatch.setattr(sync, "move_existing_files", move_existing_files)
+
+    labelled(app.button, "Sort Files").click().run()
+    assert reported.wait(10)
+    labelled(app.button, "Refresh").click().run()
+    assert any(
+        "checked 64 file(s), moved 10" in c.value for c in app.caption
+    )
+
+    release.set()
+    while sync.is_running():
+        time.sleep(0.01)
+    app.run()
+    assert any("12 file(s) filed" in s.value for s in app.success)
@@ -0,0 +1,83 @@
+import errno
+import os
+
+import pytest
+
+from smartfolder import destinations
+from smartfolder.destinations import Destination, rename_new
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_names_taken_by_another_process_get_the_next_suffix(tmp_path):
+    folder = tmp_path / "Documents"
+    folder.mkdir()
+    destination = Destination(str(folder))
+    destination.reserve("other.pdf")  # lists the (empty) folder
+    # Taken by another process after the listing.
+    write(folder / "a.pdf", b"theirs")
+    write(folder / "a (1).pdf", b"theirs too")
+
+    src = tmp_path / "incoming"
+    write(src, b"ours")
+    path = destination.put("a.pdf", lambda dest: rename_new(str(src), dest))
+    assert os.path.basename(path) == "a (2).pdf"
+    assert read(path) == b"ours"
+    assert read(folder / "a.pdf") == b"theirs"
+    assert destination.reserve("a.pdf").endswith("a (3).pdf")
+
+
+def test_reserved_names_never_collide_within_a_batch(tmp_path):
+    destination = Destination(str(tmp_path))
+    assert [os.path.basename(destination.reserve(n)) for n in (
+        "a.pdf", "A.pdf", "a.pdf"
+    )] == ["a.pdf", "A (1).pdf", "a (2).pdf"]
+
+
+@pytest.fixture(params=[errno.EPERM, errno.EXDEV])
+def no_hard_links(request, monkeypatch):
+    """os.link failing as on a filesystem without hard links (EPERM) or
+    across devices (EXDEV, which copies)."""
+    def link(src, dst):
+        raise OSError(request.param, os.strerror(request.param))
+    monkeypatch.setattr(destinations.os, "link", link)
+    return request.param
+
+
+def test_rename_new_falls_back_to_a_placeholder(tmp_path, no_hard_links):
+    src, dst = tmp_path / "src", tmp_path / "dst.pdf"
+    write(src, b"content")
+    rename_new(str(src), str(dst))
+    assert read(dst) == b"content"
+    assert sorted(os.listdir(tmp_path)) == ["dst.pdf"]
+
+
+def test_rename_new_fallback_never_replaces(tmp_path, no_hard_links):
+    src, dst = tmp_path / "src", tmp_path / "dst.pdf"
+    write(src, b"new")
+    write(dst, b"old")
+    with pytest.raises(FileExistsError):
+        rename_new(str(src), str(dst))
+    assert read(dst) == b"old"
+    assert read(src) == b"new"
+
+
+def test_failed_fallback_removes_its_placeholder(
+        tmp_path, monkeypatch, no_hard_links):
+    src, dst = tmp_path / "src", tmp_path / "dst.pdf"
+    write(src, b"content")
+
+    def fail(*args):
+        raise OSError(errno.EIO, "I/O error")
+    monkeypatch.setattr(destinations.os, "replace", fail)
+    with pytest.raises(OSError):
+        rename_new(str(src), str(dst))
+    assert sorted(os.listdir(tmp_path)) == ["src"]
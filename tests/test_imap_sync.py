@@ -0,0 +1,131 @@
+import os
+from email.message import EmailMessage
+
+import pytest
+
+import imapd
+from smartfolder import organizer
+from smartfolder.imap import fetch_attachments
+from smartfolder.organizer import save_attachments
+from smartfolder.settings import save_settings
+
+
+def message(n, content=None, subtype="pdf", filename=None):
+    msg = EmailMessage()
+    msg["From"] = f"Sender {n} <sender{n}@example.com>"
+    msg["Subject"] = f"Report {n}"
+    msg.set_content("Attached.")
+    msg.add_attachment(
+        content or b"%PDF-1.7\n" + bytes([n]) * 100, maintype="application",
+        subtype=subtype, filename=filename or f"report_{n}.pdf"
+    )
+    return msg.as_bytes()
+
+
+@pytest.fixture
+def mailbox(configure):
+    mailbox = imapd.Mailbox()
+    server = imapd.serve(mailbox)
+    mailbox.settings = {
+        "email": {"email_user": "me@example.com", "email_pass": "secret"},
+        "imap_host": "127.0.0.1", "imap_port": server.server_address[1],
+        "imap_ssl": False, "attachment_chunk_size": 64,
+    }
+    configure(**mailbox.settings)
+    yield mailbox
+    server.shutdown()
+    server.server_close()
+
+
+def names(paths):
+    return [os.path.basename(path) for path in paths]
+
+
+def sync():
+    return save_attachments(fetch_attachments())
+
+
+def part_fetches(mailbox):
+    """UIDs whose attachment parts were fetched (not just structure)."""
+    return {
+        int(uid) for uid_set, items in mailbox.fetched
+        if b"BODYSTRUCTURE" not in items for uid in uid_set.split(b",")
+    }
+
+
+def test_failed_save_is_fetched_again(mailbox, monkeypatch):
+    first = mailbox.add(message(1))
+    mailbox.add(message(2))
+    place_content = organizer._place_content
+
+    def fail_first(digest, src, dest):
+        if dest.endswith("report_1.pdf"):
+            raise OSError("disk full")
+        place_content(digest, src, dest)
+    monkeypatch.setattr(organizer, "_place_content", fail_first)
+    assert names(sync()) == ["report_2.pdf"]
+
+    monkeypatch.setattr(organizer, "_place_content", place_content)
+    mailbox.fetched.clear()
+    assert names(sync()) == ["report_1.pdf"]
+    assert first in mailbox.fetched_uids()
+
+    mailbox.fetched.clear()
+    assert sync() == []
+    assert mailbox.fetched_uids() == set()
+
+
+def test_saved_messages_are_not_fetched_again(mailbox):
+    mailbox.add(message(1))
+    assert len(sync()) == 1
+    mailbox.fetched.clear()
+    mailbox.add(message(2))
+    assert names(sync()) == ["report_2.pdf"]
+    assert mailbox.fetched_uids() == {2}
+
+
+def test_octet_stream_parts_are_sniffed_from_the_first_chunk(mailbox):
+    mailbox.add(message(
+        1, b"\x89PNG\r\n" + bytes(range(256)) * 4, "octet-stream", "scan"
+    ))
+    mailbox.add(message(
+        2, b"%PDF-1.7\n" + bytes(range(256)) * 4, "octet-stream", "scan"
+    ))
+    assert names(sync()) == ["scan.pdf"]
+    # Only the PDF was fetched past its first chunk.
+    ranged = [uids for uids, items in mailbox.fetched if b"]<64." in items]
+    assert ranged and set(ranged) == {b"2"}
+
+
+def test_connections_never_exceed_the_pool_size(mailbox, configure):
+    configure(
+        **mailbox.settings, imap_pool_size=2, imap_batch_size=1,
+        imap_max_in_flight=4
+    )
+    for n in range(1, 13):
+        # Several chunks each, so the consumer fetches ranges while the
+        # pool fetches the next messages.
+        mailbox.add(message(n, b"%PDF-1.7\n" + bytes([n]) * 300))
+    assert len(sync()) == 12
+    assert mailbox.peak_connected <= 2
+
+
+def test_filtered_senders_parts_are_not_fetched(mailbox):
+    save_settings({"sender_filter": ["sender2@example.com"]})
+    mailbox.add(message(1))
+    mailbox.add(message(2))
+    assert names(sync()) == ["report_2.pdf"]
+    assert part_fetches(mailbox) == {2}
+    # Filtered, not failed: the watermark moved past both.
+    mailbox.fetched.clear()
+    assert sync() == [] and mailbox.fetched_uids() == set()
+
+
+def test_parts_skipped_by_size_are_not_fetched(mailbox):
+    save_settings({"rules": [
+        {"extensions": [".pdf"], "min_size": 1000, "skip": True}
+    ]})
+    mailbox.add(message(1, b"%PDF-1.7\n" + bytes(range(256)) * 8))
+    mailbox.add(message(2))
+    assert names(sync()) == ["report_2.pdf"]
+    assert part_fetches(mailbox) == {2}
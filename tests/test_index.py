@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from contextlib import closing
+
+from smartfolder import config, index, logfile
+from smartfolder.index import (
+    CLAIM_TIMEOUT, LogWriter, claim_hash, claim_hashes, has_been_downloaded,
+    open_index, release_hash
+)
+from smartfolder.logfile import (
+    append_log, archived_segments, prune_archives, rotate_log
+)
+from smartfolder.logstore import compact_log, compacted_position
+
+
+def log_lines(first, count, day):
+    return "".join(
+        f"{day} 10:00:00\th{i}\treport_{i}.pdf\tEmail (s{i % 2}@example.com)\n"
+        for i in range(first, first + count)
+    ).encode()
+
+
+def derived(conn):
+    return (
+        conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0],
+        sorted(conn.execute("SELECT day, files FROM daily_counts")),
+        sorted(conn.execute("SELECT address, files FROM senders")),
+    )
+
+
+def prune_everything_archived():
+    old = time.time() - 10 * 86400
+    for path in archived_segments().values():
+        os.utime(path, (old, old))
+    assert prune_archives()
+
+
+def test_rebuild_after_prune_keeps_history(configure):
+    configure(log_retention_days=1)
+    append_log(log_lines(0, 30, "2024-01-01"))
+    append_log(log_lines(30, 10, "2024-01-02"))
+    with closing(open_index()):
+        rotate_log()
+    prune_everything_archived()
+    append_log(log_lines(40, 4, "2024-01-02"))
+    with closing(open_index()) as conn:
+        before = derived(conn)
+        assert before[0] == 44
+        # Force a rebuild, as a new DERIVED_VERSION would.
+        with conn:
+            conn.execute(
+                "UPDATE meta SET value = '0' WHERE key = 'derived_version'"
+            )
+    # Counted for the first time by the rebuild.
+    append_log(log_lines(44, 1, "2024-01-02"))
+    with closing(open_index()) as conn:
+        hashes, days, senders = derived(conn)
+    assert hashes == 45
+    assert days == [("2024-01-01", 30), ("2024-01-02", 15)]
+    assert senders == [("s0@example.com", 23), ("s1@example.com", 22)]
+    assert has_been_downloaded("h0")
+
+
+def test_truncated_log_after_prune_keeps_history(configure):
+    configure(log_retention_days=1)
+    append_log(log_lines(0, 20, "2024-01-01"))
+    with closing(open_index()):
+        rotate_log()
+    prune_everything_archived()
+    append_log(log_lines(20, 20, "2024-01-02"))
+    with closing(open_index()):
+        pass
+    # Replace the live log with a shorter one.
+    with open(config.LOG_FILE, "wb") as f:
+        f.write(log_lines(40, 2, "2024-01-03"))
+    with closing(open_index()) as conn:
+        hashes, days, _ = derived(conn)
+    assert hashes == 42
+    assert days == [
+        ("2024-01-01", 20), ("2024-01-02", 20), ("2024-01-03", 2)
+    ]
+    assert has_been_downloaded("h0")
+
+
+def test_rebuild_without_pruned_archives_starts_over(configure):
+    append_log(log_lines(0, 5, "2024-01-01"))
+    with closing(open_index()):
+        pass
+    with open(config.LOG_FILE, "wb") as f:
+        f.write(log_lines(5, 2, "2024-01-02"))
+    with closing(open_index()) as conn:
+        hashes, days, _ = derived(conn)
+    assert hashes == 2
+    assert days == [("2024-01-02", 2)]
+
+
+def test_has_been_downloaded_uses_the_callers_connection(
+        base_dir, monkeypatch):
+    append_log(log_lines(0, 2, "2024-01-01"))
+    with closing(open_index()) as conn:
+        def reopened():
+            raise AssertionError("index opened again")
+        monkeypatch.setattr(index, "open_index", reopened)
+        assert has_been_downloaded("h1", conn)
+        assert not has_been_downloaded("h2", conn)
+    monkeypatch.undo()
+    assert has_been_downloaded("h0")
+
+
+def test_sync_after_rotation_moves_past_the_archive(base_dir, monkeypatch):
+    append_log(log_lines(0, 5, "2024-01-01"))
+    with closing(open_index()):
+        pass
+    compact_log()
+    rotate_log()
+    # Both readers step into the new, empty live segment once ...
+    with closing(open_index()) as conn:
+        assert index._log_position(conn) == (2, 0)
+    compact_log()
+    assert compacted_position() == (2, 0)
+
+    # ... and after that never open the archive again.
+    opened = []
+    open_segment = logfile._open_segment
+    monkeypatch.setattr(
+        logfile, "_open_segment",
+        lambda path: opened.append(path) or open_segment(path)
+    )
+    with closing(open_index()) as conn:
+        assert derived(conn)[0] == 5
+    compact_log()
+    assert has_been_downloaded("h4")
+    assert not [path for path in opened if path.endswith(".gz")]
+
+
+def test_only_one_writer_wins_each_claim(base_dir):
+    digests = [f"h{i}" for i in range(50)]
+    won = []
+    start = threading.Barrier(4)
+
+    def writer():
+        with closing(open_index()) as conn:
+            start.wait()
+            won.append(claim_hashes(conn, digests))
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(len(w) for w in won) == len(digests)
+    assert set().union(*won) == set(digests)
+
+    with closing(open_index()) as first, closing(open_index()) as second:
+        assert claim_hash(first, "x")
+        assert not claim_hash(second, "x")
+        release_hash(first, "x")
+        assert claim_hash(second, "x")
+
+
+def test_claims_expire_after_the_timeout(base_dir, monkeypatch):
+    with closing(open_index()) as conn:
+        assert claim_hash(conn, "x")
+        now = time.time()
+        monkeypatch.setattr(index.time, "time", lambda: now + 60)
+        assert not claim_hash(conn, "x")
+        monkeypatch.setattr(
+            index.time, "time", lambda: now + CLAIM_TIMEOUT + 1
+        )
+        assert claim_hash(conn, "x")
+
+
+def test_log_writer_flush_releases_its_claims(base_dir):
+    with closing(open_index()) as conn, closing(open_index()) as other:
+        assert claim_hashes(conn, ["a", "b"]) == {"a", "b"}
+        with LogWriter(conn, batch_size=10) as writer:
+            writer.add("a", "a.pdf")
+            # Queued, not logged: still claimed.
+            assert not claim_hash(other, "a")
+            assert len(conn.execute("SELECT hash FROM claims").fetchall()) == 2
+        assert conn.execute(
+            "SELECT hash FROM claims"
+        ).fetchall() == [("b",)]
+        assert has_been_downloaded("a", other)
+        assert not claim_hash(other, "a")  # logged now
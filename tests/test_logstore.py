@@ -0,0 +1,118 @@
+import glob
+import os
+import threading
+
+import pytest
+
+from smartfolder import logstore
+from smartfolder.logfile import append_log
+from smartfolder.logstore import (
+    compact_log, count_rows, open_dataset, write_csv
+)
+
+
+def log_lines(first, count):
+    return "".join(
+        f"2024-0{1 + i % 2}-01 10:00:00\th{i}\treport_{i}.pdf\tDownloads\n"
+        for i in range(first, first + count)
+    ).encode()
+
+
+def test_rerun_after_interrupted_compaction_adds_no_rows(
+        base_dir, monkeypatch):
+    append_log(log_lines(0, 10))
+
+    def crash(*args):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(logstore, "_write_position", crash)
+    with pytest.raises(KeyboardInterrupt):
+        compact_log()  # the parts are written, the position is not
+    monkeypatch.undo()
+
+    append_log(log_lines(10, 5))
+    assert count_rows(open_dataset()) == 15
+    append_log(log_lines(15, 1))
+    assert count_rows(open_dataset()) == 16
+
+
+def test_compaction_catches_up_in_blocks(base_dir, monkeypatch):
+    monkeypatch.setattr(logstore, "COMPACT_BLOCK_SIZE", 200)
+    append_log(log_lines(0, 20))
+    writes = []
+    write_position = logstore._write_position
+    monkeypatch.setattr(
+        logstore, "_write_position",
+        lambda *position: writes.append(position) or write_position(*position)
+    )
+    assert compact_log() == len(log_lines(0, 20))
+    assert len(writes) > 1
+    assert writes[-1] == (1, len(log_lines(0, 20)))
+    assert count_rows(open_dataset()) == 20
+
+
+def compact_in_steps(first, steps):
+    """Append and compact one line at a time; returns the next line."""
+    for i in range(first, first + steps):
+        append_log(log_lines(i, 1))
+        compact_log()
+    return first + steps
+
+
+def stored_parts():
+    return sorted(
+        os.path.basename(p) for p in glob.glob(
+            os.path.join(logstore.store_dir(), "month=*", "*")
+        )
+    )
+
+
+@pytest.mark.parametrize("crash_in", ["_write_table", "_finish_merge"])
+def test_rerun_after_interrupted_merge_adds_no_rows(
+        base_dir, monkeypatch, crash_in):
+    monkeypatch.setattr(logstore, "MAX_PARTS_PER_MONTH", 3)
+    step = compact_in_steps(0, 4)  # two parts in each month
+    real = getattr(logstore, crash_in)
+
+    journal = os.path.join(logstore.store_dir(), "month=2024-01", "_merge")
+
+    def crash(*args):
+        if os.path.exists(journal):
+            raise KeyboardInterrupt
+        return real(*args)
+    monkeypatch.setattr(logstore, crash_in, crash)
+    with pytest.raises(KeyboardInterrupt):
+        compact_in_steps(step, 1)
+    monkeypatch.setattr(logstore, crash_in, real)
+
+    step = compact_in_steps(step + 1, 1)
+    assert count_rows(open_dataset()) == step
+    assert "_merge" not in stored_parts()
+    assert not [p for p in stored_parts() if p.startswith(".")]
+
+
+def test_repeated_merges_keep_every_row(base_dir, monkeypatch):
+    monkeypatch.setattr(logstore, "MAX_PARTS_PER_MONTH", 3)
+    compact_in_steps(0, 12)
+    assert count_rows(open_dataset()) == 12
+    assert any(".m2." in p for p in stored_parts())
+
+
+def test_compaction_waits_for_the_store_lock(base_dir):
+    append_log(log_lines(0, 3))
+    with logstore._store_lock():
+        other = threading.Thread(target=compact_log)
+        other.start()
+        other.join(0.5)
+        assert other.is_alive()
+    other.join(5)
+    assert count_rows(open_dataset()) == 3
+
+
+def test_write_csv_leaves_only_the_export(tmp_path, base_dir):
+    append_log(log_lines(0, 3))
+    exports = tmp_path / "exports"
+    exports.mkdir()
+    path = write_csv(open_dataset(), str(exports / "log.csv"))
+    assert [p.name for p in exports.iterdir()] == ["log.csv"]
+    with open(path, encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 4  # header and three rows
@@ -0,0 +1,139 @@
+import io
+import os
+from contextlib import closing
+
+import pytest
+
+from smartfolder import index, organizer, sniff
+from smartfolder.index import legacy_md5, open_index
+from smartfolder.organizer import (
+    ingest_uploads, move_existing_files, save_attachments
+)
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Paths file_hash() is called on, in order."""
+    calls = []
+    file_hash = index.file_hash
+
+    def counting(path, *args):
+        calls.append(os.path.basename(path))
+        return file_hash(path, *args)
+    monkeypatch.setattr(index, "file_hash", counting)
+    return calls
+
+
+def write(folder, name, data):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), "wb") as f:
+        f.write(data)
+
+
+def test_files_are_hashed_once(tmp_path, base_dir, hashed):
+    downloads = str(tmp_path / "Downloads")
+    write(downloads, "new.pdf", b"%PDF-1.7\nnew")
+    write(downloads, "copy.pdf", b"%PDF-1.7\nnew")
+    write(downloads, "other.pdf", b"%PDF-1.7\nother")
+    moved = move_existing_files(downloads)
+    # One of the two copies is moved, whichever is seen first.
+    assert len(moved) == 2
+    assert sorted(os.listdir(downloads)) in (["copy.pdf"], ["new.pdf"])
+    assert sorted(hashed) == ["copy.pdf", "new.pdf", "other.pdf"]
+
+    # The duplicate left behind is recognised from the stat cache.
+    hashed.clear()
+    assert move_existing_files(downloads) == []
+    assert hashed == []
+
+
+def test_files_that_are_not_documents_are_sniffed_once(
+        tmp_path, base_dir, monkeypatch):
+    sniffed = []
+    real_sniff = sniff.sniff
+
+    def counting(source):
+        if isinstance(source, str):
+            sniffed.append(os.path.basename(source))
+        return real_sniff(source)
+    monkeypatch.setattr(sniff, "sniff", counting)
+    downloads = str(tmp_path / "Downloads")
+    write(downloads, "photo", b"\x89PNG\r\n")
+    write(downloads, "scan", b"%PDF-1.7\nscan")
+    assert [os.path.basename(p) for p in move_existing_files(downloads)] == [
+        "scan.pdf"
+    ]
+    assert sniffed.count("photo") == 1
+
+    sniffed.clear()
+    assert move_existing_files(downloads) == []
+    assert sniffed == []
+
+    write(downloads, "photo", b"\x89PNG\r\n changed")
+    move_existing_files(downloads)
+    assert sniffed == ["photo"]
+
+
+def test_content_logged_before_a_hash_algorithm_switch_is_known(
+        tmp_path, configure):
+    downloads = str(tmp_path / "Downloads")
+    write(downloads, "a.pdf", b"%PDF-1.7\nold")
+    assert len(move_existing_files(downloads)) == 1
+
+    configure(hash_algorithm="blake2b")
+    write(downloads, "a.pdf", b"%PDF-1.7\nold")
+    assert move_existing_files(downloads) == []
+    assert save_attachments([("a.pdf", b"%PDF-1.7\nold", "x@y.z")]) == []
+    assert [r["status"] for r in ingest_uploads([
+        ("a.pdf", io.BytesIO(b"%PDF-1.7\nold")),
+        ("b.pdf", io.BytesIO(b"%PDF-1.7\nnew")),
+    ])] == ["duplicate", "saved"]
+    with closing(open_index()) as conn:
+        assert legacy_md5(conn)
+
+
+def test_md5_is_not_checked_without_md5_entries(tmp_path, configure, hashed):
+    configure(hash_algorithm="blake2b")
+    downloads = str(tmp_path / "Downloads")
+    write(downloads, "a.pdf", b"%PDF-1.7\nnew")
+    assert len(move_existing_files(downloads)) == 1
+    assert hashed == ["a.pdf"]
+    with closing(open_index()) as conn:
+        assert not legacy_md5(conn)
+
+
+def uploads(*names):
+    return [
+        (name, io.BytesIO(b"%PDF-1.7\n" + name.encode())) for name in names
+    ]
+
+
+def statuses(results):
+    return [r["status"] for r in results]
+
+
+def test_uploads_are_deduplicated_within_and_across_batches(base_dir):
+    batch = uploads("a.pdf", "b.pdf") + [
+        ("copy.pdf", io.BytesIO(b"%PDF-1.7\na.pdf"))
+    ]
+    assert statuses(ingest_uploads(batch)) == ["saved", "saved", "duplicate"]
+    assert statuses(ingest_uploads(uploads("b.pdf", "c.pdf"))) == [
+        "duplicate", "saved"
+    ]
+
+
+def test_failed_upload_batch_gives_its_claims_back(base_dir, monkeypatch):
+    typed = organizer._typed
+
+    def fail_on_boom(conn, digest, name, source):
+        if name == "boom.pdf":
+            raise OSError("database is locked")
+        return typed(conn, digest, name, source)
+    monkeypatch.setattr(organizer, "_typed", fail_on_boom)
+    with pytest.raises(OSError):
+        ingest_uploads(uploads("boom.pdf", "later.pdf"))
+    monkeypatch.undo()
+
+    assert statuses(ingest_uploads(uploads("boom.pdf", "later.pdf"))) == [
+        "saved", "saved"
+    ]
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from smartfolder.rules import compile_rules
+
+
+def rules(*specs, **settings):
+    return compile_rules({"rules": list(specs), **settings})
+
+
+def test_first_matching_rule_wins():
+    ruleset = rules(
+        {"extensions": ["pdf"], "filename": "(?i)invoice",
+         "destination": "Invoices/{year}"},
+        {"extensions": [".pdf"], "senders": ["*@client.com"],
+         "destination": "Clients/{sender}"},
+        {"min_size": 1000, "destination": "Large"},
+    )
+    assert ruleset.match("Invoice-7.pdf", ".pdf", 10).index == 0
+    assert ruleset.match("notes.pdf", ".pdf", 10, "a@client.com").index == 1
+    assert ruleset.match("notes.pdf", ".pdf", 10, "a@other.com") is None
+    assert ruleset.match("notes.pdf", ".pdf", 5000).index == 2
+    assert ruleset.match("sheet.xlsx", ".xlsx", 5000).index == 2
+
+
+def test_place_fills_templates_and_defaults_to_the_category(configure):
+    ruleset = rules(
+        {"extensions": [".pdf"], "senders": ["*@client.com"],
+         "destination": "../Clients/{sender}",
+         "name_template": "{type}-{name}"},
+        naming_convention="ProjectName-Type", folder_prefix="Mail/",
+    )
+    assert ruleset.place("q3.pdf", ".pdf", 10, "a@client.com") == (
+        os.path.join("Mail", "Clients", "a@client.com"), "PDF-q3.pdf"
+    )
+    assert ruleset.place("q3.docx", ".docx", 10) == (
+        os.path.join("Mail", "WordDocs"), "q3-DOCX.docx"
+    )
+
+
+def test_sender_filter_and_skip_rules_place_nothing():
+    ruleset = rules(
+        {"extensions": [".pdf"], "max_size": 100, "skip": True},
+        sender_filter=["*@example.com"],
+    )
+    assert ruleset.place("a.pdf", ".pdf", 500, "me@other.org") is None
+    assert ruleset.place("a.pdf", ".pdf", 50, "me@example.com") is None
+    assert ruleset.place("a.pdf", ".pdf", 500, "me@example.com")
+    # Files that did not come by email are not filtered by sender.
+    assert ruleset.place("a.pdf", ".pdf", 500)
+    assert ruleset.accepts_sender("me@example.com")
+    assert not ruleset.accepts_sender("me@other.org")
+
+
+@pytest.mark.parametrize("size_range, skipped", [
+    ((10, 90), True),      # inside the skip rule
+    ((90, 110), False),    # may be over its limit
+    ((200, 300), False),
+])
+def test_skips_only_when_every_size_in_the_range_is_skipped(
+        size_range, skipped):
+    ruleset = rules({"extensions": [".pdf"], "max_size": 100, "skip": True})
+    assert ruleset.skips("a.pdf", ".pdf", *size_range) is skipped
+
+
+def test_skips_respects_earlier_rules_that_place_files():
+    ruleset = rules(
+        {"extensions": [".pdf"], "min_size": 40, "max_size": 60,
+         "destination": "Mid"},
+        {"extensions": [".pdf"], "skip": True},
+    )
+    assert ruleset.skips("a.pdf", ".pdf", 0, 30)
+    # A size between the bounds goes to the first rule.
+    assert not ruleset.skips("a.pdf", ".pdf", 0, 100)
+    assert not ruleset.skips("a.pdf", ".pdf", 50, 50)
+    assert rules(sender_filter=["x@y.z"]).skips("a.pdf", ".pdf", 0, 9, "q@r.s")
@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+from smartfolder import sync
+
+
+def wait_until_idle(timeout=5):
+    deadline = time.monotonic() + timeout
+    while sync.is_running():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_start_run_sorts_in_the_background(configure, monkeypatch, tmp_path):
+    configure()
+    release = threading.Event()
+
+    def move_existing_files(folder, max_depth=None, excludes=None,
+                            progress=None):
+        release.wait(5)
+        logging.getLogger("smartfolder.organizer").warning("Skipped %s", "a")
+        return [folder]
+    monkeypatch.setattr(sync, "move_existing_files", move_existing_files)
+
+    folder = str(tmp_path / "Downloads")
+    assert sync.start_run(email=False, folders=[folder])
+    assert sync.is_running()
+    # A second click while the first run is going starts nothing.
+    assert not sync.start_run(email=False, folders=[folder])
+
+    release.set()
+    wait_until_idle()
+    status = sync.read_status()
+    assert status["jobs"] == {folder: {"files": 1}}
+    assert status["messages"] == [{"level": "WARNING", "message": "Skipped a"}]
+
+
+def test_sort_progress_is_kept_in_the_status(configure, monkeypatch, tmp_path):
+    configure()
+    sync.write_status({"finished": "earlier", "jobs": {}})
+    reported = threading.Event()
+    release = threading.Event()
+
+    def move_existing_files(folder, max_depth=None, excludes=None,
+                            progress=None):
+        progress(64, 10)
+        reported.set()
+        release.wait(5)
+        progress(100, 12)
+        return [folder] * 12
+    monkeypatch.setattr(sync, "move_existing_files", move_existing_files)
+
+    folder = str(tmp_path / "Downloads")
+    assert sync.start_run(email=False, folders=[folder])
+    assert reported.wait(5)
+    status = sync.read_status()
+    assert status["progress"] == {folder: {"seen": 64, "moved": 10}}
+    # The last finished run is still shown meanwhile.
+    assert status["finished"] == "earlier"
+
+    release.set()
+    wait_until_idle()
+    status = sync.read_status()
+    assert "progress" not in status
+    assert status["jobs"] == {folder: {"files": 12}}
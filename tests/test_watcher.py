@@ -0,0 +1,78 @@
+import glob
+import os
+import sys
+import time
+
+import pytest
+
+from smartfolder import config
+from smartfolder.watcher import FolderWatcher
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="uses inotify"
+)
+
+PDF = b"%PDF-1.7\n" + b"x" * 4096
+
+
+@pytest.fixture
+def downloads(tmp_path, base_dir):
+    folder = tmp_path / "Downloads"
+    folder.mkdir()
+    watcher = FolderWatcher([str(folder)], settle=0.5, initial_scan=False)
+    watcher.start()
+    yield folder
+    watcher.stop()
+
+
+def sorted_files(count, timeout=5):
+    """Names filed into BASE_DIR once count have arrived (or timeout)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        paths = glob.glob(os.path.join(config.BASE_DIR, "*", "*.pdf"))
+        if len(paths) >= count or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    time.sleep(0.7)  # anything filed late, e.g. a second copy
+    return sorted(
+        os.path.basename(p)
+        for p in glob.glob(os.path.join(config.BASE_DIR, "*", "*.pdf"))
+    )
+
+
+def logged():
+    with open(config.LOG_FILE, encoding="utf-8") as f:
+        return [line.split("\t")[2] for line in f]
+
+
+def test_placeholder_replaced_by_the_download_is_sorted_once(downloads):
+    # Firefox: an empty placeholder under the final name, then the
+    # finished .part file renamed over it.
+    (downloads / "report.pdf").write_bytes(b"")
+    (downloads / "report.pdf.part").write_bytes(PDF[:100])
+    time.sleep(0.2)
+    with open(downloads / "report.pdf.part", "ab") as f:
+        f.write(PDF[100:])
+    os.replace(downloads / "report.pdf.part", downloads / "report.pdf")
+    assert sorted_files(1) == ["report.pdf"]
+    assert logged() == ["report.pdf"]
+    assert os.listdir(downloads) == []
+
+
+@pytest.mark.parametrize("partial", ["report.pdf.part", "f1e2.crdownload"])
+def test_partial_download_is_sorted_when_renamed(downloads, partial):
+    with open(downloads / partial, "wb") as f:
+        f.write(PDF[:100])
+        f.flush()
+        time.sleep(0.7)  # longer than settle: still not sorted
+        f.write(PDF[100:])
+    assert sorted_files(0, timeout=0) == []
+    os.replace(downloads / partial, downloads / "report.pdf")
+    assert sorted_files(1) == ["report.pdf"]
+    assert logged() == ["report.pdf"]
+
+
+def test_empty_files_are_left_alone(downloads):
+    (downloads / "empty.pdf").write_bytes(b"")
+    assert sorted_files(1, timeout=1) == []
+    assert os.listdir(downloads) == ["empty.pdf"]